@@ -10,20 +10,29 @@ conversation.
 import copy
 import numpy as np
 
-from chatbotQuery.conversation.conversation_utils import BaseDetector
+from chatbotQuery.conversation.conversation_utils import BaseDetector,\
+    AsyncDetector
 from chatbotQuery.conversation.conversation_utils import BaseQuerier,\
-    NullQuerier
+    NullQuerier, AsyncQuerier
+from chatbotQuery.conversation.conversation_utils import run_in_executor
 from chatbotQuery.conversation.conversation_utils import RandomChooser,\
     QuerierSizeDrivenChooser, QuerierSplitterChooser, SequentialChooser,\
     NullChooser, BaseChooser
 from chatbotQuery.conversation.conversation_utils import\
     NullTransitionConversation, TransitionConversationStates
 from chatbotQuery.conversation.conversation_utils import flatten_1lvl
+from chatbotQuery.conversation.conversation_runtime import\
+    ConversationRuntime, NamesVocabulary, RuntimeField, RuntimeNameField,\
+    attach_runtime, bind_runtime, bound_runtime
 from chatbotQuery import ChatbotMessage
 
 
 class BaseConversationState(object):
 
+    ## Per-session fields
+    next_state = RuntimeNameField('next_state')
+    runned = RuntimeField('runned')
+
     def __init__(self, name, transition, endstates=None, shadow=True,
                  test_mode=False):
         self.name = name
@@ -98,6 +107,10 @@ class BaseConversationState(object):
     def _compute_next(self, message, sonparentstate=None):
         self.next_state = self.next(message, sonparentstate)
 
+    async def aget_message(self, handler_db, message):
+        """Asynchronous `get_message` (run in an executor by default)."""
+        return await run_in_executor(self.get_message, handler_db, message)
+
 #    def _if_sent(self, message):
 #        ifsent = False
 #        if 'sending_status' in message:
@@ -167,6 +180,10 @@ class GeneralConversationState(BaseConversationState):
                     'shadow': False, 'running_times': np.inf,
                     'test_mode': False}
 
+    ## Per-session fields
+    counts = RuntimeField('counts')
+    flag_question_answer = RuntimeField('flag_question_answer')
+
     def __init__(self, name, detector=None, chooser=None, querier=None,
                  transition=None, asker=True, tags=None, shadow=False,
                  running_times=np.inf, test_mode=False):
@@ -175,11 +192,6 @@ class GeneralConversationState(BaseConversationState):
         self.detector = BaseDetector.from_detector_info(detector)
         self.chooser = BaseChooser.from_chooser_info(chooser)
         self.querier = BaseQuerier.from_querier_info(querier)
-        # Store initial configuration
-        self.initializers = {'transition': self.transition,
-                             'detector': self.detector,
-                             'chooser': self.chooser,
-                             'querier': self.querier}
         # Enrichment information
         self.tags = self._format_tags(tags)
         ## Asker or answerer
@@ -197,16 +209,40 @@ class GeneralConversationState(BaseConversationState):
         self.accumulate_states = [self]
 
     def get_message(self, handler_db, message):
-        message = ChatbotMessage.from_message(message)
+        message = self._start_turn(message)
         if self.flag_question_answer == 0:
-            answer = self._answer_message(handler_db, message)
-            self._manage_next_state(answer)
-        elif self.flag_question_answer == 1:
-            answer = self._process_message(message)
-            self._manage_next_state(answer)
+            ## 0. Make query
+            message = self.querier.make_query(handler_db, message)
+        else:
+            ## 1. Process answer
+            message = self.detector.detect(message)
+        return self._end_turn(handler_db, message)
+
+    async def aget_message(self, handler_db, message):
+        """Asynchronous `get_message`, awaiting the querier and the
+        detector.
+        """
+        message = self._start_turn(message)
+        if self.flag_question_answer == 0:
+            message = await self.querier.amake_query(handler_db, message)
         else:
+            message = await self.detector.adetect(message)
+        return self._end_turn(handler_db, message)
+
+    def _start_turn(self, message):
+        message = ChatbotMessage.from_message(message)
+        if self.flag_question_answer not in [0, 1]:
             # It should be added as an end state
             raise Exception("End of conversation!")
+        return message
+
+    def _end_turn(self, handler_db, message):
+        ## Answer of the queried message or tagged detected message
+        if self.flag_question_answer == 0:
+            answer = self._format_answer(handler_db, message)
+        else:
+            answer = self._add_tags(message)
+        self._manage_next_state(answer)
         assert(isinstance(answer, dict))
         return answer
 
@@ -238,9 +274,7 @@ class GeneralConversationState(BaseConversationState):
         else:
             self.flag_question_answer = int(abs(self.flag_question_answer-1))
 
-    def _answer_message(self, handler_db, message):
-        ## 0. Make query
-        message = self.querier.make_query(handler_db, message)
+    def _format_answer(self, handler_db, message):
         ## 0b. Preformat message
         ## 1. Choose Answer
         message = copy.copy(self.chooser.choose(message))
@@ -278,13 +312,6 @@ class GeneralConversationState(BaseConversationState):
         message = message.format_message(formatting_tags)
         return message
 
-    def _process_message(self, message):
-        ## 1. Process answer
-        message = self.detector.detect(message)
-        ## 2. Add tags
-        message = self._add_tags(message)
-        return message
-
     def _detect_message_sending_status(self, message):
         if 'sending_status' in message:
             return message['sending_status']
@@ -326,18 +353,18 @@ class GeneralConversationState(BaseConversationState):
 
     def restart(self):
         """Reset the properties of the state to go back to the initial
-        moment.
+        moment. The core components are not mutated by the conversation,
+        so only the per-session fields (and the chooser position) are
+        reset: from the initial runtime of the machine once compiled.
         """
-        # Initial core components
-        self.transition = TransitionConversationStates.\
-            from_transition_info(self.initializers['transition'])
-        self.transition.set_current_state(self)
-        self.detector =\
-            BaseDetector.from_detector_info(self.initializers['detector'])
-        self.chooser =\
-            BaseChooser.from_chooser_info(self.initializers['chooser'])
-        self.querier =\
-            BaseQuerier.from_querier_info(self.initializers['querier'])
+        slot = self.__dict__.get('_runtime_slot')
+        if (slot is not None) and slot[0].setted:
+            slot[0].reset_runtime([slot[1]])
+            return
+        self.chooser.times_used = 0
+        self.counts = 0
+        self.runned = False
+        self.next_state = self.name
         # Asking state class
         if self.asker:
             self.flag_question_answer = 0
@@ -352,6 +379,10 @@ class ConversationStateMachine(BaseConversationState):
     required_pars = ('name', 'states', 'startState', 'endStates')
     default_pars = {'transition': None}
 
+    ## Per-session fields
+    flag_question_answer = RuntimeField('flag_question_answer')
+    NotEnter = RuntimeField('not_enter')
+
     def __init__(self, name, states, startState, endStates, transition=None,
                  test_mode=False):
         ## Managing states
@@ -462,19 +493,162 @@ class ConversationStateMachine(BaseConversationState):
                                      s.abspathname))
         self.all_endit = dict(all_endit)
         self.all_endit.update({self.abspathname: self.abspathname})
+        self._compile_machine()
 
         self.currentState = self.get_initial_state()
         self.historyStates = [self.currentState]
+        self.initial_runtime = self.runtime.copy()
         self.setted = True
 #        x_states = {}
 #        for s in all_states:
 #            if isinstance(s, ConversationStateMachine):
 #                x_states[s.abspathname] = (s.startState, s.initial_endStates)
 
+    def _compile_machine(self):
+        """Flat table of the states indexed by integer ids, so the next
+        bottom state is resolved with a few array lookups instead of
+        walking the dotted path names on every turn:
+
+        * states_table: state of each id.
+        * start_table: initial bottom state of each state machine.
+        * parent_table: state machine whose transition is computed when
+          the bottom state ends (-1 for the global end and -2 if it is not
+          a state of the machine).
+        * son_table: state of the bottom state which is son of that parent.
+        * next_table: ids of the sibling states by their names.
+
+        The per-session fields of the states (and of their choosers) are
+        moved to the rows of their ids of a `ConversationRuntime`.
+        """
+        paths = list(self.all_states_d.keys())
+        n_states = len(paths)
+        self.states_index = dict(zip(paths, range(n_states)))
+        self.states_table = [self.all_states_d[p] for p in paths]
+        self.start_table = -np.ones(n_states, dtype=np.int32)
+        self.parent_table = -np.ones(n_states, dtype=np.int32)
+        self.son_table = -np.ones(n_states, dtype=np.int32)
+        siblings = {}
+        for i, path in enumerate(paths):
+            state = self.states_table[i]
+            if isinstance(state, ConversationStateMachine):
+                try:
+                    self.start_table[i] =\
+                        self.states_index[self._walk_initial_state(path)]
+                except KeyError:
+                    pass
+            elif isinstance(state, GeneralConversationState):
+                parent = self._get_parentState_transitioner(path)
+                if parent is not None:
+                    son = self._get_son_of_parentstate_transitioner(path,
+                                                                    parent)
+                    self.parent_table[i] = self.states_index.get(parent, -2)
+                    self.son_table[i] = self.states_index.get(son, -2)
+            ## Siblings by their names and their path names
+            names = siblings.setdefault('.'.join(path.split('.')[:-1]), {})
+            names[path.split('.')[-1]] = i
+            names.setdefault(state.name, i)
+        self.next_table = [siblings['.'.join(p.split('.')[:-1])]
+                           for p in paths]
+        self.root_id = self.states_index[self.abspathname]
+        ## Per-session fields
+        if 'state_names' not in self.__dict__:
+            self.state_names = NamesVocabulary()
+        for state in self.states_table:
+            self.state_names.code(state.name)
+        runtime = ConversationRuntime.empty(self, n_states)
+        for i, state in enumerate(self.states_table):
+            attach_runtime(state, self, i, runtime)
+            if isinstance(state, GeneralConversationState):
+                attach_runtime(state.chooser, self, i, runtime)
+        self.runtime = runtime
+
+    def new_runtime(self, seed=None):
+        """Runtime of a new session of the machine, with its own random
+        generator.
+        """
+        assert(self.setted)
+        runtime = self.initial_runtime.copy()
+        runtime.random_state = np.random.default_rng(seed)
+        return runtime
+
+    def restore_runtime(self, blob):
+        """Runtime of a session from its `ConversationRuntime.snapshot`."""
+        assert(self.setted)
+        return ConversationRuntime.restore(self, blob)
+
+    def bind(self, runtime):
+        """Context in which the machine uses the session `runtime`."""
+        assert(runtime.machine is self)
+        return bind_runtime(runtime)
+
+    def _session_runtime(self):
+        if self.__dict__.get('runtime') is None:
+            return None
+        return bound_runtime(self)
+
+    @property
+    def currentState(self):
+        runtime = self._session_runtime()
+        if runtime is None:
+            return self.__dict__['_currentState']
+        return self._state_path(runtime.current)
+
+    @currentState.setter
+    def currentState(self, state):
+        runtime = self._session_runtime()
+        if runtime is None:
+            self.__dict__['_currentState'] = state
+        else:
+            runtime.current = self._state_id(state)
+
+    @property
+    def historyStates(self):
+        runtime = self._session_runtime()
+        if runtime is None:
+            return self.__dict__['_historyStates']
+        return [self._state_path(i) for i in runtime.history]
+
+    @historyStates.setter
+    def historyStates(self, states):
+        runtime = self._session_runtime()
+        if runtime is None:
+            self.__dict__['_historyStates'] = states
+        else:
+            runtime.history = type(runtime.history)(
+                'i', [self._state_id(s) for s in states])
+
+    def _state_path(self, i):
+        if i < 0:
+            return None
+        return self.states_table[i].abspathname
+
+    def _state_id(self, path):
+        if path is None:
+            return -1
+        return self.states_index[path]
+
+    def _next_state_id(self, i, name):
+        ## Id of the sibling state `name` of the state `i`
+        ids = self.next_table[i]
+        if name in ids:
+            return ids[name]
+        return ids[self._pathname_formatter(name)]
+
+    def _start_state_id(self, i):
+        start = self.start_table[i]
+        if start < 0:
+            raise KeyError(self.states_table[i].abspathname)
+        return start
+
     def get_initial_state(self, name=''):
-#        name = self._pathname_formatter(name)
         if not name:
             name = self._pathname_formatter(self.name)
+        i = getattr(self, 'states_index', {}).get(name)
+        if (i is None) or (self.start_table[i] < 0):
+            return self._walk_initial_state(name)
+        return self.states_table[self.start_table[i]].abspathname
+
+    def _walk_initial_state(self, name):
         while True:
             new_name = self.all_init[name]
             name = '.'.join([name, new_name])
@@ -482,52 +656,74 @@ class ConversationStateMachine(BaseConversationState):
                 break
         return name
 
-    def get_message(self, handler_db, message):
+    def get_message(self, handler_db, message, runtime=None):
         assert(self.setted)
+        if runtime is not None:
+            with self.bind(runtime):
+                return self.get_message(handler_db, message)
         current_state = self.all_states_d[self.currentState]
         while not self.message_prepared(message):
             message = current_state.get_message(handler_db, message)
-            current_state = self.manage_next_state(current_state, message)
-            self.track_evolution(current_state)
+            current_state = self._next_turn_state(current_state, message)
             if current_state is None:
-                self.runned = True
-                self.NotEnter = True
                 break
         return message
 
+    async def aget_message(self, handler_db, message, runtime=None):
+        """Asynchronous `get_message`: the states await their queriers
+        and detectors, so an event loop can run many conversations.
+        """
+        assert(self.setted)
+        if runtime is not None:
+            with self.bind(runtime):
+                return await self.aget_message(handler_db, message)
+        current_state = self.all_states_d[self.currentState]
+        while not self.message_prepared(message):
+            message = await current_state.aget_message(handler_db, message)
+            current_state = self._next_turn_state(current_state, message)
+            if current_state is None:
+                break
+        return message
+
+    def _next_turn_state(self, current_state, message):
+        current_state = self.manage_next_state(current_state, message)
+        self.track_evolution(current_state)
+        if current_state is None:
+            self.runned = True
+            self.NotEnter = True
+        return current_state
+
     def manage_next_state(self, currentstate, message):
         next_state = currentstate.next_state
+        i = self.states_index[currentstate.abspathname]
         if next_state is None:
             ## Transition between 1 ended bottom and 1 initial bottom states
             ########## Dealing with multiple transition functions ##########
-            currentstatepath = currentstate.abspathname
-            parentstate = self._get_parentState_transitioner(currentstatepath)
+            parent = self.parent_table[i]
             # Global ending state Case
-            if parentstate is None:
+            if parent == -1:
                 return None
-            sonparentstate =\
-                self._get_son_of_parentstate_transitioner(currentstatepath,
-                                                          parentstate)
+            elif parent < 0:
+                raise KeyError(currentstate.abspathname)
+            parentstate = self.states_table[parent]
+            sonparentstate = self.states_table[self.son_table[i]].abspathname
             # Get the next top parent state
-            self.all_states_d[parentstate]._compute_next(message,
-                                                         sonparentstate)
-            self.all_states_d[parentstate].runned = True
-            next_parent = self.all_states_d[parentstate].next_state
+            parentstate._compute_next(message, sonparentstate)
+            parentstate.runned = True
+            next_parent = parentstate.next_state
             # Global ending state Case
             if next_parent is None:
                 return None
             # Get buttom initial state
             if next_parent != self.abspathname:
-                next_parent =\
-                    '.'.join([self.all_states_d[parentstate].parentState,
-                              self._pathname_formatter(next_parent)])
-            next_state = self.get_initial_state(next_parent)
-            currentstate = self.all_states_d[next_state]
+                j = self._next_state_id(parent, next_parent)
+            else:
+                j = self.root_id
+            currentstate = self.states_table[self._start_state_id(j)]
         else:
             ## Normal transition between two bottom states
-            next_state = '.'.join([currentstate.parentState,
-                                   self._pathname_formatter(next_state)])
-            currentstate = self.all_states_d[next_state]
+            currentstate = self.states_table[self._next_state_id(i,
+                                                                 next_state)]
         ## Manage not enter states
         if currentstate.NotEnter:
             currentstate = None
@@ -548,11 +744,12 @@ class ConversationStateMachine(BaseConversationState):
         return self._get_parentState_transitioner(parentname)
 
     def track_evolution(self, currentstate):
+        runtime = bound_runtime(self)
         if currentstate is None:
-            self.currentState = None
+            runtime.current = -1
         else:
-            self.currentState = currentstate.abspathname
-        self.historyStates.append(self.currentState)
+            runtime.current = self.states_index[currentstate.abspathname]
+        runtime.history.append(runtime.current)
 
     def accumulate_states_f(self):
         def flatten(container):
@@ -567,11 +764,29 @@ class ConversationStateMachine(BaseConversationState):
         return list(flatten(l))
 
     def restart(self):
-        self.set_machine()
-#        self.currentState = self.get_initial_state()
+        """Go back to the initial moment of the conversation. Once the
+        machine is set, only the per-session fields of the runtime in use
+        are copied from the initial runtime (for all the session or for
+        the rows of the states of a nested machine).
+        """
         self.endStates = self.initial_endStates
-        self.historyStates = [self.startState]
-        [self.states[s].restart() for s in self.states]
+        slot = self.__dict__.get('_runtime_slot')
+        if (slot is None) or (not slot[0].setted):
+            ## Not compiled: the states reset their own fields before the
+            ## initial runtime is taken
+            [self.states[s].restart() for s in self.states]
+            self.set_machine()
+        elif slot[0] is self:
+            self.reset_runtime()
+        else:
+            slot[0].reset_runtime([s.__dict__['_runtime_slot'][1]
+                                   for s in self.accumulate_states])
+
+    def reset_runtime(self, ids=None):
+        """Reset the rows `ids` of the runtime in use (or all the session
+        if None) to their initial values.
+        """
+        bound_runtime(self).reset(self.initial_runtime, ids)
 
     def _ensure_correct_message(self, message):
         logi = True
@@ -0,0 +1,281 @@
+"""
+Conversation runtime
+--------------------
+Per-session state of a compiled `ConversationStateMachine`. The machine and
+its states only keep the definition of the conversation, which can be shared
+by all the sessions, while the fields that change during a conversation are
+stored in a `ConversationRuntime`: a record array with a row per state plus
+the current state and the history of the session.
+
+The states access their fields through `RuntimeField` descriptors, which
+read the runtime bound to the current context (or the default runtime of
+the machine if none is bound). Before the machine is compiled the fields
+are stored as plain attributes of the states.
+
+A runtime is serialized by `snapshot` to a compact binary blob (a header,
+the raw record array, the history and the state of its random generator),
+so a session can be stored between turns and restored by any worker.
+
+"""
+
+import struct
+import threading
+import contextvars
+import numpy as np
+from array import array
+from contextlib import contextmanager
+
+RUNTIME_DTYPE = np.dtype([('counts', np.int64), ('times_used', np.int64),
+                          ('next_state', np.int32),
+                          ('flag_question_answer', np.int8),
+                          ('runned', np.bool_), ('not_enter', np.bool_)])
+
+_bound_runtime = contextvars.ContextVar('conversation_runtime', default=None)
+
+## Magic, number of states, current state, history length, with generator
+SNAPSHOT_HEADER = struct.Struct('<4sIiI?')
+SNAPSHOT_MAGIC = b'CRT1'
+## PCG64 state and increment (128 bits each), has_uint32 and uinteger
+RANDOM_STATE = struct.Struct('<16s16s?I')
+
+
+class ConversationRuntime(object):
+    """Mutable state of a session of a compiled machine.
+
+    * table: record array (`RUNTIME_DTYPE`) with a row per state id.
+    * current: id of the current bottom state (-1 when ended).
+    * history: ids of the visited states (-1 for the end).
+    * random_state: `numpy.random.Generator` of the random choices of the
+      session (None to use the global numpy random state).
+    """
+
+    def __init__(self, machine, table, current=-1, history=(),
+                 random_state=None):
+        self.machine = machine
+        self.table = table
+        self.current = current
+        self.history = array('i', history)
+        self.random_state = random_state
+
+    @classmethod
+    def empty(cls, machine, n_states):
+        table = np.zeros(n_states, dtype=RUNTIME_DTYPE)
+        table['next_state'] = -1
+        return cls(machine, table)
+
+    def copy(self):
+        random_state = None
+        if self.random_state is not None:
+            random_state = np.random.Generator(np.random.PCG64())
+            random_state.bit_generator.state =\
+                self.random_state.bit_generator.state
+        return ConversationRuntime(self.machine, self.table.copy(),
+                                   self.current, self.history, random_state)
+
+    def reset(self, initial, ids=None):
+        """Copy the rows `ids` of the runtime `initial` (or all its fields
+        if None). The random generator of the session is kept.
+        """
+        if ids is None:
+            self.table[:] = initial.table
+            self.current = initial.current
+            self.history = array('i', initial.history)
+        else:
+            self.table[ids] = initial.table[ids]
+
+    def snapshot(self):
+        """Binary blob with the state of the session."""
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(self.table),
+                                      self.current, len(self.history),
+                                      self.random_state is not None)
+        blob = [header, self.table.tobytes(), self.history.tobytes()]
+        if self.random_state is not None:
+            blob.append(pack_random_state(self.random_state))
+        return b''.join(blob)
+
+    @classmethod
+    def restore(cls, machine, blob):
+        """Runtime of the machine from a blob built by `snapshot`."""
+        if len(blob) < SNAPSHOT_HEADER.size:
+            raise ValueError("Not a snapshot of this conversation machine.")
+        magic, n_states, current, n_history, with_random =\
+            SNAPSHOT_HEADER.unpack_from(blob)
+        size = SNAPSHOT_HEADER.size+n_states*RUNTIME_DTYPE.itemsize +\
+            n_history*array('i').itemsize +\
+            (RANDOM_STATE.size if with_random else 0)
+        if (magic != SNAPSHOT_MAGIC) or\
+                (n_states != len(machine.states_table)) or\
+                (len(blob) != size):
+            raise ValueError("Not a snapshot of this conversation machine.")
+        start = SNAPSHOT_HEADER.size
+        table = np.frombuffer(blob, dtype=RUNTIME_DTYPE, count=n_states,
+                              offset=start).copy()
+        start += table.nbytes
+        history = array('i')
+        history.frombytes(blob[start:start+n_history*history.itemsize])
+        start += n_history*history.itemsize
+        random_state = None
+        if with_random:
+            random_state = unpack_random_state(blob, start)
+        return cls(machine, table, current, history, random_state)
+
+    @property
+    def nbytes(self):
+        return (self.table.nbytes +
+                self.history.itemsize*len(self.history))
+
+
+def pack_random_state(random_state):
+    state = random_state.bit_generator.state
+    if state['bit_generator'] != 'PCG64':
+        raise ValueError("Only PCG64 generators are supported.")
+    return RANDOM_STATE.pack(state['state']['state'].to_bytes(16, 'little'),
+                             state['state']['inc'].to_bytes(16, 'little'),
+                             state['has_uint32'], state['uinteger'])
+
+
+def unpack_random_state(blob, offset=0):
+    state, inc, has_uint32, uinteger = RANDOM_STATE.unpack_from(blob, offset)
+    random_state = np.random.Generator(np.random.PCG64())
+    random_state.bit_generator.state =\
+        {'bit_generator': 'PCG64',
+         'state': {'state': int.from_bytes(state, 'little'),
+                   'inc': int.from_bytes(inc, 'little')},
+         'has_uint32': int(has_uint32), 'uinteger': uinteger}
+    return random_state
+
+
+def bound_runtime(machine):
+    """Runtime of the machine in the current context."""
+    runtime = _bound_runtime.get()
+    if (runtime is None) or (runtime.machine is not machine):
+        return machine.runtime
+    return runtime
+
+
+@contextmanager
+def bind_runtime(runtime):
+    """Use `runtime` as the session state of its machine in the context."""
+    token = _bound_runtime.set(runtime)
+    try:
+        yield runtime
+    finally:
+        _bound_runtime.reset(token)
+
+
+def random_integer(obj, high):
+    """Random integer in [0, high) drawn from the generator of the session
+    of the object (or from the global numpy random state).
+    """
+    slot = obj.__dict__.get('_runtime_slot')
+    if slot is not None:
+        random_state = bound_runtime(slot[0]).random_state
+        if random_state is not None:
+            return int(random_state.integers(high))
+    return np.random.randint(high)
+
+
+class RuntimeField(object):
+    """Per-session field stored in the column `column` of the runtime of the
+    machine to which the object has been attached (by `attach_runtime`).
+    """
+
+    def __init__(self, column):
+        self.column = column
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        slot = obj.__dict__.get('_runtime_slot')
+        if slot is None:
+            try:
+                return obj.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name)
+        machine, i = slot
+        value = bound_runtime(machine).table[self.column][i].item()
+        return self.decode(machine, value)
+
+    def __set__(self, obj, value):
+        slot = obj.__dict__.get('_runtime_slot')
+        if slot is None:
+            obj.__dict__[self.name] = value
+        else:
+            machine, i = slot
+            bound_runtime(machine).table[self.column][i] =\
+                self.encode(machine, value)
+
+    def decode(self, machine, value):
+        return value
+
+    def encode(self, machine, value):
+        return value
+
+
+class RuntimeNameField(RuntimeField):
+    """Field storing a state name (or None) by its code in the vocabulary of
+    names of the machine.
+    """
+
+    def decode(self, machine, value):
+        if value < 0:
+            return None
+        return machine.state_names.names[value]
+
+    def encode(self, machine, value):
+        if value is None:
+            return -1
+        return machine.state_names.code(value)
+
+
+class NamesVocabulary(object):
+    """Codes of the state names, extended with the unseen ones."""
+
+    def __init__(self, names=()):
+        self.names = []
+        self.codes = {}
+        self._lock = threading.Lock()
+        for name in names:
+            self.code(name)
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            with self._lock:
+                code = self.codes.setdefault(name, len(self.names))
+                if code == len(self.names):
+                    self.names.append(name)
+        return code
+
+
+def runtime_fields(obj):
+    """Runtime fields of an object by their attribute names."""
+    fields = {}
+    for cls in reversed(type(obj).__mro__):
+        for name, attr in vars(cls).items():
+            if isinstance(attr, RuntimeField):
+                fields[name] = attr
+            elif name in fields:
+                del fields[name]
+    return fields
+
+
+def attach_runtime(obj, machine, i, runtime):
+    """Store the current values of the runtime fields of `obj` in the row
+    `i` of `runtime` and attach it to the runtimes of the machine.
+    """
+    fields = runtime_fields(obj)
+    values = {}
+    for name in fields:
+        try:
+            values[name] = getattr(obj, name)
+        except AttributeError:
+            pass
+        obj.__dict__.pop(name, None)
+    obj.__dict__['_runtime_slot'] = (machine, i)
+    with bind_runtime(runtime):
+        for name, value in values.items():
+            setattr(obj, name, value)
@@ -1,11 +1,18 @@
 
 
 import copy
+import asyncio
+import inspect
+import functools
+import contextvars
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 from functools import wraps
 from chatbotQuery import ChatbotMessage
 from chatbotQuery.io import chooser_io, parse_parameter_functions
+from chatbotQuery.conversation.conversation_runtime import RuntimeField,\
+    random_integer
 
 
 def formatting_store_detection(func):
@@ -48,6 +55,33 @@ def formatting_base_response(func):
     return function_wrapped
 
 
+async def run_in_executor(func, *args):
+    """Run a blocking function in the default executor of the running loop
+    with a copy of the current context (so it keeps the bound runtime of
+    the session).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run,
+                                                              func, *args))
+
+
+def run_coroutine(func, *args):
+    """Run the coroutine function from synchronous code. Inside a running
+    event loop, where `asyncio.run` is not allowed, it runs in the loop of
+    a worker thread (with a copy of the current context) while the caller
+    waits for it.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(func(*args))
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(context.run, lambda: asyncio.run(func(*args))).\
+            result()
+
+
 ################################## Detection ##################################
 ###############################################################################
 class BaseDetector(object):
@@ -72,20 +106,47 @@ class BaseDetector(object):
             pos_types = detector_info['pos_types']
             detector_f =\
                 parse_parameter_functions(detector_info['detector_function'])
+            if inspect.iscoroutinefunction(detector_f):
+                return AsyncDetector(pos_types=pos_types, detector=detector_f)
             return cls(pos_types=pos_types, detector=detector_f)
         else:
             assert(isinstance(detector_info, BaseDetector))
-            return cls(pos_types=detector_info.pos_types,
-                       detector=detector_info.detector)
+            return type(detector_info)(pos_types=detector_info.pos_types,
+                                       detector=detector_info.detector)
 
     @formatting_store_detection
     def detect(self, answer):
         probabilities = self.detector(answer)
+        return self._selector_types(probabilities)
+
+    async def adetect(self, answer):
+        """Detection of the asynchronous conversation turns: the detector
+        is run in an executor (unless there is nothing to detect).
+        """
+        if not self.pos_types:
+            return self.detect(answer)
+        return await run_in_executor(self.detect, answer)
+
+    def _selector_types(self, probabilities):
         assert(len(probabilities) == len(self.pos_types))
         selector_types = dict(zip(self.pos_types, probabilities))
         return selector_types
 
 
+class AsyncDetector(BaseDetector):
+    """Detector with a coroutine function `detector`, awaited in the
+    asynchronous conversation turns.
+    """
+
+    def detect(self, answer):
+        return run_coroutine(self.adetect, answer)
+
+    async def adetect(self, answer):
+        assert(isinstance(answer, ChatbotMessage))
+        probabilities = await self.detector(answer)
+        return answer.add_selector_types(self._selector_types(probabilities))
+
+
 ################################### Querier ###################################
 ###############################################################################
 class BaseQuerier(object):
@@ -99,10 +160,14 @@ class BaseQuerier(object):
         if querier_info is None:
             return NullQuerier()
         elif callable(querier_info):
+            if inspect.iscoroutinefunction(querier_info):
+                return AsyncQuerier(querier_info)
             return cls(querier_info)
         elif type(querier_info) == dict:
             querier_f =\
                 parse_parameter_functions(querier_info['querier_function'])
+            if inspect.iscoroutinefunction(querier_f):
+                return AsyncQuerier(querier=querier_f)
             return cls(querier=querier_f)
         else:
             assert(isinstance(querier_info, BaseQuerier))
@@ -110,6 +175,15 @@ class BaseQuerier(object):
 
     def make_query(self, handler_db, message):
         query_message = self.querier(handler_db, message)
+        return self._store_query(message, query_message)
+
+    async def amake_query(self, handler_db, message):
+        """Query of the asynchronous conversation turns: the blocking
+        querier is run in an executor.
+        """
+        return await run_in_executor(self.make_query, handler_db, message)
+
+    def _store_query(self, message, query_message):
         if isinstance(query_message, dict):
             if 'query' in query_message:
                 message.update(query_message)
@@ -119,6 +193,20 @@ class BaseQuerier(object):
         return message
 
 
+class AsyncQuerier(BaseQuerier):
+    """Querier with a coroutine function `querier`, awaited in the
+    asynchronous conversation turns so the event loop keeps running other
+    conversations while it waits for the database.
+    """
+
+    def make_query(self, handler_db, message):
+        return run_coroutine(self.amake_query, handler_db, message)
+
+    async def amake_query(self, handler_db, message):
+        query_message = await self.querier(handler_db, message)
+        return self._store_query(message, query_message)
+
+
 class NullQuerier(BaseQuerier):
 
     def __init__(self):
@@ -126,11 +214,17 @@ class NullQuerier(BaseQuerier):
             return None
         super().__init__(null_querier)
 
+    async def amake_query(self, handler_db, message):
+        return self.make_query(handler_db, message)
+
 
 ################################### Chooser ###################################
 ###############################################################################
 class BaseChooser(object):
 
+    ## Per-session fields
+    times_used = RuntimeField('times_used')
+
     @formatting_base_response
     def choose(self, message=None):
         message = self.candidates[(self.times_used % len(self.candidates))]
@@ -153,6 +247,7 @@ class BaseChooser(object):
         else:
             assert(isinstance(chooser_info, BaseChooser))
             obj = copy.copy(chooser_info)
+            obj.__dict__.pop('_runtime_slot', None)
             obj.times_used = 0
             return obj
 
@@ -192,7 +287,7 @@ class RandomChooser(BaseChooser):
     @formatting_base_response
     def choose(self, message=None):
         self.times_used += 1
-        return self.candidates[np.random.randint(len(self.candidates))]
+        return self.candidates[random_integer(self, len(self.candidates))]
 
 
 class SequentialChooser(BaseChooser):
@@ -242,7 +337,8 @@ class QuerierSizeDrivenChooser(BaseChooser):
             i = self.cond(len(message['query'][self.query_var]))
         filtered_candidates = [q for q in self.candidates
                                if q[self.type_var] == i]
-        return filtered_candidates[np.random.randint(len(filtered_candidates))]
+        i = random_integer(self, len(filtered_candidates))
+        return filtered_candidates[i]
 
 
 class QuerierSplitterChooser(BaseChooser):
@@ -271,7 +367,8 @@ class QuerierSplitterChooser(BaseChooser):
         i = self.choose_tag(message)
         filtered_candidates = [q for q in self.candidates
                                if int(q[self.type_var]) == i]
-        return filtered_candidates[np.random.randint(len(filtered_candidates))]
+        i = random_integer(self, len(filtered_candidates))
+        return filtered_candidates[i]
 
     def choose_tag(self, message):
         # TODO: Extend
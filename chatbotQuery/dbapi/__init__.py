@@ -3,24 +3,73 @@ import copy
 import pandas as pd
 import numpy as np
 import functools
+import threading
 
 from os.path import isfile
+from scipy import sparse
 
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.neighbors import NearestNeighbors
 #from sklearn.feature_extraction.text import CountVectorizer
 #from sklearn.neighbors import LSHForest
 
+from chatbotQuery.dbapi.dbapi_retrievers import create_main_retriever,\
+    InvertedIndexRetriever, TokenIndexRetriever, select_top_k
+from chatbotQuery.dbapi.dbapi_vectorizers import create_main_vectorizer,\
+    HashingTfidfVectorizer
+from chatbotQuery.dbapi.dbapi_category_index import CategoryBitmapIndex,\
+    FacetCounts, group_rows
+from chatbotQuery.dbapi.dbapi_fuzzy import FuzzyWordIndex
+from chatbotQuery.dbapi.dbapi_caching import create_cache, freeze, thaw,\
+    fingerprint
+from chatbotQuery.dbapi.dbapi_storage import save_index_arrays,\
+    load_index_arrays, publish_index_arrays, attach_index_arrays,\
+    to_storable_arrays, from_storable_arrays, to_json_values,\
+    to_string_block, StringBlock, BlockVocabulary
+from chatbotQuery.dbapi.dbapi_memory import memory_report
+
 
 class DataBaseAPI(object):
 
+    ## Retrieval of the main variable:
+    # * vectorizer: 'tfidf' (1-4 grams vocabulary), 'hashing' (hashed 1-4
+    #   grams with a fixed-size idf array) or an object with `fit_transform`
+    #   and `transform`.
+    # * retriever: 'inverted' (sparse inverted index), 'brute' (dense
+    #   NearestNeighbors) or an object with `fit` and `radius_neighbors`.
+    # * radius: maximum cosine distance of the retrieved elements.
+    # * top_k: if not None, only the `top_k` elements with the highest
+    #   cosine scores are retrieved (ordered by score) and their scores are
+    #   returned in `main_scores`, instead of every element in the radius.
+    # * score_floor: minimum cosine score of the elements in top-k mode.
+    # * compact_dtypes: store the index with float32 weights and the ids
+    #   (also the ones of the queries) with the smallest integer dtype which
+    #   fits the catalog.
+    # * refinement: when the previous query retrieved elements, score only
+    #   its rows instead of the whole catalog (in top-k mode the best ones
+    #   of the previous rows are returned).
+    # * fuzzy: the keywords which retrieve nothing are queried again with
+    #   their misspelled words corrected to the words of the catalog.
+    default_retrieval_pars = {'vectorizer': 'tfidf', 'retriever': 'inverted',
+                              'radius': 0.75, 'top_k': None,
+                              'score_floor': 0., 'compact_dtypes': False,
+                              'refinement': False, 'fuzzy': False}
+    ## Opt-in caches, each one given by the parameters of a `LRUCache`:
+    # * query: query information by normalized keywords and prior query.
+    # * responses: names and rendered responses by the ids of the result
+    #   and the label flag.
+    default_cache_pars = {'query': None, 'responses': None}
+    ## Number of index segments of the catalog updates which triggers their
+    ## compaction in background
+    max_index_segments = 8
+
     def __init__(self, data_info, type_vars, responses_formatter,
-                 parameter_formatter={}):
+                 parameter_formatter={}, retrieval_pars={}, cache_pars={}):
         if isinstance(data_info, pd.DataFrame):
             self.data = data_info
         else:
             assert(isfile(data_info))
             self.data = pd.read_csv(data_info, index_col=0)
+        self.n_rows = self.data.shape[0]
 
         ## Type vars: dictionary with 'main_var', 'cat_vars', 'label_var'
         assert(all([v in type_vars
@@ -33,71 +82,720 @@ class DataBaseAPI(object):
 
         ## Data transformed
         names = list(self.data[self.type_vars['main_var']['name']])
-        categories = dict([(c, list(self.data[c].unique()))
-                           for c in type_vars['cat_vars']['name']])
 #        cats_ids = dict([(c, dict([(v,
 #                                    list(self.data.index[self.data[c] == v]))
 #                                   for v in categories[c]]))
 #                         for c in type_vars['cat_vars']['name']])
-        dummy_idxs = np.arange(self.data.shape[0])
-        cats_ids = dict([(c, dict([(v, dummy_idxs[np.array(self.data[c] == v)])
-                                   for v in categories[c]]))
-                         for c in type_vars['cat_vars']['name']])
+        ## Rows of each category value grouped in a single pass by column
+        categories, cats_ids, self.cats_codes = {}, {}, {}
+        for c in type_vars['cat_vars']['name']:
+            categories[c], cats_ids[c], self.cats_codes[c] =\
+                group_rows(self.data[c])
+        ## Main parameters
+        self.retrieval_pars = copy.copy(self.default_retrieval_pars)
+        self.retrieval_pars.update(retrieval_pars)
+        ## Category postings
         self.categories = categories
         self.cats_ids = cats_ids
+        if self.retrieval_pars['compact_dtypes']:
+            for c in self.cats_ids:
+                for v in self.cats_ids[c]:
+                    self.cats_ids[c][v] =\
+                        self.cats_ids[c][v].astype(self._row_ids_dtype())
+        self.cats_index =\
+            CategoryBitmapIndex.from_cats_ids(cats_ids, categories,
+                                              self.n_rows)
+        self.facets = FacetCounts.from_codes(self.cats_codes, categories)
         self.cats_codenames = dict(zip(type_vars['cat_vars']['name'],
                                        type_vars['cat_vars']['codename']))
-        ## Main parameters
-        self.main_vectorizer = TfidfVectorizer(ngram_range=(1, 4))
-        self.main_ret = NearestNeighbors(metric='cosine', algorithm='brute')
-        data_sp = self.main_vectorizer.fit_transform(names)
+        self.main_vectorizer =\
+            create_main_vectorizer(self.retrieval_pars['vectorizer'])
+        self.main_ret =\
+            create_main_retriever(self.retrieval_pars['retriever'],
+                                  self.retrieval_pars['radius'])
+        data_sp = self._compact_weights(
+            self.main_vectorizer.fit_transform(names))
         self.main_ret.fit(data_sp)
+        self._fit_category_retrievers()
 
-        self.cat_vectorizers, self.cat_rets = {}, {}
-        for var, vals in categories.items():
-#            self.cat_vectorizers[var] = CountVectorizer(binary=True)
-#            self.cat_rets[var] = NearestNeighbors(radius=.9, metric='hamming')
-            self.cat_vectorizers[var] = DummyVectorizer()
-            self.cat_rets[var] = DummyRetriever(radius=1)
-#            data_sp = self.cat_vectorizers[var].fit_transform(categories[var])
-#            self.cat_rets[var].fit(data_sp)
-            data_sp = self.cat_vectorizers[var].fit_transform(categories[var])
-            self.cat_rets[var].fit(data_sp)
-
+        self._set_response_arrays()
+        self._set_fuzzy_index()
         self.responses_formatter = responses_formatter
         self.parameter_formatter = parameter_formatter
+        self._set_caches(cache_pars)
+        self._set_updates()
+
+    def _set_response_arrays(self, columns={}, label_names=None):
+        """Precompute the contiguous arrays used to build the responses.
+        The arrays of `columns` are used instead of the ones of the data,
+        and the formatted `label_names` instead of formatting the labels.
+        """
+        main_var = self.type_vars['main_var']['name']
+        label_var = self.type_vars['label_var']['name']
+        if main_var in columns:
+            self.main_names = columns[main_var]
+        else:
+            self.main_names = self.data[main_var].to_numpy()
+        if label_names is None:
+            labels = columns[label_var] if label_var in columns else\
+                self.data[label_var].to_numpy()
+            label_names = self._format_labels(labels)
+        self.label_names = label_names
+        self.categories_names = {}
+        for c in self.type_vars['cat_vars']['name']:
+            self._set_category_names(c)
+
+    def _set_category_names(self, c):
+        self.categories_names[c] = np.empty(len(self.categories[c]),
+                                            dtype=object)
+        self.categories_names[c][:] = self.categories[c]
+
+    @staticmethod
+    def _format_labels(labels):
+        return np.array([str(e) for e in np.round(labels, decimals=2)],
+                        dtype=object)
+
+    def _set_caches(self, cache_pars):
+        self.cache_pars = copy.copy(self.default_cache_pars)
+        self.cache_pars.update(cache_pars)
+        self.query_cache = create_cache(self.cache_pars['query'])
+        self.responses_cache = create_cache(self.cache_pars['responses'])
+
+    ############################# Compact dtypes #############################
+    def _row_ids_dtype(self):
+        if not self.retrieval_pars['compact_dtypes']:
+            return np.dtype(np.int64)
+        return np.min_scalar_type(max(self.n_rows-1, 0))
+
+    def _compact_weights(self, data_sp):
+        if not self.retrieval_pars['compact_dtypes']:
+            return data_sp
+        return data_sp.astype(np.float32)
+
+    def _compact_ids(self, ids):
+        """Query ids with the smallest integer dtypes (and float32 scores)
+        in compact mode.
+        """
+        if not self.retrieval_pars['compact_dtypes']:
+            return ids
+        dtypes = [('main_var', self._row_ids_dtype()),
+                  ('main_scores', np.dtype(np.float32))]
+        for key, dtype in dtypes:
+            if key in ids:
+                self._cast_elements(ids[key], dtype)
+        for c in ids.get('cat_vars', {}):
+            dtype = np.min_scalar_type(max(len(self.categories[c])-1, 0))
+            self._cast_elements(ids['cat_vars'][c], dtype)
+        return ids
+
+    def _copy_ids(self, ids):
+        ## Copy of the containers of the query ids to be cast in place
+        copied = dict([(key, copy.copy(v)) for key, v in ids.items()
+                       if key != 'cat_vars'])
+        if 'cat_vars' in ids:
+            copied['cat_vars'] = dict([(c, copy.copy(v)) for c, v
+                                       in ids['cat_vars'].items()])
+        return copied
+
+    def _cast_elements(self, elements, dtype):
+        for i in range(len(elements)):
+            elements[i] = np.asarray(elements[i]).astype(dtype, copy=False)
+
+    @property
+    def data(self):
+        """Data frame of the catalog. The loaded instances build it from the
+        stored columns when it is first used (None if attached).
+        """
+        columns = self.__dict__.get('_stored_columns')
+        if columns is not None:
+            self._data = self._data_frame(*columns)
+            self._stored_columns = None
+        return self.__dict__.get('_data')
+
+    @data.setter
+    def data(self, data):
+        self._data, self._stored_columns = data, None
+
+    @staticmethod
+    def _data_frame(arrays, meta):
+        ## Writable data frame of the stored columns
+        def values(name):
+            return np.array(from_storable_arrays(arrays, name)[:])
+        data = dict([(col, values('column_%d' % i))
+                     for i, col in enumerate(meta['columns'])])
+        return pd.DataFrame(data, columns=meta['columns'],
+                            index=pd.Index(values('index'),
+                                           name=meta['index_name']))
+
+    def memory_report(self):
+        """Bytes used by each one of the structures of the database (the
+        data frame only if it is built).
+        """
+        structures = dict([(k, getattr(self, k, None)) for k in
+                           ['main_vectorizer', 'main_ret',
+                            'cats_ids', 'cats_index', 'facets',
+                            'fuzzy_index', 'cat_vectorizers',
+                            'cat_rets', 'main_names', 'label_names',
+                            'categories_names', 'query_cache',
+                            'responses_cache']])
+        structures['data'] = self.__dict__.get('_data')
+        return memory_report(structures)
+
+    def cache_stats(self):
+        """Hits, misses and evictions of the active caches."""
+        stats = {}
+        if self.query_cache is not None:
+            stats['query'] = self.query_cache.stats()
+        if self.responses_cache is not None:
+            stats['responses'] = self.responses_cache.stats()
+        return stats
+
+    def _set_fuzzy_index(self):
+        self.fuzzy_index = None
+        if self.retrieval_pars['fuzzy']:
+            self.fuzzy_index = FuzzyWordIndex().fit(self._fuzzy_texts())
+
+    def _fuzzy_texts(self):
+        ## Names of the elements and the category values
+        texts = list(self.main_names)
+        for c in self.type_vars['cat_vars']['name']:
+            texts += [v for v in self.categories[c] if not pd.isnull(v)]
+        return texts
+
+    def _fit_category_retrievers(self):
+        self.cat_vectorizers, self.cat_rets = {}, {}
+        for var in self.categories:
+            self._fit_category_retriever(var)
+
+    def _fit_category_retriever(self, var):
+#        self.cat_vectorizers[var] = CountVectorizer(binary=True)
+#        self.cat_rets[var] = NearestNeighbors(radius=.9, metric='hamming')
+        vectorizer = DummyVectorizer()
+        retriever = TokenIndexRetriever(radius=1)
+#        data_sp = self.cat_vectorizers[var].fit_transform(categories[var])
+#        self.cat_rets[var].fit(data_sp)
+        data_sp = vectorizer.fit_transform(self.categories[var])
+        retriever.fit(data_sp)
+        self.cat_vectorizers[var], self.cat_rets[var] = vectorizer, retriever
 
     @classmethod
     def from_parameters(cls, parameters):
         return DataBaseAPI(**parameters)
 
-    def query(self, keywords, pre=None, label=None):
+    def build_index(self, path):
+        """Store the fitted indices in the folder `path` as `.npy` arrays
+        which could be memory-mapped by `load_index`.
+        """
+        arrays, meta = self._index_arrays()
+        save_index_arrays(path, arrays, meta)
+
+    def publish_shared(self, name=None):
+        """Publish the fitted indices in a shared memory block, so the
+        worker processes could attach them with `attach_shared` instead of
+        holding their own copies. The block is returned: it should be kept
+        by the publisher while it is used and `close`d and `unlink`ed at
+        the end.
+        """
+        arrays, meta = self._index_arrays(shared=True)
+        return publish_index_arrays(arrays, meta, name)
+
+    def _index_arrays(self, shared=False):
+        ## The shared indices store the names and formatted labels instead
+        ## of the data columns
+
+        if not isinstance(self.main_ret, InvertedIndexRetriever):
+            raise ValueError("Only the 'inverted' retriever can be stored.")
+        arrays, meta = {}, {}
+        ## Main retrieval
+        if isinstance(self.main_vectorizer, HashingTfidfVectorizer):
+            meta['vectorizer'] = {'name': 'hashing', 'n_features':
+                                  self.main_vectorizer.n_features}
+        elif isinstance(self.main_vectorizer, TfidfVectorizer):
+            meta['vectorizer'] = {'name': 'tfidf'}
+            vocabulary = sorted(self.main_vectorizer.vocabulary_.items(),
+                                key=lambda x: x[1])
+            terms = [v for v, _ in vocabulary]
+            arrays['vocabulary_offsets'], arrays['vocabulary_bytes'] =\
+                to_string_block(terms)
+            arrays['vocabulary_order'] = BlockVocabulary.sorted_order(terms)
+        else:
+            raise ValueError("Only the 'tfidf' and 'hashing' vectorizers "
+                             "can be stored.")
+        arrays['idf'] = self.main_vectorizer.idf_
+        postings = self.main_ret.postings
+        arrays['postings_data'] = postings.data
+        arrays['postings_indices'] = postings.indices
+        arrays['postings_indptr'] = postings.indptr
+        meta['postings_shape'] = list(postings.shape)
+        meta['ngram_range'] = list(self.main_vectorizer.ngram_range)
+        ## Category postings
+        for i, c in enumerate(self.type_vars['cat_vars']['name']):
+            ids = [self.cats_ids[c][v] for v in self.categories[c]]
+            arrays['cats_ids_%d' % i] =\
+                np.concatenate(ids).astype(self._row_ids_dtype())
+            arrays['cats_indptr_%d' % i] =\
+                np.cumsum([0]+[len(e) for e in ids]).astype(np.int64)
+            arrays['cats_codes_%d' % i] = self.cats_codes[c]
+            arrays['cats_dense_%d' % i] = self.cats_index.dense_values(c)
+            arrays['cats_bitmaps_%d' % i] = self.cats_index.bitmaps[c]
+        meta['categories'] = [to_json_values(self.categories[c])
+                              for c in self.type_vars['cat_vars']['name']]
+        facets = self.facets.to_arrays(self.type_vars['cat_vars']['name'])
+        for key, array in facets.items():
+            arrays['facets_'+key] = array
+        meta['n_rows'] = self.n_rows
+        ## Parameters
+        meta['type_vars'] = self.type_vars
+        meta['retrieval_pars'] = dict(self.retrieval_pars,
+                                      vectorizer=meta['vectorizer']['name'])
+        ## Names and formatted labels of the responses
+        arrays.update(to_storable_arrays('main_names',
+                                         np.asarray(self.main_names[:],
+                                                    dtype=object)))
+        arrays['label_names_offsets'], arrays['label_names_bytes'] =\
+            to_string_block(self.label_names)
+        if shared:
+            return arrays, meta
+        ## Data columns
+        for i, col in enumerate(self.data.columns):
+            arrays.update(to_storable_arrays('column_%d' % i, self.data[col]))
+        arrays.update(to_storable_arrays('index', self.data.index))
+        meta['columns'] = list(self.data.columns)
+        meta['index_name'] = self.data.index.name
+        return arrays, meta
+
+    @classmethod
+    def load_index(cls, path, responses_formatter, parameter_formatter={},
+                   cache_pars={}, mmap_mode='r'):
+        """Load the indices stored by `build_index` without refitting.
+        The numerical arrays are memory-mapped (read-only by default).
+        """
+        arrays, meta = load_index_arrays(path, mmap_mode)
+        return cls._from_index_arrays(arrays, meta, responses_formatter,
+                                      parameter_formatter, cache_pars)
+
+    @classmethod
+    def attach_shared(cls, name, responses_formatter, parameter_formatter={},
+                      cache_pars={}):
+        """Attach the indices published by `publish_shared` in the shared
+        memory block `name`. The numerical arrays are read-only views of
+        the block, so they are not copied by each worker: the names and
+        labels are decoded when they are read and there is no data frame.
+        """
+        arrays, meta, block = attach_index_arrays(name)
+        dbapi = cls._from_index_arrays(arrays, meta, responses_formatter,
+                                       parameter_formatter, cache_pars,
+                                       shared=True)
+        dbapi._shared_block = block
+        return dbapi
+
+    @classmethod
+    def _from_index_arrays(cls, arrays, meta, responses_formatter,
+                           parameter_formatter, cache_pars, shared=False):
+        dbapi = cls.__new__(cls)
+        dbapi._shared_block = None
+        dbapi.type_vars = meta['type_vars']
+        dbapi.retrieval_pars = copy.copy(cls.default_retrieval_pars)
+        dbapi.retrieval_pars.update(meta['retrieval_pars'])
+        ## Data columns: not built until they are used
+        data, label_names = {}, None
+        dbapi.data = None
+        if not shared:
+            dbapi._stored_columns = (arrays, meta)
+        if 'label_names_offsets' in arrays:
+            main_var = dbapi.type_vars['main_var']['name']
+            data[main_var] = from_storable_arrays(arrays, 'main_names')
+            label_names = StringBlock(arrays['label_names_offsets'],
+                                      arrays['label_names_bytes'])
+        else:
+            ## Indices stored before the names and labels
+            data = dict([(col, dbapi.data[col].to_numpy())
+                         for col in meta['columns']])
+        ## Indices stored before the number of rows
+        dbapi.n_rows = meta['n_rows'] if 'n_rows' in meta else\
+            dbapi.data.shape[0]
+        n_rows = dbapi.n_rows
+        ## Category postings
+        cat_names = dbapi.type_vars['cat_vars']['name']
+        dbapi.categories, dbapi.cats_ids, dbapi.cats_codes = {}, {}, {}
+        dense, bitmaps = {}, {}
+        for i, c in enumerate(cat_names):
+            ids = arrays['cats_ids_%d' % i]
+            indptr = arrays['cats_indptr_%d' % i]
+            dbapi.categories[c] = meta['categories'][i]
+            dbapi.cats_ids[c] =\
+                dict([(v, ids[indptr[j]:indptr[j+1]])
+                      for j, v in enumerate(dbapi.categories[c])])
+            if 'cats_codes_%d' % i in arrays:
+                dbapi.cats_codes[c] = arrays['cats_codes_%d' % i]
+            else:
+                ## Indices stored before the codes
+                dbapi.cats_codes[c] =\
+                    -np.ones(n_rows, dtype=np.int32)
+                for j in range(len(indptr)-1):
+                    dbapi.cats_codes[c][ids[indptr[j]:indptr[j+1]]] = j
+            dense[c] = arrays['cats_dense_%d' % i]
+            bitmaps[c] = arrays['cats_bitmaps_%d' % i]
+        dbapi.cats_index =\
+            CategoryBitmapIndex.from_arrays(dbapi.cats_ids, dbapi.categories,
+                                            n_rows, dense, bitmaps)
+        if 'facets_counts_0' in arrays or not cat_names:
+            facets = dict([(k[len('facets_'):], v) for k, v in arrays.items()
+                           if k.startswith('facets_')])
+            dbapi.facets = FacetCounts.from_arrays(facets, cat_names)
+        else:
+            dbapi.facets = FacetCounts.from_codes(dbapi.cats_codes,
+                                                  dbapi.categories)
+        cat_codenames = dbapi.type_vars['cat_vars']['codename']
+        dbapi.cats_codenames = dict(zip(cat_names, cat_codenames))
+        ## Main retrieval
+        vectorizer = meta.get('vectorizer', {'name': 'tfidf'})
+        if vectorizer['name'] == 'hashing':
+            dbapi.main_vectorizer =\
+                HashingTfidfVectorizer(meta['ngram_range'],
+                                       vectorizer['n_features'])
+        else:
+            dbapi.main_vectorizer =\
+                TfidfVectorizer(ngram_range=tuple(meta['ngram_range']))
+            if 'vocabulary' in arrays:
+                ## Indices stored before the vocabulary blocks
+                vocabulary = arrays['vocabulary'].tolist()
+                dbapi.main_vectorizer.vocabulary_ =\
+                    dict(zip(vocabulary, range(len(vocabulary))))
+            else:
+                terms = StringBlock(arrays['vocabulary_offsets'],
+                                    arrays['vocabulary_bytes'])
+                dbapi.main_vectorizer.vocabulary_ =\
+                    BlockVocabulary(terms, arrays['vocabulary_order'])
+        dbapi.main_vectorizer.idf_ = arrays['idf']
+        postings = sparse.csr_matrix((arrays['postings_data'],
+                                      arrays['postings_indices'],
+                                      arrays['postings_indptr']),
+                                     shape=tuple(meta['postings_shape']),
+                                     copy=False)
+        dbapi.main_ret = InvertedIndexRetriever.\
+            from_postings(postings, dbapi.retrieval_pars['radius'])
+        dbapi._fit_category_retrievers()
+        dbapi._set_response_arrays(data, label_names)
+        dbapi._set_fuzzy_index()
+
+        dbapi.responses_formatter = responses_formatter
+        dbapi.parameter_formatter = parameter_formatter
+        dbapi._set_caches(cache_pars)
+        dbapi._set_updates()
+        return dbapi
+
+    ############################ Catalog updates ############################
+    def _set_updates(self):
+        self.read_only = False
+        self._update_lock = threading.RLock()
+        self._buffers, self._positions = {}, {}
+        self._compaction = None
+        self._generation = 0
+
+    def add_rows(self, rows):
+        """Append the rows of the dataframe `rows` to the catalog and
+        return their ids. The ids of the previous rows are kept, so the
+        query ids held by the sessions remain valid. The vectorizer is not
+        refitted: the new rows are indexed with the current vocabulary.
+        """
+        self._check_updatable()
+        if not rows.index.is_unique:
+            raise ValueError("Repeated index labels in the rows: %s"
+                             % list(rows.index[rows.index.duplicated()]))
+        with self._update_lock:
+            repeated = self.data.index.intersection(rows.index)
+            if len(repeated):
+                raise ValueError("Index labels already in the catalog: %s. "
+                                 "Use `update_rows` to replace them."
+                                 % list(repeated))
+            n_rows = self.n_rows
+            ids = np.arange(n_rows, n_rows+rows.shape[0])
+            rows = rows[self.data.columns]
+            self.data = pd.concat([self.data, rows])
+            self.n_rows = self.data.shape[0]
+            self._update_response_arrays(ids, rows)
+            self._update_categories(ids, rows=rows)
+            self._update_fuzzy_index(rows)
+            self.main_ret.add(self._transform_rows(rows), ids)
+            self._after_update()
+        return ids
+
+    def update_rows(self, rows):
+        """Replace the rows of the catalog with the same index labels than
+        the rows of the dataframe `rows`, keeping their ids. Updating a
+        removed row restores it.
+        """
+        self._check_updatable()
+        with self._update_lock:
+            ids = self.data.index.get_indexer(rows.index)
+            if np.any(ids < 0):
+                raise KeyError("Rows not in the catalog: %s"
+                               % list(rows.index[ids < 0]))
+            rows = rows[self.data.columns]
+            self.data.loc[rows.index, self.data.columns] = rows
+            self._update_response_arrays(ids, rows)
+            self._update_categories(ids, rows=rows)
+            self._update_fuzzy_index(rows)
+            self.main_ret.add(self._transform_rows(rows), ids)
+            self._after_update()
+
+    def remove_ids(self, ids):
+        """Remove the rows `ids` from the retrievals. Their data is kept
+        (tombstones) so the query ids held by the sessions remain valid.
+        """
+        self._check_updatable()
+        with self._update_lock:
+            ids = np.unique(np.asarray(ids, dtype=np.int64))
+            self.main_ret.remove(ids)
+            self._update_categories(ids)
+            self._after_update()
+
+    def compact(self, background=False):
+        """Merge the index segments of the updates, dropping the removed
+        rows. The queries keep running meanwhile. In background it runs in
+        a daemon thread, which is returned.
+        """
+        if background:
+            if (self._compaction is None) or\
+                    (not self._compaction.is_alive()):
+                self._compaction = threading.Thread(target=self.compact,
+                                                    daemon=True)
+                self._compaction.start()
+            return self._compaction
+        with self._update_lock:
+            self.main_ret.compact()
+
+    def _check_updatable(self):
+        if not hasattr(self.main_ret, 'add'):
+            raise ValueError("Only the 'inverted' retriever can be updated.")
+        if getattr(self, '_shared_block', None) is not None:
+            raise ValueError("The shared memory indices are read-only.")
+        if self.read_only:
+            raise ValueError("The shared instances are read-only: update a "
+                             "copy built from the same parameters.")
+
+    def _transform_rows(self, rows):
+        return self._compact_weights(self.main_vectorizer.transform(
+            list(rows[self.type_vars['main_var']['name']])))
+
+    def _update_response_arrays(self, ids, rows):
+        n_rows = self.n_rows
+        self.main_names = self._extended('main_names', self.main_names,
+                                         n_rows, None)
+        self.main_names[ids] =\
+            rows[self.type_vars['main_var']['name']].to_numpy()
+        self.label_names = self._extended('label_names', self.label_names,
+                                          n_rows, None)
+        self.label_names[ids] =\
+            self._format_labels(rows[self.type_vars['label_var']['name']].
+                                to_numpy())
+
+    def _extended(self, key, array, n_rows, fill):
+        """Writable array of `n_rows` items starting with the ones of
+        `array` and followed by `fill`. It is a view of a buffer which
+        doubles its capacity when full, so appending rows is amortized
+        O(1) per row.
+        """
+        buffer = self._buffers.get(key)
+        if not isinstance(array, np.ndarray):
+            ## Strings stored in blocks
+            array = array[:]
+        if (buffer is None) or (array.base is not buffer) or\
+                (len(buffer) < n_rows):
+            buffer = np.full(max(2*n_rows, 64), fill, dtype=array.dtype)
+            buffer[:len(array)] = array
+            self._buffers[key] = buffer
+        return buffer[:n_rows]
+
+    def _value_positions(self, c):
+        if c not in self._positions:
+            self._positions[c] = dict(zip(self.categories[c],
+                                          range(len(self.categories[c]))))
+        return self._positions[c]
+
+    def _update_categories(self, ids, rows=None):
+        ## Rows `ids` moved from their current values to the ones of `rows`
+        ## (or removed). Only their contributions to the postings, bitmaps
+        ## and facets are updated and the positions of the values are kept.
+        n_rows = self.n_rows
+        self.cats_index.resize(n_rows)
+        old_codes, new_codes, n_values, new_values = {}, {}, {}, []
+        for c in self.type_vars['cat_vars']['name']:
+            self.cats_codes[c] = self._extended(('cats_codes', c),
+                                                self.cats_codes[c], n_rows, -1)
+            old_codes[c] = self.cats_codes[c][ids].copy()
+            new_codes[c] = -np.ones(len(ids), dtype=np.int32)
+            n_old = len(self.categories[c])
+            if rows is not None:
+                positions = self._value_positions(c)
+                values = rows[c].to_numpy()
+                for v in pd.unique(values):
+                    if pd.isnull(v):
+                        continue
+                    if v not in positions:
+                        positions[v] = len(self.categories[c])
+                        self.categories[c].append(v)
+                        self.cats_ids[c][v] = np.array([], dtype=np.int64)
+                    new_codes[c][values == v] = positions[v]
+            self.cats_codes[c][ids] = new_codes[c]
+            ## Postings of the values which lost or gained rows
+            removed, added = {}, {}
+            for changes, codes in [(removed, old_codes[c]),
+                                   (added, new_codes[c])]:
+                for j in np.unique(codes[codes >= 0]):
+                    changes[j] = ids[codes == j]
+            postings = {}
+            for changes, update in [(removed, np.setdiff1d),
+                                    (added, np.union1d)]:
+                for j, ids_j in changes.items():
+                    v = self.categories[c][j]
+                    self.cats_ids[c][v] = postings[j] =\
+                        update(self.cats_ids[c][v], ids_j).\
+                        astype(self._row_ids_dtype())
+            self.cats_index.update(c, postings, added, removed)
+            n_values[c] = len(self.categories[c])
+            if n_values[c] > n_old:
+                new_values.append(c)
+        self.facets.update(old_codes, new_codes, n_values)
+        for c in new_values:
+            self._set_category_names(c)
+            self._fit_category_retriever(c)
+
+    def _update_fuzzy_index(self, rows):
+        if self.fuzzy_index is None:
+            return
+        columns = [self.type_vars['main_var']['name']] +\
+            list(self.type_vars['cat_vars']['name'])
+        for col in columns:
+            self.fuzzy_index.add(rows[col].dropna())
+
+    def _after_update(self):
+        self._generation += 1
+        for cache in [self.query_cache, self.responses_cache]:
+            if cache is not None:
+                cache.clear()
+        if self.main_ret.n_segments > self.max_index_segments:
+            self.compact(background=True)
+
+    def query(self, keywords, pre=None, label=None, queried=None):
         pars = self._format_parameters(keywords, pre, label)
         # TODO: Use in the future
         ifchanged = self.changed_labels(pre, pars)
 
-        ids, query_result = self.complete_query(keywords, pre)
+        ids, query_result = self.complete_query(keywords, pre, queried)
         if self.empy_ids(ids['main_var']):
             if pre is not None:
-                ids['main_var'] = pre['query_idxs']['main_var']
+                ids['main_var'] = copy.copy(pre['query_idxs']['main_var'])
+                ids.pop('main_scores', None)
+                if 'main_scores' in pre['query_idxs']:
+                    ids['main_scores'] =\
+                        copy.copy(pre['query_idxs']['main_scores'])
         pars['query_result'] = query_result
-        return ids, pars
+        return self._compact_ids(ids), pars
 
     def empy_ids(self, ids):
         return any([(len(e) == 0) for e in ids])
 
-    def complete_query(self, keywords, pre=None):
-        queried = self.columwise_query(keywords)
+    def complete_query(self, keywords, pre=None, queried=None):
+        if queried is None:
+            queried = self.columwise_query(keywords, pre)
         queried, query_result = self.join_w_prequeries(queried, pre)
         return queried, query_result
 
-    def columwise_query(self, keywords):
-        queried = {}
+    def query_batch_ids(self, queries):
+        """Query a batch of sessions at once. Each query is a tuple
+        `(keywords, pre)` or `(keywords, pre, label)` and it returns the
+        `(ids, pars)` of `query` for each of them.
+        """
+        queries = [self._format_batch_query(q) for q in queries]
+        results = [None]*len(queries)
+        for pre, group in self._batch_groups(queries):
+            ## Retrieval of all the keywords of the group at once
+            all_keywords = [k for i in group for k in queries[i][0]]
+            queried = self.columwise_query(all_keywords, pre)
+            ## Split by session
+            start = 0
+            for i in group:
+                keywords, pre_i, label = queries[i]
+                end = start+len(keywords)
+                queried_i = {'main_var': queried['main_var'][start:end].copy(),
+                             'cat_vars': dict([(c, v[start:end]) for c, v in
+                                               queried['cat_vars'].items()])}
+                if 'main_scores' in queried:
+                    queried_i['main_scores'] =\
+                        queried['main_scores'][start:end].copy()
+                results[i] = self.query(keywords, pre_i, label, queried_i)
+                start = end
+        return results
+
+    def _batch_groups(self, queries):
+        ## The previous query only restricts the retrieval in refinement
+        ## mode, so the queries with `pre` are retrieved on their own there
+        groups, shared = [], []
+        for i, (keywords, pre, label) in enumerate(queries):
+            if self.retrieval_pars['refinement'] and (pre is not None):
+                groups.append((pre, [i]))
+            else:
+                shared.append(i)
+        if shared:
+            groups.insert(0, (None, shared))
+        return groups
+
+    def query_batch(self, queries):
+        """Batched version of `get_query_info` over a list of
+        `(keywords, pre)` or `(keywords, pre, label)` queries.
+        """
+        queries = [self._format_batch_query(q) for q in queries]
+        ## Only the queries not cached are retrieved
+        keys = [self._query_cache_key(*q) for q in queries]
+        query_infos = [self._get_cached_query_info(k) for k in keys]
+        missing = [i for i, q in enumerate(query_infos) if q is None]
+        results = self.query_batch_ids([queries[i] for i in missing])
+        for i, (ids, pars) in zip(missing, results):
+            query_infos[i] =\
+                self._set_cached_query_info(keys[i],
+                                            self.get_query_info_from_ids(
+                                                ids, **pars))
+        return query_infos
+
+    def _format_batch_query(self, query):
+        return tuple(query)+(None,)*(3-len(query))
+
+    ################################ Caching ################################
+    def _query_cache_key(self, keywords, pre=None, label=None):
+        if self.query_cache is None:
+            return None
+        keywords = tuple([' '.join(str(k).lower().split()) for k in keywords])
+        if pre is not None:
+            pre = fingerprint(dict([(k, pre[k]) for k in
+                                    ['query_idxs', 'query_result',
+                                     'query_pars'] if k in pre]))
+        return (keywords, pre, label, self._generation)
+
+    def _get_cached_query_info(self, key):
+        if key is None:
+            return None
+        query_info = self.query_cache.get(key)
+        if query_info is not None:
+            query_info = thaw(query_info)
+        return query_info
+
+    def _set_cached_query_info(self, key, query_info):
+        if key is None:
+            return query_info
+        self.query_cache.set(key, freeze(query_info))
+        return query_info
+
+    def columwise_query(self, keywords, pre=None):
+        queried = self._columwise_query(keywords, pre)
+        if getattr(self, 'fuzzy_index', None) is not None:
+            queried = self._fuzzy_query(keywords, pre, queried)
+        return queried
+
+    def _columwise_query(self, keywords, pre=None):
         ## Main query
-        ids = self.main_ret.radius_neighbors(self.main_vectorizer.
-                                             transform(keywords).A, 0.75)
-#        queried['main_var'] = {self.type_vars['main_var']['name']: ids}
-        queried['main_var'] = ids[1]
+        queried = self._main_query(keywords, pre)
         ## Category queries
         queried_cat = {}
         for var, vals in self.categories.items():
@@ -107,6 +805,105 @@ class DataBaseAPI(object):
         queried['cat_vars'] = queried_cat
         return queried
 
+    def _fuzzy_query(self, keywords, pre, queried):
+        """Fallback of the keywords which retrieve nothing: they are
+        queried again with their words corrected by the fuzzy index.
+        """
+        missing = []
+        for i in range(len(keywords)):
+            if len(queried['main_var'][i]) or\
+                    any([len(v[i]) for v in queried['cat_vars'].values()]):
+                continue
+            corrected = self.fuzzy_index.correct(keywords[i])
+            if corrected != str(keywords[i]).lower():
+                missing.append((i, corrected))
+        if not missing:
+            return queried
+        queried_fuzzy = self._columwise_query([k for _, k in missing], pre)
+        for j, (i, _) in enumerate(missing):
+            for key in ['main_var', 'main_scores']:
+                if key in queried:
+                    queried[key][i] = queried_fuzzy[key][j]
+            for c in queried['cat_vars']:
+                queried['cat_vars'][c][i] = queried_fuzzy['cat_vars'][c][j]
+        return queried
+
+    def _main_query(self, keywords, pre=None):
+        queried = {}
+        keywords_sp =\
+            self._compact_weights(self.main_vectorizer.transform(keywords))
+        rows = self._refinement_rows(pre, len(keywords))
+        if rows is not None:
+            return self._refined_main_query(keywords, keywords_sp, rows)
+        if self.retrieval_pars['top_k'] is None:
+            ids = self.main_ret.radius_neighbors(keywords_sp,
+                                                 self.retrieval_pars['radius'])
+#            queried['main_var'] = {self.type_vars['main_var']['name']: ids}
+            queried['main_var'] = ids[1]
+        else:
+            scores, ids = self._top_main_query(keywords_sp)
+            queried['main_var'] = ids
+            queried['main_scores'] = scores
+        return queried
+
+    def _refinement_rows(self, pre, n_keywords):
+        ## Rows of the previous elements query which restrict the search
+        if (not self.retrieval_pars['refinement']) or (pre is None):
+            return None
+        if (pre['query_result']['query_type'] != 'elements') or\
+                (not hasattr(self.main_ret, 'radius_neighbors_in')):
+            return None
+        rows = pre['query_idxs']['main_var']
+        if (len(rows) != n_keywords) or self.empy_ids(rows):
+            return None
+        return rows
+
+    def _refined_main_query(self, keywords, keywords_sp, rows):
+        """Main query only among the rows of the previous query, so it
+        costs O(previous result size) instead of O(catalog).
+        """
+        if self.retrieval_pars['top_k'] is None:
+            _, ids = self.main_ret.\
+                radius_neighbors_in(keywords_sp, rows,
+                                    self.retrieval_pars['radius'])
+            queried = {'main_var': ids}
+        else:
+            scores, ids = self.main_ret.\
+                top_neighbors_in(keywords_sp, rows,
+                                 self.retrieval_pars['top_k'],
+                                 self.retrieval_pars['score_floor'])
+            queried = {'main_var': ids, 'main_scores': scores}
+        ## The keywords without results among the previous rows are searched
+        ## in the whole catalog to know if they are elements queries
+        missing = [i for i in range(len(ids)) if len(ids[i]) == 0]
+        if missing:
+            queried_full = self._main_query([keywords[i] for i in missing])
+            for key in queried:
+                for j, i in enumerate(missing):
+                    queried[key][i] = queried_full[key][j]
+        return queried
+
+    def _top_main_query(self, keywords_sp):
+        """Top-k retrieval of the main variable. The retrievers without
+        `top_neighbors` are queried in the radius of the score floor.
+        """
+        top_k = self.retrieval_pars['top_k']
+        score_floor = self.retrieval_pars['score_floor']
+        if hasattr(self.main_ret, 'top_neighbors'):
+            return self.main_ret.top_neighbors(keywords_sp, top_k,
+                                               score_floor)
+        dists, ids = self.main_ret.radius_neighbors(keywords_sp,
+                                                    1.-score_floor)
+        scores = np.empty(len(ids), dtype=object)
+        for i in range(len(ids)):
+            ids_i = np.asarray(ids[i], dtype=np.int64)
+            scores_i = 1.-np.asarray(dists[i], dtype=float)
+            ## The elements without shared terms are in a radius of 1 too
+            logi = (scores_i > 0) & (scores_i >= score_floor)
+            ids[i], scores[i] = select_top_k(ids_i[logi], scores_i[logi],
+                                             top_k)
+        return scores, ids
+
     def _evaluate_queried(self, queried):
         cat = not all([len(v[0]) == 0 for c, v in queried['cat_vars'].items()])
         main_len = len(queried['main_var'][0])
@@ -152,30 +949,14 @@ class DataBaseAPI(object):
         return queried, query_result
 
     def _cross_category_element_query(self, ids_ele, ids_cat):
-        ## Get the indices associated at each category
-        ids_i_cat = []
-        for c in ids_cat['cat_vars']:
-            ids_cat_each = []
-            for i in range(len(ids_cat['cat_vars'][c])):
-                ids_cat_c = np.array([], dtype=np.int64)
-                for c_i in ids_cat['cat_vars'][c][i]:
-                    ids_cat_c =\
-                        np.union1d(ids_cat_c,
-                                   self.cats_ids[c][self.categories[c][c_i]])
-                ids_cat_each.append(copy.copy(ids_cat_c))
-            ids_i_cat.append(ids_cat_each)
-        ## Get indices for each query
-        ids_i = []
-        for i in range(len(ids_i_cat[0])):
-            aux = np.union1d(*[ids[i] for ids in ids_i_cat]).astype(np.int64)
-            ids_i.append(aux)
-        ## Union in its own query
-        for i in range(len(ids_i)):
-            ids_i[i] = np.union1d(ids_i[i], ids_cat['main_var'][i])
-
-        ## Intersection with indices
-        for i in range(len(ids_i)):
-            ids_i[i] = np.intersect1d(ids_ele['main_var'][i], ids_i[i])
+        ids_i, scores_i = [], []
+        for i in range(len(ids_cat['main_var'])):
+            ## Intersection with indices (keeping the order of the scores)
+            logi = self._category_element_mask(ids_ele['main_var'][i],
+                                               ids_cat, i)
+            ids_i.append(np.asarray(ids_ele['main_var'][i])[logi])
+            if 'main_scores' in ids_ele:
+                scores_i.append(ids_ele['main_scores'][i][logi])
 
         ## Categories
         cat_ids = {}
@@ -183,20 +964,41 @@ class DataBaseAPI(object):
             cat_ids[c] =\
                 [np.array([], dtype=np.int64) for i in range(len(ids_i))]
         ids = {'main_var': ids_i, 'cat_vars': cat_ids}
+        if 'main_scores' in ids_ele:
+            ids['main_scores'] = scores_i
 
         return ids
 
+    def _category_element_mask(self, ids, ids_cat, i):
+        if len(ids)*64 < self.n_rows:
+            ## Few rows: category codes of the rows themselves
+            logi = np.isin(ids, ids_cat['main_var'][i])
+            for c in ids_cat['cat_vars']:
+                logi |= np.isin(self.cats_codes[c][self._as_index(ids)],
+                                ids_cat['cat_vars'][c][i])
+            return logi
+        ## Rows of each queried category united with its own query
+        bitmap = self.cats_index.from_ids(ids_cat['main_var'][i])
+        for c in ids_cat['cat_vars']:
+            bitmap = self.cats_index.union(c, ids_cat['cat_vars'][c][i],
+                                           bitmap)
+        return self.cats_index.contains(bitmap, ids)
+
     def _cross_element_element_query(self, ids0, ids1):
         for i in range(len(ids0['main_var'])):
-            ids0['main_var'][i] = np.intersect1d(ids0['main_var'][i],
-                                                 ids1['main_var'][i])
+            ## Intersection keeping the order of the scores
+            logi = np.isin(ids0['main_var'][i], ids1['main_var'][i])
+            ids0['main_var'][i] = np.asarray(ids0['main_var'][i])[logi]
+            if 'main_scores' in ids0:
+                ids0['main_scores'][i] = ids0['main_scores'][i][logi]
         return ids0
 
     def _cross_category_category_query(self, ids0, ids1):
         for c in ids0['cat_vars']:
             for i in range(len(ids0['cat_vars'][c])):
-                ids0['cat_vars'][c][i] = np.union1d(ids0['cat_vars'][c][i],
-                                                    ids1['cat_vars'][c][i])
+                ids0['cat_vars'][c][i] =\
+                    self.cats_index.union_values(c, ids0['cat_vars'][c][i],
+                                                 ids1['cat_vars'][c][i])
         return ids0
 
 #    def query_intersection(self, queried0, queried1):
@@ -222,24 +1024,31 @@ class DataBaseAPI(object):
 #        return row
 
     def get_label(self, ids):
-        labels = self.data.loc[self.data.index[ids['main_var'][0]],
-                               self.type_vars['label_var']['name']]
-        labels = [str(e) for e in np.round(labels.as_matrix(), decimals=2)]
-        return labels
+        labels = self._get_label_names(self._as_index(ids['main_var'][0]))
+        return labels.tolist()
 
     def get_names(self, ids):
         names = {}
-        main_names = self.data.loc[self.data.index[ids['main_var'][0]],
-                                   self.type_vars['main_var']['name']]
-        names['main_var'] = [e for e in main_names.as_matrix()]
+        ## Lists at the interface: the arrays are internal
+        names['main_var'] =\
+            self._get_main_names(self._as_index(ids['main_var'][0])).tolist()
         names_cat = {}
         for c in self.type_vars['cat_vars']['name']:
             names_cat[c] =\
-                [self.categories[c][i]
-                 for i in ids['cat_vars'][c][0]]
+                list(self.categories_names[c][
+                    self._as_index(ids['cat_vars'][c][0])])
         names['cat_vars'] = names_cat
         return names
 
+    def _get_main_names(self, idx):
+        return self.main_names[idx]
+
+    def _get_label_names(self, idx):
+        return self.label_names[idx]
+
+    def _as_index(self, ids):
+        return np.asarray(ids).astype(np.intp, copy=False)
+
     def get_reponses(self, ids_names):
        ## Initialization of utils
         responses = {}
@@ -249,13 +1058,17 @@ class DataBaseAPI(object):
         category_code = self.responses_formatter['join_cats'][1]
 
         ## Building possible responses
-        responses[self.responses_formatter['main_var'][1]] = self.\
-            responses_formatter['main_var'][0](ids_names['main_var'])
+        names, n_more = self._truncate_items(ids_names['main_var'])
+        responses[self.responses_formatter['main_var'][1]] =\
+            self._more_items(self.responses_formatter['main_var'][0](names),
+                             n_more)
         responses_cat = []
         for c, f in self.responses_formatter['cat_vars'].items():
             if len(ids_names['cat_vars'][c]):
-                responses_cat.append(f(self.cats_codenames[c],
-                                       ids_names['cat_vars'][c]))
+                names, n_more = self._truncate_items(ids_names['cat_vars'][c])
+                responses_cat.append(
+                    self._more_items(f(self.cats_codenames[c], names),
+                                     n_more))
         responses[category_code] = category_joiner(responses_cat)
 
         return responses
@@ -270,43 +1083,140 @@ class DataBaseAPI(object):
         category_code = self.responses_formatter['join_cats'][1]
 
         ## Building possible responses
-        responses[self.responses_formatter['label_var'][1]] = self.\
-            responses_formatter['label_var'][0](ids_names['main_var'],
-                                                self.get_label(ids))
+        names, n_more = self._truncate_items(ids_names['main_var'])
+        labels, _ = self._truncate_items(self.get_label(ids))
+        responses[self.responses_formatter['label_var'][1]] =\
+            self._more_items(self.responses_formatter['label_var'][0](names,
+                                                                      labels),
+                             n_more)
         responses_cat = []
         for c, f in self.responses_formatter['cat_vars'].items():
             if len(ids_names['cat_vars'][c]):
-                responses_cat.append(f(self.cats_codenames[c],
-                                       ids_names['cat_vars'][c]))
+                names, n_more = self._truncate_items(ids_names['cat_vars'][c])
+                responses_cat.append(
+                    self._more_items(f(self.cats_codenames[c], names),
+                                     n_more))
         responses[category_code] = category_joiner(responses_cat)
         return ids_names, responses
 
+    def _truncate_items(self, names):
+        ## First `max_items` names to render and the number of the others
+        max_items = self.responses_formatter.get('max_items')
+        if (max_items is None) or (len(names) <= max_items):
+            return names, 0
+        return names[:max_items], len(names)-max_items
+
+    def _more_items(self, response, n_more):
+        if n_more == 0:
+            return response
+        more_items = self.responses_formatter.get('more_items',
+                                                  format_more_items)
+        return response+more_items(n_more)
+
     def get_query_info(self, keywords, pre=None, label=None):
+        key = self._query_cache_key(keywords, pre, label)
+        query_info = self._get_cached_query_info(key)
+        if query_info is not None:
+            return query_info
         ids, pars = self.query(keywords, pre, label)
         query_info = self.get_query_info_from_ids(ids, **pars)
-        return query_info
+        return self._set_cached_query_info(key, query_info)
 
     def get_query_responses(self, ids, label=False):
+        key = self._responses_cache_key(ids, label)
+        if key is not None:
+            cached = self.responses_cache.get(key)
+            if cached is not None:
+                return thaw(cached)
         if label:
             ids_names, responses = self.get_label_reponses(ids)
         else:
             ids_names = self.get_names(ids)
             responses = self.get_reponses(ids_names)
+        if key is not None:
+            self.responses_cache.set(key, freeze((ids_names, responses)))
         return ids_names, responses
 
+    def _responses_cache_key(self, ids, label):
+        ## The responses depend only on the first result
+        if self.responses_cache is None:
+            return None
+        result = [ids['main_var'][0]] +\
+            [ids['cat_vars'][c][0] for c in self.type_vars['cat_vars']['name']]
+        return (fingerprint(result), bool(label), self._generation)
+
     def get_query_info_from_ids(self, ids, label=False, query_result={}):
         ids_names, responses = self.get_query_responses(ids, label)
         query_info = {'query': {'query_idxs': ids, 'query_names': ids_names,
                                 'query_pars': {'label': label},
-                                'query_result': query_result},
+                                'query_result': query_result,
+                                'query_facets': self._query_facets(ids)},
                       'answer_names': responses}
         return query_info
 
+    def _query_facets(self, ids):
+        ## Every answer has the precomputed facets of the category values.
+        ## Counting the rows of the results costs O(result), so it is done
+        ## only if the `responses_formatter` asks for it in `facets_rows`
+        rows = self.responses_formatter.get('facets_rows', False)
+        return self.get_facets(ids, rows=rows)
+
+    ################################# Facets #################################
+    def get_facets(self, ids, rows=True):
+        """Number of rows of each category value in the result of every
+        keyword (only the values with rows, the most frequent first). The
+        facets of the values of a single category come from the precomputed
+        counts. The ones of the elements and of the values of several
+        categories are counted from their rows, or empty if not `rows`.
+        """
+        cat_names = self.type_vars['cat_vars']['name']
+        facets = dict([(c, []) for c in cat_names])
+        for i in range(len(ids['main_var'])):
+            cat_values = dict([(c, v[i])
+                               for c, v in ids.get('cat_vars', {}).items()
+                               if (i < len(v)) and len(v[i])])
+            if len(ids['main_var'][i]):
+                counts = self._rows_facets(ids['main_var'][i]) if rows\
+                    else {}
+            elif (len(cat_values) == 1) or (rows and cat_values):
+                counts = self._values_facets(cat_values)
+            else:
+                counts = {}
+            for c in cat_names:
+                facets[c].append(self._format_facet(c, counts.get(c)))
+        return facets
+
+    def _rows_facets(self, rows):
+        return self.facets.rows_facets(self.cats_codes, self._as_index(rows))
+
+    def _values_facets(self, cat_values):
+        if len(cat_values) == 1:
+            c, values = list(cat_values.items())[0]
+            return self.facets.values_facets(c, values)
+        ## Union of several categories: rows of the bitmap
+        bitmap = self.cats_index.empty()
+        for c in cat_values:
+            bitmap = self.cats_index.union(c, cat_values[c], bitmap)
+        return self._rows_facets(self.cats_index.to_ids(bitmap))
+
+    def _format_facet(self, c, counts):
+        if counts is None:
+            return {}
+        values = np.nonzero(counts)[0]
+        values = values[np.argsort(-counts[values], kind='stable')]
+        return dict([(self.categories[c][j], int(counts[j]))
+                     for j in values])
+
     def get_reflection_query(self, message):
-        query_info = {'query': {'query_idxs': message['query']['query_idxs'],
+        query_idxs = message['query']['query_idxs']
+        ## Only the ids dicts are compacted, in a copy of the message ids
+        if isinstance(query_idxs, dict):
+            query_idxs = self._compact_ids(self._copy_ids(query_idxs))
+        query_info = {'query': {'query_idxs': query_idxs,
                       'query_names': message['query']['query_names'],
                       'query_pars': message['query']['query_pars'],
-                      'query_result': message['query']['query_result']},
+                      'query_result': message['query']['query_result'],
+                      'query_facets': message['query'].get('query_facets')},
                       'answer_names': message['answer_names']}
         return query_info
 
@@ -321,7 +1231,7 @@ class DataBaseAPI(object):
 #                if pre['query'] is not None:
 #                    pars = pre['query']['query_pars']
             if 'query_pars' in pre:
-                pars = pre['query_pars']
+                pars = copy.copy(pre['query_pars'])
         if label:
             pars['label'] = True
 
@@ -339,6 +1249,11 @@ class DataBaseAPI(object):
         return (not labels_old) and new_labels
 
 
+def format_more_items(n_more):
+    """Default text of the items which are not rendered."""
+    return ' (and %d more)' % n_more
+
+
 class DummyRetriever(object):
 
     def __init__(self, radius):
@@ -0,0 +1,158 @@
+"""
+DBAPI caching
+-------------
+Bounded caches to reuse the results of `DataBaseAPI` for the repeated
+queries of the users.
+
+"""
+
+import time
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe least recently used cache with optional time to live.
+
+    It keeps counters of the hits, misses and evictions (entries removed
+    because of the size limit or because they expired).
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.monotonic):
+        assert(maxsize > 0)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return (key in self._entries) and (not self._expired(key))
+
+    def _expired(self, key):
+        if self.ttl is None:
+            return False
+        return (self.timer()-self._entries[key][0]) > self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                if not self._expired(key):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][1]
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.timer(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries),
+                'maxsize': self.maxsize}
+
+
+def create_cache(cache_pars):
+    """Instantiate a cache from its parameters (`None` for no cache)."""
+    if cache_pars is None:
+        return None
+    return LRUCache(**cache_pars)
+
+
+############################## Cached structures ##############################
+###############################################################################
+def freeze(obj):
+    """Copy the containers of a query structure with read-only arrays, so
+    it could be safely stored in a cache. The writable arrays are copied
+    (the ones of the caller keep their flags) and the read-only ones are
+    shared.
+    """
+    if isinstance(obj, dict):
+        return dict([(k, freeze(v)) for k, v in obj.items()])
+    elif isinstance(obj, list):
+        return [freeze(e) for e in obj]
+    elif isinstance(obj, tuple):
+        return tuple([freeze(e) for e in obj])
+    elif isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return _object_array([freeze(e) for e in obj])
+        if obj.flags.writeable:
+            obj = obj.copy()
+            obj.flags.writeable = False
+        return obj
+    return obj
+
+
+def thaw(obj):
+    """Copy the containers of a frozen query structure so the caller could
+    modify them. The read-only arrays are shared.
+    """
+    if isinstance(obj, dict):
+        return dict([(k, thaw(v)) for k, v in obj.items()])
+    elif isinstance(obj, list):
+        return [thaw(e) for e in obj]
+    elif isinstance(obj, tuple):
+        return tuple([thaw(e) for e in obj])
+    elif isinstance(obj, np.ndarray) and (obj.dtype == object):
+        return _object_array([thaw(e) for e in obj])
+    return obj
+
+
+def _object_array(elements):
+    array = np.empty(len(elements), dtype=object)
+    for i, e in enumerate(elements):
+        array[i] = e
+    return array
+
+
+def fingerprint(obj):
+    """Hash of a nested structure of dicts, lists and arrays."""
+    hasher = hashlib.blake2b(digest_size=16)
+    _update_fingerprint(hasher, obj)
+    return hasher.hexdigest()
+
+
+def _update_fingerprint(hasher, obj):
+    if isinstance(obj, dict):
+        hasher.update(b'{')
+        for k in sorted(obj.keys(), key=str):
+            hasher.update(repr(k).encode())
+            _update_fingerprint(hasher, obj[k])
+        hasher.update(b'}')
+    elif isinstance(obj, (list, tuple)) or\
+            (isinstance(obj, np.ndarray) and (obj.dtype == object)):
+        hasher.update(b'[')
+        for e in obj:
+            _update_fingerprint(hasher, e)
+        hasher.update(b']')
+    elif isinstance(obj, np.ndarray):
+        ## Ids are hashed independently of their integer dtype
+        if obj.size == 0:
+            hasher.update(('empty%s' % (obj.shape,)).encode())
+        elif obj.dtype.kind in 'iu':
+            hasher.update(('int%s' % (obj.shape,)).encode())
+            hasher.update(np.ascontiguousarray(obj, np.int64).tobytes())
+        else:
+            hasher.update(('%s%s' % (obj.dtype.str, obj.shape)).encode())
+            hasher.update(np.ascontiguousarray(obj).tobytes())
+    else:
+        hasher.update(repr(obj).encode())
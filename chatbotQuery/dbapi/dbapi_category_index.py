@@ -0,0 +1,367 @@
+"""
+DBAPI category index
+--------------------
+Bitmap representation of the rows which belong to each category value.
+The sets of rows are packed in `np.uint64` words (the bit `i % 64` of the
+word `i // 64` represents the row `i`), so unions and intersections of the
+category queries are vectorized bitwise operations. The facet counts of
+the category values are precomputed too.
+
+Both structures are updated in place with the contributions of the rows
+changed by the catalog updates, so an update costs O(changed rows) instead
+of O(catalog).
+
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+ONE = np.uint64(1)
+WORD_BITS = np.arange(64, dtype=np.uint64)
+
+
+class CategoryBitmapIndex(object):
+    """Bitmaps of the rows of each category value.
+
+    Only the values dense enough (more than one row every 64 rows) store
+    a precomputed bitmap; the sparse ones are scattered from their postings
+    when queried, so the index never needs more memory than the postings.
+    The values which lose rows in the updates keep their bitmaps. The
+    bitmaps of the updatable indices are views of buffers which double
+    their capacity when full.
+    """
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.n_words = (n_rows+63) // 64
+        self.cats_ids = {}
+        self.dense_rows = {}
+        self.bitmaps = {}
+        self._buffers = {}
+
+    @classmethod
+    def from_cats_ids(cls, cats_ids, categories, n_rows):
+        index = cls(n_rows)
+        for c in categories:
+            postings = [cats_ids[c][v] for v in categories[c]]
+            dense = [j for j, ids in enumerate(postings)
+                     if len(ids)*64 >= n_rows]
+            bitmaps = np.zeros((len(dense), index.n_words), dtype=np.uint64)
+            for k, j in enumerate(dense):
+                bitmaps[k] = index.from_ids(postings[j])
+            index._set_category(c, postings, dense, bitmaps)
+        return index
+
+    @classmethod
+    def from_arrays(cls, cats_ids, categories, n_rows, dense, bitmaps):
+        """Build the index from precomputed dense values and bitmaps."""
+        index = cls(n_rows)
+        for c in categories:
+            postings = [cats_ids[c][v] for v in categories[c]]
+            index._set_category(c, postings, dense[c], bitmaps[c])
+        return index
+
+    def resize(self, n_rows):
+        """Extend the index to `n_rows` rows."""
+        n_words = (n_rows+63) // 64
+        for c in self.bitmaps:
+            buffer = self._buffers[c]
+            if (buffer.shape[1] < n_words) or (not buffer.flags.writeable):
+                buffer = self._reallocate(c, buffer.shape[0], 2*n_words)
+            self.bitmaps[c] = buffer[:len(self.bitmaps[c]), :n_words]
+        self.n_rows, self.n_words = n_rows, n_words
+
+    def update(self, c, postings, added, removed):
+        """Update in place the category `c` with the new `postings` of the
+        values which gained the rows `added` or lost the rows `removed`
+        (dictionaries keyed by value position, the new values are the next
+        positions). Only the bits of these rows are changed; the sparse
+        values which become dense get their bitmap.
+        """
+        n_new = max(postings)+1-len(self.cats_ids[c]) if postings else 0
+        if n_new > 0:
+            self.cats_ids[c] = self.cats_ids[c]+[None]*n_new
+            self.dense_rows[c] = np.concatenate(
+                [self.dense_rows[c], -np.ones(n_new, dtype=np.int64)])
+        for j, ids in postings.items():
+            self.cats_ids[c][j] = ids
+        if not self._buffers[c].flags.writeable:
+            self._reallocate(c, *self._buffers[c].shape)
+        for j, ids in removed.items():
+            if self.dense_rows[c][j] >= 0:
+                self.clear_ids(ids, self.bitmaps[c][self.dense_rows[c][j]])
+        for j, ids in added.items():
+            if self.dense_rows[c][j] >= 0:
+                self.from_ids(ids, self.bitmaps[c][self.dense_rows[c][j]])
+            elif len(self.cats_ids[c][j])*64 >= self.n_rows:
+                self.from_ids(self.cats_ids[c][j], self._add_dense(c, j))
+
+    def _add_dense(self, c, j):
+        ## Bitmap of the value `j` which has become dense
+        k = len(self.bitmaps[c])
+        buffer = self._buffers[c]
+        if buffer.shape[0] <= k:
+            buffer = self._reallocate(c, 2*k+1, buffer.shape[1])
+        self.bitmaps[c] = buffer[:k+1, :self.n_words]
+        self.dense_rows[c][j] = k
+        return self.bitmaps[c][k]
+
+    def _reallocate(self, c, n_dense, n_words):
+        buffer = np.zeros((n_dense, n_words), dtype=np.uint64)
+        bitmaps = self.bitmaps[c]
+        buffer[:bitmaps.shape[0], :bitmaps.shape[1]] = bitmaps
+        self._buffers[c] = buffer
+        self.bitmaps[c] = buffer[:bitmaps.shape[0], :bitmaps.shape[1]]
+        return buffer
+
+    def _set_category(self, c, postings, dense, bitmaps):
+        self.cats_ids[c] = postings
+        self.dense_rows[c] = -np.ones(len(postings), dtype=np.int64)
+        self.dense_rows[c][np.asarray(dense, dtype=np.int64)] =\
+            np.arange(len(dense))
+        self.bitmaps[c] = bitmaps
+        self._buffers[c] = bitmaps
+
+    def dense_values(self, c):
+        return np.nonzero(self.dense_rows[c] >= 0)[0]
+
+    ############################## Conversions ###############################
+    def empty(self):
+        return np.zeros(self.n_words, dtype=np.uint64)
+
+    def from_ids(self, ids, bitmap=None):
+        """Bitmap of the rows `ids` (or the rows added to `bitmap`)."""
+        bitmap = self.empty() if bitmap is None else bitmap
+        ids = np.asarray(ids, dtype=np.int64)
+        np.bitwise_or.at(bitmap, ids >> 6,
+                         np.left_shift(ONE, (ids & 63).astype(np.uint64)))
+        return bitmap
+
+    def clear_ids(self, ids, bitmap):
+        """Remove the rows `ids` from `bitmap`."""
+        ids = np.asarray(ids, dtype=np.int64)
+        np.bitwise_and.at(bitmap, ids >> 6,
+                          ~np.left_shift(ONE, (ids & 63).astype(np.uint64)))
+        return bitmap
+
+    def to_ids(self, bitmap):
+        """Sorted rows which are in the bitmap."""
+        words = np.nonzero(bitmap)[0]
+        bits = (bitmap[words][:, None] >> WORD_BITS) & ONE
+        w, b = np.nonzero(bits)
+        return (words[w]*64+b).astype(np.int64)
+
+    def contains(self, bitmap, ids):
+        """Boolean mask of the rows `ids` which are in the bitmap."""
+        ids = np.asarray(ids, dtype=np.int64)
+        bits = bitmap[ids >> 6] >> (ids & 63).astype(np.uint64)
+        return (bits & ONE).astype(bool)
+
+    def filter(self, ids, bitmap):
+        """Rows of `ids` which are in the bitmap, keeping their order."""
+        ids = np.asarray(ids)
+        return ids[self.contains(bitmap, ids)]
+
+    ############################### Operations ###############################
+    def union(self, c, values, bitmap=None):
+        """Bitmap of the rows which have any of the `values` (positions in
+        the list of categories) of the category `c`.
+        """
+        bitmap = self.empty() if bitmap is None else bitmap
+        values = np.asarray(values, dtype=np.int64)
+        rows = self.dense_rows[c][values]
+        if np.any(rows >= 0):
+            bitmap |= np.bitwise_or.reduce(self.bitmaps[c][rows[rows >= 0]],
+                                           axis=0)
+        sparse_values = values[rows < 0]
+        if len(sparse_values):
+            ids = np.concatenate([self.cats_ids[c][v] for v in sparse_values])
+            self.from_ids(ids, bitmap)
+        return bitmap
+
+    def union_values(self, c, *values):
+        """Sorted union of sets of values of the category `c`."""
+        mask = np.zeros(len(self.cats_ids[c]), dtype=bool)
+        for v in values:
+            mask[np.asarray(v, dtype=np.int64)] = True
+        return np.nonzero(mask)[0]
+
+
+class FacetCounts(object):
+    """Precomputed number of rows of each category value and co-occurrence
+    counts of the values of every pair of categories, so the facets of a
+    set of category values are obtained without visiting its rows.
+
+    Each unordered pair of categories is stored once, in the order of the
+    categories. The updates change the counts in place, while the
+    co-occurrences of the updated rows are kept as pending (values of the
+    first category, values of the second one, weights) triplets until they
+    outnumber the stored ones and they are merged.
+    """
+
+    def __init__(self, counts, cooccurrences):
+        self.counts = counts
+        self.cooccurrences = cooccurrences
+        self.pending = dict([(pair, []) for pair in cooccurrences])
+
+    @classmethod
+    def from_codes(cls, cats_codes, categories):
+        """Counts from the value position of each row (-1 for no value)."""
+        counts, cooccurrences = {}, {}
+        names = list(categories)
+        for c in names:
+            codes = np.asarray(cats_codes[c])
+            counts[c] = np.bincount(codes[codes >= 0],
+                                    minlength=len(categories[c]))
+        for k, c0 in enumerate(names):
+            for c1 in names[k+1:]:
+                codes0 = np.asarray(cats_codes[c0])
+                codes1 = np.asarray(cats_codes[c1])
+                logi = (codes0 >= 0) & (codes1 >= 0)
+                shape = (len(categories[c0]), len(categories[c1]))
+                cooccurrences[(c0, c1)] = sparse.csr_matrix(
+                    (np.ones(logi.sum(), dtype=np.int64),
+                     (codes0[logi], codes1[logi])), shape=shape)
+        return cls(counts, cooccurrences)
+
+    def to_arrays(self, names):
+        """Arrays of the counts (`counts_<i>`) and of the co-occurrences of
+        each pair (`<data|indices|indptr>_<i>_<j>`) by the positions of the
+        categories in `names`. The pending co-occurrences are merged.
+        """
+        arrays = {}
+        for i, c in enumerate(names):
+            arrays['counts_%d' % i] = self.counts[c]
+        for (c0, c1), cooccurrence in list(self.cooccurrences.items()):
+            if self.pending[(c0, c1)]:
+                self._merge((c0, c1), (len(self.counts[c0]),
+                                       len(self.counts[c1])))
+            cooccurrence = self.cooccurrences[(c0, c1)]
+            key = '%d_%d' % (names.index(c0), names.index(c1))
+            arrays['data_'+key] = cooccurrence.data
+            arrays['indices_'+key] = cooccurrence.indices
+            arrays['indptr_'+key] = cooccurrence.indptr
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, names):
+        """Counts from the arrays built by `to_arrays`, without copying."""
+        counts = dict([(c, arrays['counts_%d' % i])
+                       for i, c in enumerate(names)])
+        cooccurrences = {}
+        for k, c0 in enumerate(names):
+            for j, c1 in enumerate(names[k+1:], k+1):
+                key = '%d_%d' % (k, j)
+                indptr = arrays['indptr_'+key]
+                shape = (len(indptr)-1, len(counts[c1]))
+                cooccurrences[(c0, c1)] = sparse.csr_matrix(
+                    (arrays['data_'+key], arrays['indices_'+key], indptr),
+                    shape=shape, copy=False)
+        return cls(counts, cooccurrences)
+
+    def update(self, old_codes, new_codes, n_values):
+        """Move the contributions of some rows from their value positions
+        `old_codes` to `new_codes` (dictionaries of arrays by category, -1
+        for no value). `n_values` is the number of values of each category.
+        """
+        for c in self.counts:
+            n_new = n_values[c]-len(self.counts[c])
+            if n_new > 0:
+                self.counts[c] = np.concatenate(
+                    [self.counts[c], np.zeros(n_new, dtype=np.int64)])
+            elif not self.counts[c].flags.writeable:
+                ## Counts loaded from read-only arrays
+                self.counts[c] = np.array(self.counts[c])
+            for codes, weight in [(old_codes[c], -1), (new_codes[c], 1)]:
+                np.add.at(self.counts[c], codes[codes >= 0], weight)
+        for (c0, c1) in self.cooccurrences:
+            pending = self.pending[(c0, c1)]
+            for codes, weight in [(old_codes, -1), (new_codes, 1)]:
+                logi = (codes[c0] >= 0) & (codes[c1] >= 0)
+                if np.any(logi):
+                    pending.append((codes[c0][logi], codes[c1][logi],
+                                    np.full(logi.sum(), weight,
+                                            dtype=np.int64)))
+            n_pending = sum([len(w) for _, _, w in pending])
+            if n_pending > self.cooccurrences[(c0, c1)].nnz:
+                self._merge((c0, c1), (n_values[c0], n_values[c1]))
+
+    def _merge(self, pair, shape):
+        ## Pending co-occurrences added to the matrix of the pair
+        cooccurrence = self.cooccurrences[pair].tocoo()
+        rows = [cooccurrence.row]+[r for r, _, _ in self.pending[pair]]
+        cols = [cooccurrence.col]+[c for _, c, _ in self.pending[pair]]
+        weights = [cooccurrence.data]+[w for _, _, w in self.pending[pair]]
+        cooccurrence = sparse.csr_matrix(
+            (np.concatenate(weights).astype(np.int64),
+             (np.concatenate(rows), np.concatenate(cols))), shape=shape)
+        cooccurrence.eliminate_zeros()
+        self.cooccurrences[pair] = cooccurrence
+        self.pending[pair] = []
+
+    def values_facets(self, c, values):
+        """Counts of the values of every category among the rows with any
+        of the `values` (positions) of the category `c`.
+        """
+        values = np.unique(np.asarray(values, dtype=np.int64))
+        facets = {c: np.zeros(len(self.counts[c]), dtype=np.int64)}
+        facets[c][values] = self.counts[c][values]
+        mask = np.zeros(len(self.counts[c]), dtype=np.int64)
+        mask[values] = 1
+        for (c0, c1), cooccurrence in self.cooccurrences.items():
+            if c not in (c0, c1):
+                continue
+            other = c1 if c == c0 else c0
+            if c == c0:
+                counts = cooccurrence.T.dot(mask[:cooccurrence.shape[0]])
+            else:
+                counts = cooccurrence.dot(mask[:cooccurrence.shape[1]])
+            facets[other] = np.zeros(len(self.counts[other]), dtype=np.int64)
+            facets[other][:len(counts)] = counts
+            for codes0, codes1, weights in self.pending[(c0, c1)]:
+                codes, others = (codes0, codes1) if c == c0 else\
+                    (codes1, codes0)
+                logi = mask[codes] > 0
+                np.add.at(facets[other], others[logi], weights[logi])
+        return facets
+
+    def rows_facets(self, cats_codes, rows):
+        """Counts of the values of every category among the `rows`."""
+        rows = np.asarray(rows, dtype=np.int64)
+        facets = {}
+        for c in self.counts:
+            codes = np.asarray(cats_codes[c])[rows]
+            facets[c] = np.bincount(codes[codes >= 0],
+                                    minlength=len(self.counts[c]))
+        return facets
+
+
+def group_rows(values):
+    """Distinct values (in order of appearance, as `pd.Series.unique`), the
+    sorted rows of each one and the position of the value of each row (-1
+    for the null values, which have no rows), grouped in a single pass with
+    a stable argsort of the factorized codes.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    limits = np.concatenate([[0], np.cumsum(counts)])+np.sum(codes < 0)
+    categories = list(np.asarray(uniques))
+    cats_ids = dict([(v, order[limits[k]:limits[k+1]].astype(np.int64))
+                     for k, v in enumerate(categories)])
+    ## Null values (None, nan...) in the position of their first appearance
+    positions = np.arange(len(uniques))
+    nulls = np.nonzero(codes < 0)[0]
+    if len(nulls):
+        null_values = values.iloc[nulls].to_numpy()
+        null_types = [type(v) for v in null_values]
+        for j, null in enumerate(pd.unique(null_values)):
+            first = nulls[null_types.index(type(null))]
+            position = (codes[:first].max()+1 if first else 0)+j
+            categories.insert(position, null)
+            cats_ids[null] = np.array([], dtype=np.int64)
+            positions[positions >= position] += 1
+    codes = np.where(codes >= 0, positions[codes], -1).astype(np.int32)
+    return categories, cats_ids, codes
@@ -0,0 +1,92 @@
+"""
+DBAPI fuzzy
+-----------
+Index of the words of the catalog tolerant to misspellings, used by
+`DataBaseAPI` to correct the keywords which do not retrieve anything.
+The candidates of a word are blocked by its deletion neighborhood (the
+strings obtained deleting up to its maximum number of edits characters),
+so only a few words of the vocabulary are compared with the
+Damerau-Levenshtein distance.
+
+"""
+
+import re
+import itertools
+import numpy as np
+import jellyfish
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def max_edits(word):
+    """Maximum accepted edit distance of a word (as `Words_collapser`): 0
+    up to 3 characters, 1 up to 7 and 2 for the longer ones.
+    """
+    return int(min(max(np.floor(np.log2(max(len(word), 2)))-1, 0), 2))
+
+
+def deletions(word, n_edits):
+    """Strings obtained deleting up to `n_edits` characters of the word."""
+    neighborhood = set([word])
+    for n in range(1, min(n_edits, len(word)-1)+1):
+        for positions in itertools.combinations(range(len(word)), n):
+            neighborhood.add(''.join([ch for i, ch in enumerate(word)
+                                      if i not in positions]))
+    return neighborhood
+
+
+class FuzzyWordIndex(object):
+    """Deletion-neighborhood index of the words of a set of texts.
+
+    A word is corrected to the word of the vocabulary with the smallest
+    Damerau-Levenshtein distance (up to `max_edits` of the word), the most
+    frequent one in case of ties. The words of the vocabulary are kept
+    as they are.
+    """
+
+    def __init__(self):
+        self.frequencies = {}
+        self.neighborhoods = {}
+
+    def fit(self, texts):
+        self.frequencies, self.neighborhoods = {}, {}
+        return self.add(texts)
+
+    def add(self, texts):
+        """Add the words of the `texts` to the vocabulary."""
+        for text in texts:
+            for word in self.tokenize(text):
+                if word not in self.frequencies:
+                    self.frequencies[word] = 0
+                    for key in deletions(word, max_edits(word)):
+                        self.neighborhoods.setdefault(key, []).append(word)
+                self.frequencies[word] += 1
+        return self
+
+    def tokenize(self, text):
+        return TOKEN_PATTERN.findall(str(text).lower())
+
+    def correct_word(self, word):
+        """Closest word of the vocabulary (or the word itself if there is
+        none close enough).
+        """
+        word = word.lower()
+        n_edits = max_edits(word)
+        if (word in self.frequencies) or (n_edits == 0):
+            return word
+        candidates = set()
+        for key in deletions(word, n_edits):
+            candidates.update(self.neighborhoods.get(key, []))
+        best, best_key = word, None
+        for candidate in candidates:
+            distance = jellyfish.damerau_levenshtein_distance(word, candidate)
+            key = (distance, -self.frequencies[candidate], candidate)
+            if (distance <= n_edits) and ((best_key is None) or
+                                          (key < best_key)):
+                best, best_key = candidate, key
+        return best
+
+    def correct(self, text):
+        """Text in lower case with its words corrected."""
+        return TOKEN_PATTERN.sub(lambda m: self.correct_word(m.group(0)),
+                                 str(text).lower())
@@ -0,0 +1,49 @@
+"""
+DBAPI memory
+------------
+Estimation of the memory used by the structures of `DataBaseAPI` and of the
+queries stored by the conversation handlers.
+
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def nbytes(obj, seen=None):
+    """Bytes used by an object and everything it references (numpy arrays,
+    sparse matrices, dataframes, containers and the attributes of plain
+    objects), counting each referenced object once. Memory-mapped arrays
+    are counted with their mapped size.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        size = obj.nbytes
+        if obj.dtype == object:
+            size += sum([nbytes(e, seen) for e in obj.ravel()])
+        return size
+    elif sparse.issparse(obj):
+        obj = obj.tocsr() if obj.format not in ['csr', 'csc'] else obj
+        return obj.data.nbytes+obj.indices.nbytes+obj.indptr.nbytes
+    elif isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True).sum()) if\
+            isinstance(obj, pd.DataFrame) else int(obj.memory_usage(deep=True))
+    elif isinstance(obj, dict):
+        return sys.getsizeof(obj)+sum([nbytes(k, seen)+nbytes(v, seen)
+                                       for k, v in obj.items()])
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj)+sum([nbytes(e, seen) for e in obj])
+    elif hasattr(obj, '__dict__') and not callable(obj) and\
+            not isinstance(obj, type(sys)):
+        return sys.getsizeof(obj)+nbytes(vars(obj), seen)
+    return sys.getsizeof(obj)
+
+
+def memory_report(structures):
+    """Bytes of each one of the named `structures`."""
+    return dict([(k, nbytes(v)) for k, v in structures.items()])
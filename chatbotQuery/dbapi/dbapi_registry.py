@@ -0,0 +1,155 @@
+"""
+DBAPI registry
+--------------
+Process-wide registry of the built `DataBaseAPI`, so every conversation
+handler configured with the same database shares a single instance instead
+of reading and fitting the catalog again.
+
+"""
+
+import os
+import types
+import hashlib
+import weakref
+import threading
+import pandas as pd
+
+from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_caching import fingerprint
+
+
+class DataBaseAPIRegistry(object):
+    """Registry of shared `DataBaseAPI` keyed by a hash of their resolved
+    parameters. The modification time of their data files is stored with
+    the instances, which are built again when the files change.
+
+    The instances are built once and handed out to every caller, so they
+    are marked as read-only: their catalog updates raise a ValueError. The
+    registry is fork-safe: the forked
+    children keep the already built instances (shared copy-on-write with
+    the parent) but renew the lock, which could be held by another thread
+    of the parent at the moment of the fork.
+    """
+
+    def __init__(self, builder=None):
+        self.builder = DataBaseAPI.from_parameters if builder is None\
+            else builder
+        self._instances = {}
+        self._reset_lock()
+        if hasattr(os, 'register_at_fork'):
+            ref = weakref.ref(self)
+
+            def after_in_child():
+                registry = ref()
+                if registry is not None:
+                    registry._reset_lock()
+            os.register_at_fork(after_in_child=after_in_child)
+
+    def _reset_lock(self):
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        ## Fallback for the platforms without `os.register_at_fork`
+        if self._pid != os.getpid():
+            self._reset_lock()
+
+    def __len__(self):
+        return len(self._instances)
+
+    def __contains__(self, parameters):
+        return self.key(parameters) in self._instances
+
+    def key(self, parameters):
+        return fingerprint(describe_parameters(parameters))
+
+    def get(self, parameters):
+        """Shared `DataBaseAPI` of the parameters, built if needed or if
+        their data files have been modified since it was built.
+        """
+        self._check_process()
+        description = describe_parameters(parameters)
+        key, mtimes = fingerprint(description), files_mtimes(description)
+        with self._lock:
+            entry = self._instances.get(key)
+            if (entry is None) or (entry[0] != mtimes):
+                instance = self.builder(parameters)
+                if isinstance(instance, DataBaseAPI):
+                    instance.read_only = True
+                entry = self._instances[key] = (mtimes, instance)
+            return entry[1]
+
+    def invalidate(self, parameters=None):
+        """Forget the instance of the parameters (or all the instances if
+        `parameters` is None), so it will be built again when requested.
+        """
+        self._check_process()
+        with self._lock:
+            if parameters is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(self.key(parameters), None)
+
+
+def describe_parameters(parameters):
+    """Hashable description of the parameters of a `DataBaseAPI`: functions
+    are described by their compiled code (bytecode, constants and names),
+    defaults and closure values, data files by their path and dataframes by
+    a hash of their content.
+    """
+    if isinstance(parameters, dict):
+        return dict([(str(k), describe_parameters(v))
+                     for k, v in parameters.items()])
+    elif isinstance(parameters, (list, tuple)):
+        return [describe_parameters(e) for e in parameters]
+    elif isinstance(parameters, pd.DataFrame):
+        hashes = pd.util.hash_pandas_object(parameters, index=True).values
+        return {'dataframe': fingerprint(hashes),
+                'columns': [str(c) for c in parameters.columns]}
+    elif callable(parameters) and hasattr(parameters, '__code__'):
+        closure = [c.cell_contents for c in (parameters.__closure__ or [])]
+        return {'function': describe_code(parameters.__code__),
+                'defaults': describe_parameters(parameters.__defaults__),
+                'closure': describe_parameters(closure)}
+    elif isinstance(parameters, str) and os.path.isfile(parameters):
+        return {'file': os.path.abspath(parameters)}
+    return parameters
+
+
+def describe_code(code):
+    """Description of a code object: its name, a hash of its bytecode, its
+    constants (with the nested code objects described in turn) and the
+    names it references.
+    """
+    consts = [describe_code(c) if isinstance(c, types.CodeType) else repr(c)
+              for c in code.co_consts]
+    return [code.co_name, hashlib.sha1(code.co_code).hexdigest(), consts,
+            list(code.co_names)]
+
+
+def files_mtimes(description):
+    """Modification times of the data files of a description of parameters
+    (None for the files which no longer exist).
+    """
+    if isinstance(description, dict):
+        if set(description) == {'file'}:
+            path = description['file']
+            return [os.path.getmtime(path) if os.path.isfile(path) else None]
+        return [m for k in sorted(description)
+                for m in files_mtimes(description[k])]
+    elif isinstance(description, list):
+        return [m for e in description for m in files_mtimes(e)]
+    return []
+
+
+default_registry = DataBaseAPIRegistry()
+
+
+def get_shared_database(parameters):
+    """Shared `DataBaseAPI` of the process-wide registry."""
+    return default_registry.get(parameters)
+
+
+def invalidate_shared_databases(parameters=None):
+    """Invalidate instances of the process-wide registry."""
+    default_registry.invalidate(parameters)
@@ -0,0 +1,387 @@
+"""
+DBAPI retrievers
+----------------
+Retrieval backends used by `DataBaseAPI` to find the elements of the
+database related with the keywords of the user.
+
+"""
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from sklearn.neighbors import NearestNeighbors
+
+
+############################### Main retrievers ###############################
+###############################################################################
+class InvertedIndexRetriever(object):
+    """Cosine radius retriever over an inverted index of a fitted sparse
+    matrix.
+
+    The fitted matrix is stored transposed (term -> postings), so a sparse
+    query only visits the postings of its own non-zero terms instead of
+    densifying the query and scoring the whole catalog. It returns the same
+    result set as the brute-force cosine `NearestNeighbors`.
+
+    The index could be updated without refitting: the added elements are
+    stored in new segments and the removed ones are marked as not live
+    (tombstones), keeping the ids of every element. `compact` merges the
+    segments. Each segment is a tuple `(postings, ids, live)` where `ids`
+    and `live` are None for the identity and all live elements. The state
+    is replaced as a whole, so the queries running during an update see
+    either the old or the new index, but the updates should be serialized
+    by the caller.
+    """
+
+    def __init__(self, radius=0.75):
+        self.radius = radius
+
+    def fit(self, data_sp):
+        data_sp = normalize(sparse.csr_matrix(data_sp))
+        self._set_state(((data_sp.T.tocsr(), None, None),),
+                        data_sp.shape[0])
+        return self
+
+    @classmethod
+    def from_postings(cls, postings, radius=0.75):
+        """Build the retriever from an already computed (term, element)
+        normalized postings matrix without copying it.
+        """
+        retriever = cls(radius=radius)
+        retriever._set_state(((postings, None, None),), postings.shape[1])
+        return retriever
+
+    def _set_state(self, segments, n_samples):
+        self._state = (tuple(segments), n_samples)
+        self.n_samples_fit_ = n_samples
+
+    @property
+    def n_segments(self):
+        return len(self._state[0])
+
+    @property
+    def postings(self):
+        """(term, element) postings matrix of the live elements."""
+        segments, n_samples = self._state
+        if (len(segments) == 1) and (segments[0][1] is None) and\
+                (segments[0][2] is None):
+            return segments[0][0]
+        return self._merge(segments, n_samples)
+
+    ################################ Updates ################################
+    def add(self, data_sp, ids=None):
+        """Index new elements with the next ids (or replace the elements
+        `ids`, which are no longer retrieved by their old terms).
+        """
+        data_sp = normalize(sparse.csr_matrix(data_sp))
+        segments, n_samples = self._state
+        if ids is None:
+            ids = np.arange(n_samples, n_samples+data_sp.shape[0])
+        ids = np.asarray(ids, dtype=np.int64)
+        segments = self._remove_segments(segments, ids)
+        if len(ids):
+            n_samples = max(n_samples, int(ids.max())+1)
+        segments += ((data_sp.T.tocsr(), ids, np.ones(len(ids), dtype=bool)),)
+        self._set_state(segments, n_samples)
+        return ids
+
+    def remove(self, ids):
+        """Mark the elements `ids` as removed."""
+        segments, n_samples = self._state
+        ids = np.asarray(ids, dtype=np.int64)
+        self._set_state(self._remove_segments(segments, ids), n_samples)
+
+    def compact(self):
+        """Merge all the segments in one, dropping the removed elements."""
+        segments, n_samples = self._state
+        alive = self._alive(segments, n_samples)
+        self._set_state(((self._merge(segments, n_samples), None, alive),),
+                        n_samples)
+        return self
+
+    def _remove_segments(self, segments, ids):
+        new_segments = []
+        for postings, seg_ids, live in segments:
+            if seg_ids is None:
+                removed = np.zeros(postings.shape[1], dtype=bool)
+                removed[ids[ids < postings.shape[1]]] = True
+            else:
+                removed = np.isin(seg_ids, ids)
+            if np.any(removed):
+                live = ~removed if live is None else live & ~removed
+            new_segments.append((postings, seg_ids, live))
+        return tuple(new_segments)
+
+    def _merge(self, segments, n_samples):
+        rows, cols, data = [], [], []
+        for postings, ids, live in segments:
+            postings = postings.tocoo()
+            logi = np.ones(len(postings.col), dtype=bool) if live is None\
+                else live[postings.col]
+            rows.append(postings.row[logi])
+            cols.append((postings.col if ids is None else ids[postings.col])
+                        [logi])
+            data.append(postings.data[logi])
+        return sparse.csr_matrix((np.concatenate(data),
+                                  (np.concatenate(rows),
+                                   np.concatenate(cols))),
+                                 shape=(segments[0][0].shape[0], n_samples))
+
+    def _alive(self, segments, n_samples):
+        if all([live is None for _, _, live in segments]):
+            return None
+        alive = np.zeros(n_samples, dtype=bool)
+        for postings, ids, live in segments:
+            ids = np.arange(postings.shape[1]) if ids is None else ids
+            alive[ids if live is None else ids[live]] = True
+        return alive
+
+    ################################ Queries ################################
+    def similarities(self, queries_sp):
+        """Cosine similarities between the queries and the fitted elements.
+        Only the entries with a shared term are stored.
+        """
+        queries_sp = normalize(sparse.csr_matrix(queries_sp))
+        segments, n_samples = self._state
+        if (len(segments) == 1) and (segments[0][1] is None) and\
+                (segments[0][2] is None):
+            return queries_sp.dot(segments[0][0]).tocsr()
+        rows, cols, data = [], [], []
+        for postings, ids, live in segments:
+            sims = queries_sp.dot(postings).tocoo()
+            logi = np.ones(len(sims.col), dtype=bool) if live is None\
+                else live[sims.col]
+            rows.append(sims.row[logi])
+            cols.append((sims.col if ids is None else ids[sims.col])[logi])
+            data.append(sims.data[logi])
+        return sparse.csr_matrix((np.concatenate(data),
+                                  (np.concatenate(rows),
+                                   np.concatenate(cols))),
+                                 shape=(queries_sp.shape[0], n_samples))
+
+    def radius_neighbors(self, queries_sp, radius=None):
+        radius = self.radius if radius is None else radius
+        if radius >= 1:
+            # Elements without shared terms are also inside the radius
+            sims = self.similarities(queries_sp).toarray()
+            alive = self._alive(*self._state)
+            if alive is not None:
+                sims[:, ~alive] = -np.inf
+            return self._format_output(
+                [np.nonzero(1-s <= radius)[0] for s in sims],
+                [1-s[1-s <= radius] for s in sims])
+        sims = self.similarities(queries_sp)
+        ids, dists = [], []
+        for i in range(sims.shape[0]):
+            row = slice(sims.indptr[i], sims.indptr[i+1])
+            dist_i = 1-sims.data[row]
+            logi = dist_i <= radius
+            ids_i, dist_i = sims.indices[row][logi], dist_i[logi]
+            order = np.argsort(ids_i)
+            ids.append(ids_i[order].astype(np.int64))
+            dists.append(dist_i[order])
+        return self._format_output(ids, dists)
+
+    def top_neighbors(self, queries_sp, k, score_floor=0.):
+        """The `k` elements with the highest cosine scores (and sharing
+        some term with the query) above `score_floor`, ordered by score.
+        """
+        sims = self.similarities(queries_sp)
+        ids, scores = [], []
+        for i in range(sims.shape[0]):
+            row = slice(sims.indptr[i], sims.indptr[i+1])
+            logi = (sims.data[row] > 0) & (sims.data[row] >= score_floor)
+            ids_i, scores_i = select_top_k(sims.indices[row][logi],
+                                           sims.data[row][logi], k)
+            ids.append(ids_i)
+            scores.append(scores_i)
+        return self._format_output(ids, scores)
+
+    ############################ Subset queries #############################
+    def _subset_similarities(self, queries_sp, rows):
+        ## Cosine similarities of each query with its own subset of rows.
+        ## The rows are searched in the postings of the query terms (sorted
+        ## by element), so no transposed copy of the index is needed and the
+        ## cost depends on the size of the subset
+        queries_sp = normalize(sparse.csr_matrix(queries_sp))
+        segments, _ = self._state
+        for i in range(queries_sp.shape[0]):
+            rows_i = np.unique(np.asarray(rows[i], dtype=np.int64))
+            sims = np.zeros(len(rows_i))
+            query = queries_sp[i]
+            for postings, ids, live in segments:
+                positions, cols = self._segment_columns(postings, ids, live,
+                                                        rows_i)
+                for term, weight in zip(query.indices, query.data):
+                    found, values = self._posting_values(postings, term, cols)
+                    sims[positions[found]] += weight*values
+            yield rows_i, sims
+
+    def _segment_columns(self, postings, ids, live, rows):
+        ## Positions of the live `rows` in the segment and their columns
+        if ids is None:
+            positions = np.nonzero(rows < postings.shape[1])[0]
+            cols = rows[positions]
+        else:
+            order = np.argsort(ids, kind='stable')
+            j = np.minimum(np.searchsorted(ids[order], rows), len(ids)-1)
+            positions = np.nonzero(ids[order][j] == rows)[0]
+            cols = order[j[positions]]
+        if live is not None:
+            logi = live[cols]
+            positions, cols = positions[logi], cols[logi]
+        return positions, cols
+
+    def _posting_values(self, postings, term, cols):
+        ## Weights of the columns `cols` in the postings of the term
+        start, end = postings.indptr[term], postings.indptr[term+1]
+        indices = postings.indices[start:end]
+        if not len(indices):
+            return np.zeros(len(cols), dtype=bool), np.array([])
+        j = np.minimum(np.searchsorted(indices, cols), len(indices)-1)
+        found = indices[j] == cols
+        return found, postings.data[start:end][j[found]]
+
+    def radius_neighbors_in(self, queries_sp, rows, radius=None):
+        """`radius_neighbors` of each query only among its subset of
+        `rows`, so its cost depends on the size of the subset.
+        """
+        radius = self.radius if radius is None else radius
+        alive = self._alive(*self._state) if radius >= 1 else None
+        ids, dists = [], []
+        for rows_i, sims in self._subset_similarities(queries_sp, rows):
+            logi = 1-sims <= radius
+            if alive is not None:
+                logi = logi & alive[rows_i]
+            ids.append(rows_i[logi])
+            dists.append(1-sims[logi])
+        return self._format_output(ids, dists)
+
+    def top_neighbors_in(self, queries_sp, rows, k, score_floor=0.):
+        """`top_neighbors` of each query only among its subset of `rows`."""
+        ids, scores = [], []
+        for rows_i, sims in self._subset_similarities(queries_sp, rows):
+            logi = (sims > 0) & (sims >= score_floor)
+            ids_i, scores_i = select_top_k(rows_i[logi], sims[logi], k)
+            ids.append(ids_i)
+            scores.append(scores_i)
+        return self._format_output(ids, scores)
+
+    def _format_output(self, ids, dists):
+        return format_neighbors(ids, dists)
+
+
+############################# Category retrievers #############################
+###############################################################################
+class TokenIndexRetriever(object):
+    """Category retriever with a token -> category ids hash index.
+
+    Drop-in replacement of `DummyRetriever`: each query (list of keywords)
+    retrieves the categories which have at least `radius` coincidences with
+    its keywords. Categories given as token lists match the whole tokens
+    and categories given as text match substrings, optionally helped by an
+    index of the character n-grams of the texts.
+    """
+
+    def __init__(self, radius=1, ngram_index=True, ngram=3):
+        self.n_coinc = radius
+        self.ngram_index = ngram_index
+        self.ngram = ngram
+
+    def fit(self, categories):
+        self.categories = categories
+        token_index, ngrams_index, text_ids = {}, {}, []
+        for i, category in enumerate(categories):
+            if isinstance(category, str):
+                text_ids.append(i)
+                if self.ngram_index:
+                    for ngram in self._ngrams(category):
+                        ngrams_index.setdefault(ngram, set()).add(i)
+            else:
+                for token in set(category):
+                    token_index.setdefault(token, []).append(i)
+        self.token_index = dict([(k, np.array(v, dtype=np.int64))
+                                 for k, v in token_index.items()])
+        self.ngrams_index = dict([(k, np.array(sorted(v), dtype=np.int64))
+                                  for k, v in ngrams_index.items()])
+        self.text_ids = np.array(text_ids, dtype=np.int64)
+        return self
+
+    def _ngrams(self, text):
+        return set([text[i:i+self.ngram]
+                    for i in range(len(text)-self.ngram+1)])
+
+    def _substring_candidates(self, keyword):
+        if (not self.ngram_index) or (len(keyword) < self.ngram):
+            return self.text_ids
+        candidates = None
+        for ngram in self._ngrams(keyword):
+            if ngram not in self.ngrams_index:
+                return self.text_ids[:0]
+            postings = self.ngrams_index[ngram]
+            candidates = postings if candidates is None else\
+                np.intersect1d(candidates, postings, assume_unique=True)
+        return candidates
+
+    def _matches(self, keyword):
+        matches = [self.token_index.get(keyword, self.text_ids[:0])]
+        if len(self.text_ids):
+            candidates = self._substring_candidates(keyword)
+            matches.append(np.array([i for i in candidates
+                                     if keyword in self.categories[i]],
+                                    dtype=np.int64))
+        return np.concatenate(matches)
+
+    def radius_neighbors(self, keywords):
+        retrieved = []
+        for kwrds in keywords:
+            matches = [self._matches(keyword) for keyword in kwrds]
+            if (not matches) or (self.n_coinc < 1):
+                retrieved.append(np.array([]))
+                continue
+            ids, counts = np.unique(np.concatenate(matches),
+                                    return_counts=True)
+            ids = ids[counts >= self.n_coinc]
+            retrieved.append(ids if len(ids) else np.array([]))
+        return retrieved
+
+
+def format_neighbors(ids, dists):
+    """Same structure than the `NearestNeighbors` output."""
+    ids_arr = np.empty(len(ids), dtype=object)
+    dists_arr = np.empty(len(dists), dtype=object)
+    for i in range(len(ids)):
+        ids_arr[i], dists_arr[i] = ids[i], dists[i]
+    return dists_arr, ids_arr
+
+
+def select_top_k(ids, scores, k):
+    """The `k` ids with the highest scores ordered by score (and id for
+    ties), using a partial selection instead of sorting all of them.
+    """
+    if len(ids) > k:
+        top = np.argpartition(-scores, k-1)[:k]
+        ## The ties of the last score selected by id too
+        threshold = scores[top].min()
+        above = np.nonzero(scores > threshold)[0]
+        ties = np.nonzero(scores == threshold)[0]
+        ties = ties[np.argsort(ids[ties], kind='stable')[:k-len(above)]]
+        top = np.concatenate([above, ties])
+        ids, scores = ids[top], scores[top]
+    order = np.lexsort((ids, -scores))
+    return ids[order].astype(np.int64), scores[order]
+
+
+def create_main_retriever(retriever, radius):
+    """Instantiate the retriever of the main variable from its
+    specification.
+    """
+    if retriever == 'inverted':
+        return InvertedIndexRetriever(radius=radius)
+    elif retriever == 'brute':
+        return NearestNeighbors(radius=radius, metric='cosine',
+                                algorithm='brute')
+    else:
+        assert(hasattr(retriever, 'fit'))
+        assert(hasattr(retriever, 'radius_neighbors'))
+        return retriever
@@ -0,0 +1,130 @@
+"""
+DBAPI sharding
+--------------
+Scatter-gather retrieval of the main variable over shards of the catalog,
+each one indexed in its own worker process, so the search of big catalogs
+is not limited to a single core.
+
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_retrievers import InvertedIndexRetriever,\
+    format_neighbors, select_top_k
+
+## Retriever of the shard indexed by the worker process
+_shard_retriever = None
+
+
+def _init_shard(data_sp, radius):
+    global _shard_retriever
+    _shard_retriever = InvertedIndexRetriever(radius=radius).fit(data_sp)
+
+
+def _query_shard(method, queries_sp, *args):
+    return getattr(_shard_retriever, method)(queries_sp, *args)
+
+
+class ShardedRetriever(object):
+    """Cosine retriever which partitions the fitted rows in contiguous
+    shards, each one indexed by an `InvertedIndexRetriever` living in its
+    own single-worker process pool. The queries are sent to every shard and
+    their ids are merged with the global offsets of the shards.
+
+    The pools are not fork-safe: the sharded retrievers should not be shared
+    with forked processes.
+    """
+
+    def __init__(self, n_shards=2, radius=0.75, mp_context=None):
+        self.n_shards = n_shards
+        self.radius = radius
+        self.mp_context = mp_context
+        self.pools = []
+
+    def fit(self, data_sp):
+        self.close()
+        n_rows = data_sp.shape[0]
+        n_shards = max(1, min(self.n_shards, n_rows))
+        limits = np.linspace(0, n_rows, n_shards+1).astype(int)
+        self.offsets = limits[:-1]
+        self.n_samples_fit_ = n_rows
+        for start, end in zip(limits[:-1], limits[1:]):
+            self.pools.append(
+                ProcessPoolExecutor(max_workers=1,
+                                    mp_context=self.mp_context,
+                                    initializer=_init_shard,
+                                    initargs=(data_sp[start:end],
+                                              self.radius)))
+        return self
+
+    def close(self):
+        """Shut down the worker processes of the shards."""
+        for pool in self.pools:
+            pool.shutdown()
+        self.pools = []
+
+    def _gather(self, method, queries_sp, *args):
+        futures = [pool.submit(_query_shard, method, queries_sp, *args)
+                   for pool in self.pools]
+        return [f.result() for f in futures]
+
+    def radius_neighbors(self, queries_sp, radius=None):
+        radius = self.radius if radius is None else radius
+        results = self._gather('radius_neighbors', queries_sp, radius)
+        ids, dists = [], []
+        for i in range(queries_sp.shape[0]):
+            ## Shards in order of their offsets, so the ids remain sorted
+            ids.append(np.concatenate([r_ids[i]+offset for (_, r_ids), offset
+                                       in zip(results, self.offsets)]))
+            dists.append(np.concatenate([r_dists[i]
+                                         for r_dists, _ in results]))
+        return format_neighbors(ids, dists)
+
+    def top_neighbors(self, queries_sp, k, score_floor=0.):
+        results = self._gather('top_neighbors', queries_sp, k, score_floor)
+        ids, scores = [], []
+        for i in range(queries_sp.shape[0]):
+            ids_i, scores_i = select_top_k(
+                np.concatenate([r_ids[i]+offset for (_, r_ids), offset
+                                in zip(results, self.offsets)]),
+                np.concatenate([r_scores[i] for r_scores, _ in results]), k)
+            ids.append(ids_i)
+            scores.append(scores_i)
+        return format_neighbors(ids, scores)
+
+
+class ShardedDataBaseAPI(DataBaseAPI):
+    """`DataBaseAPI` whose main variable is retrieved from `n_shards`
+    worker processes.
+
+    The vectorizer is fitted globally by the coordinator, which also keeps
+    the category indices and runs the joins with the previous queries on the
+    merged ids, so it answers the same than a `DataBaseAPI`. It should be
+    closed (or used as context manager) to stop the workers.
+    """
+
+    def __init__(self, data_info, type_vars, responses_formatter,
+                 parameter_formatter={}, retrieval_pars={}, cache_pars={},
+                 n_shards=2, mp_context=None):
+        retrieval_pars = dict(retrieval_pars)
+        radius = retrieval_pars.get('radius',
+                                    self.default_retrieval_pars['radius'])
+        retrieval_pars['retriever'] =\
+            ShardedRetriever(n_shards, radius, mp_context)
+        super().__init__(data_info, type_vars, responses_formatter,
+                         parameter_formatter, retrieval_pars, cache_pars)
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        return ShardedDataBaseAPI(**parameters)
+
+    def close(self):
+        self.main_ret.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
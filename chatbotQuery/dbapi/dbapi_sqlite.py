@@ -0,0 +1,350 @@
+"""
+DBAPI SQLite
+------------
+`DataBaseAPI` backed by a SQLite file built offline: the candidates of the
+main queries are retrieved with a FTS5 index and scored with the TF-IDF
+weights stored at build time, the category postings are stored in indexed
+tables and the names and labels are read only for the rows of each answer,
+so the memory used does not depend on the size of the catalog.
+
+"""
+
+import os
+import json
+import copy
+import sqlite3
+import weakref
+import threading
+import numpy as np
+import pandas as pd
+from urllib.request import pathname2url
+from sklearn.preprocessing import normalize
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_retrievers import select_top_k
+from chatbotQuery.dbapi.dbapi_storage import to_json_values
+from chatbotQuery.dbapi.dbapi_vectorizers import create_main_vectorizer
+
+## FTS5 tokenizer with the words of the vectorizer: `\w` characters, case
+## folded, without removing the diacritics
+FTS_TOKENIZER = "unicode61 remove_diacritics 0 tokenchars '_'"
+
+
+class SQLiteDataBaseAPI(DataBaseAPI):
+    """Read-only `DataBaseAPI` over a SQLite file built by `build_database`.
+
+    A main query retrieves the rows whose names contain any of its words
+    (a FTS5 OR query ranked by BM25) and scores them with the TF-IDF cosine
+    of the vectorizer fitted at build time, so it retrieves the same rows
+    than `DataBaseAPI` in the radius or the top-k modes. `max_candidates`
+    limits the candidates scored to the best ranked by BM25.
+
+    Every thread uses its own read-only connection, which is closed when
+    the thread ends.
+    """
+
+    ## Maximum number of candidates scored by main query (None for all)
+    max_candidates = None
+
+    def __init__(self, path, responses_formatter, parameter_formatter={},
+                 retrieval_pars={}, cache_pars={}):
+        assert(os.path.isfile(path))
+        self.path = path
+        self._local = threading.local()
+        self._connections = weakref.WeakSet()
+        self._connections_lock = threading.Lock()
+        ## Metadata
+        meta = dict(self._connection().execute("SELECT key, value FROM meta"))
+        self.type_vars = json.loads(meta['type_vars'])
+        self.n_rows = json.loads(meta['n_rows'])
+        self._ngram_range = tuple(json.loads(meta['ngram_range']))
+        self._analyzer =\
+            TfidfVectorizer(ngram_range=self._ngram_range).build_analyzer()
+        cat_names = self.type_vars['cat_vars']['name']
+        self.categories = dict(zip(cat_names, json.loads(meta['categories'])))
+        self.cats_codenames = dict(zip(cat_names,
+                                       self.type_vars['cat_vars']['codename']))
+        self.retrieval_pars = copy.copy(self.default_retrieval_pars)
+        self.retrieval_pars['retriever'] = 'fts5'
+        self.retrieval_pars.update(retrieval_pars)
+        self.main_ret = None
+        ## Category retrieval
+        self._fit_category_retrievers()
+        self.categories_names = {}
+        for c in cat_names:
+            self._set_category_names(c)
+        self._set_fuzzy_index()
+
+        self.responses_formatter = responses_formatter
+        self.parameter_formatter = parameter_formatter
+        self._set_caches(cache_pars)
+        self._set_updates()
+
+    @classmethod
+    def build_database(cls, path, data_info, type_vars):
+        """Build offline the SQLite file `path` of a catalog (dataframe or
+        csv file) to be shipped to the nodes, with the TF-IDF weights of the
+        names fitted as the 'tfidf' vectorizer of `DataBaseAPI`.
+        """
+        if isinstance(data_info, pd.DataFrame):
+            data = data_info
+        else:
+            assert(os.path.isfile(data_info))
+            data = pd.read_csv(data_info, index_col=0)
+        assert(not os.path.exists(path))
+        main_var = type_vars['main_var']['name']
+        label_var = type_vars['label_var']['name']
+        cat_names = type_vars['cat_vars']['name']
+        ## Same category values than DataBaseAPI
+        categories = [list(data[c].unique()) for c in cat_names]
+        ids = np.arange(data.shape[0])
+        vectorizer = create_main_vectorizer('tfidf')
+        ## Normalized as the postings of the inverted index retriever
+        weights = normalize(vectorizer.fit_transform(
+            list(data[main_var]))).tocoo()
+
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.executescript("""
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE rows (id INTEGER PRIMARY KEY, name TEXT,
+                                   label TEXT);
+                CREATE VIRTUAL TABLE names USING fts5(
+                    name, content='rows', content_rowid='id',
+                    tokenize="%s");
+                CREATE TABLE terms (term TEXT PRIMARY KEY, id INTEGER,
+                                    idf REAL) WITHOUT ROWID;
+                CREATE TABLE weights (
+                    id INTEGER, term INTEGER, weight REAL,
+                    PRIMARY KEY (id, term)) WITHOUT ROWID;
+                CREATE TABLE cat_postings (
+                    cat INTEGER, value INTEGER, id INTEGER,
+                    PRIMARY KEY (cat, value, id)) WITHOUT ROWID;
+                """ % FTS_TOKENIZER)
+            meta = {'type_vars': type_vars, 'n_rows': data.shape[0],
+                    'ngram_range': list(vectorizer.ngram_range),
+                    'categories': [to_json_values(v) for v in categories]}
+            connection.executemany("INSERT INTO meta VALUES (?, ?)",
+                                   [(k, json.dumps(v))
+                                    for k, v in meta.items()])
+            labels = cls._format_labels(data[label_var].to_numpy())
+            connection.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?)",
+                zip(ids.tolist(), data[main_var].astype(str).tolist(),
+                    labels.tolist()))
+            connection.execute("INSERT INTO names(names) VALUES ('rebuild')")
+            connection.executemany(
+                "INSERT INTO terms VALUES (?, ?, ?)",
+                [(t, j, float(vectorizer.idf_[j]))
+                 for t, j in vectorizer.vocabulary_.items()])
+            connection.executemany(
+                "INSERT INTO weights VALUES (?, ?, ?)",
+                zip(weights.row.tolist(), weights.col.tolist(),
+                    weights.data.tolist()))
+            for i, c in enumerate(cat_names):
+                values = pd.Index(categories[i]).get_indexer(data[c])
+                logi = np.array(data[c].notnull())
+                connection.executemany(
+                    "INSERT INTO cat_postings VALUES (%d, ?, ?)" % i,
+                    zip(values[logi].tolist(), ids[logi].tolist()))
+        connection.execute("VACUUM")
+        connection.close()
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        return SQLiteDataBaseAPI(**parameters)
+
+    def _row_ids_dtype(self):
+        if not self.retrieval_pars['compact_dtypes']:
+            return np.dtype(np.int64)
+        return np.min_scalar_type(max(self.n_rows-1, 0))
+
+    ############################## Connections ##############################
+    def _connection(self):
+        local = getattr(self._local, 'connection', None)
+        if local is None:
+            uri = 'file:%s?mode=ro' % pathname2url(os.path.abspath(self.path))
+            ## Only used by its thread, but could be closed by any of them
+            connection = sqlite3.connect(uri, uri=True,
+                                         check_same_thread=False)
+            ## Closed when the local data of the thread is released at its end
+            local = self._local.connection = ThreadConnection(connection)
+            weakref.finalize(local, connection.close)
+            with self._connections_lock:
+                self._connections.add(local)
+        return local.connection
+
+    def close(self):
+        """Close the connections of all the threads."""
+        with self._connections_lock:
+            for local in list(self._connections):
+                local.connection.close()
+            self._connections = weakref.WeakSet()
+        self._local = threading.local()
+
+    def _select(self, sql, ids, *parameters):
+        ## The ids are passed as a json array parameter
+        ids = json.dumps(np.asarray(ids, dtype=np.int64).tolist())
+        return self._connection().execute(sql, parameters+(ids,)).fetchall()
+
+    def _fuzzy_texts(self):
+        texts = [r[0] for r in
+                 self._connection().execute("SELECT name FROM rows")]
+        for c in self.type_vars['cat_vars']['name']:
+            texts += [v for v in self.categories[c] if not pd.isnull(v)]
+        return texts
+
+    ################################# Query #################################
+    def _main_query(self, keywords, pre=None):
+        ids, scores = [], []
+        for k in keywords:
+            ids_k, scores_k = self._scored_candidates(k)
+            if self.retrieval_pars['top_k'] is None:
+                ## Elements without shared terms are at distance 1
+                if self.retrieval_pars['radius'] >= 1:
+                    all_scores = np.zeros(self.n_rows)
+                    all_scores[ids_k] = scores_k
+                    ids_k, scores_k = np.arange(self.n_rows), all_scores
+                logi = 1-scores_k <= self.retrieval_pars['radius']
+                ids_k, scores_k = ids_k[logi], scores_k[logi]
+            else:
+                logi = (scores_k > 0) &\
+                    (scores_k >= self.retrieval_pars['score_floor'])
+                ids_k, scores_k = select_top_k(ids_k[logi], scores_k[logi],
+                                               self.retrieval_pars['top_k'])
+            ids.append(ids_k.astype(np.int64))
+            scores.append(scores_k)
+        queried = {'main_var': self._object_array(ids)}
+        if self.retrieval_pars['top_k'] is not None:
+            queried['main_scores'] = self._object_array(scores)
+        return queried
+
+    def _scored_candidates(self, keyword):
+        """Sorted rows sharing some word with the keyword and their cosine
+        scores with its TF-IDF vector.
+        """
+        words, term_ids, query_weights = self._query_vector(keyword)
+        if not words:
+            return np.array([], dtype=np.int64), np.array([])
+        candidates = np.sort(np.array(
+            [r[0] for r in self._connection().execute(
+                "SELECT rowid FROM names WHERE names MATCH ? "
+                "ORDER BY bm25(names) LIMIT ?",
+                (self._match_expression(words),
+                 -1 if self.max_candidates is None
+                 else self.max_candidates))], dtype=np.int64))
+        weights = np.array(self._select(
+            "SELECT id, term, weight FROM weights WHERE term IN "
+            "(SELECT value FROM json_each(?)) AND id IN "
+            "(SELECT value FROM json_each(?))", candidates,
+            json.dumps(term_ids.tolist())), dtype=float).reshape(-1, 3)
+        rows = np.searchsorted(candidates, weights[:, 0].astype(np.int64))
+        cols = np.nonzero(weights[:, 1].astype(np.int64)[:, None] ==
+                          term_ids[None, :])[1]
+        ## Summed in the order of the terms of the query, as the retriever
+        order = np.lexsort((cols, rows))
+        scores = np.bincount(rows[order],
+                             weights=(weights[:, 2] *
+                                      query_weights[cols])[order],
+                             minlength=len(candidates))
+        return candidates, scores
+
+    def _query_vector(self, keyword):
+        ## Words of the keyword in the vocabulary, ids of its terms and their
+        ## TF-IDF weights, computed and normalized as the vectorizer and the
+        ## retriever of `DataBaseAPI` do
+        terms = self._connection().execute(
+            "SELECT term, id, idf FROM terms WHERE term IN "
+            "(SELECT value FROM json_each(?))",
+            (json.dumps(list(set(self._analyzer(str(keyword))))),)).\
+            fetchall()
+        if not terms:
+            return [], np.array([], dtype=np.int64), np.array([])
+        terms = sorted(terms, key=lambda x: x[1])
+        vectorizer = TfidfVectorizer(ngram_range=self._ngram_range)
+        vectorizer.vocabulary_ = dict([(t, i) for i, (t, _, _)
+                                       in enumerate(terms)])
+        vectorizer.idf_ = np.array([idf for _, _, idf in terms])
+        query = normalize(vectorizer.transform([str(keyword)]))
+        term_ids = np.array([terms[i][1] for i in query.indices],
+                            dtype=np.int64)
+        return ([t for t, _, _ in terms if ' ' not in t], term_ids,
+                query.data)
+
+    def _match_expression(self, words):
+        ## Quoted words, any of them
+        return ' OR '.join(['"%s"' % w.replace('"', '""') for w in words])
+
+    def _object_array(self, elements):
+        array = np.empty(len(elements), dtype=object)
+        for i, e in enumerate(elements):
+            array[i] = e
+        return array
+
+    def _category_element_mask(self, ids, ids_cat, i):
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = [np.asarray(ids_cat['main_var'][i], dtype=np.int64)]
+        cat_names = self.type_vars['cat_vars']['name']
+        for c in ids_cat['cat_vars']:
+            values = np.asarray(ids_cat['cat_vars'][c][i], dtype=np.int64)
+            if len(values) and len(ids):
+                rows.append(np.array(self._select(
+                    "SELECT id FROM cat_postings WHERE cat = ? AND value IN "
+                    "(SELECT value FROM json_each(?)) AND id IN "
+                    "(SELECT value FROM json_each(?))", ids,
+                    cat_names.index(c),
+                    json.dumps(values.tolist())), dtype=np.int64).ravel())
+        return np.isin(ids, np.concatenate(rows))
+
+    def _cross_category_category_query(self, ids0, ids1):
+        for c in ids0['cat_vars']:
+            for i in range(len(ids0['cat_vars'][c])):
+                ids0['cat_vars'][c][i] =\
+                    np.union1d(ids0['cat_vars'][c][i],
+                               ids1['cat_vars'][c][i]).astype(np.int64)
+        return ids0
+
+    ################################# Facets #################################
+    def _rows_facets(self, rows):
+        cat_names = self.type_vars['cat_vars']['name']
+        counts = dict([(c, np.zeros(len(self.categories[c]), dtype=np.int64))
+                       for c in cat_names])
+        for i, value, count in self._select(
+                "SELECT cat, value, COUNT(*) FROM cat_postings WHERE id IN "
+                "(SELECT value FROM json_each(?)) GROUP BY cat, value", rows):
+            counts[cat_names[i]][value] = count
+        return counts
+
+    def _values_facets(self, cat_values):
+        cat_names = self.type_vars['cat_vars']['name']
+        rows = [np.array([], dtype=np.int64)]
+        for c in cat_values:
+            values = np.asarray(cat_values[c], dtype=np.int64)
+            rows.append(np.array(self._select(
+                "SELECT id FROM cat_postings WHERE cat = ? AND value IN "
+                "(SELECT value FROM json_each(?))", values,
+                cat_names.index(c)), dtype=np.int64).ravel())
+        return self._rows_facets(np.unique(np.concatenate(rows)))
+
+    ################################ Answers ################################
+    def _get_main_names(self, idx):
+        return self._get_rows('name', idx)
+
+    def _get_label_names(self, idx):
+        return self._get_rows('label', idx)
+
+    def _get_rows(self, column, idx):
+        values = dict(self._select("SELECT id, %s FROM rows WHERE id IN "
+                                   "(SELECT value FROM json_each(?))"
+                                   % column, idx))
+        return self._object_array([values[i] for i in idx.tolist()])
+
+
+class ThreadConnection(object):
+    """Connection stored in the local data of a thread."""
+
+    __slots__ = ['connection', '__weakref__']
+
+    def __init__(self, connection):
+        self.connection = connection
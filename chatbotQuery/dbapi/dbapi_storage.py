@@ -0,0 +1,228 @@
+"""
+DBAPI storage
+-------------
+Persistence of the fitted indices of `DataBaseAPI`. Every index array is
+stored as a `.npy` file, so it could be memory-mapped when it is loaded
+and shared between processes through the page cache. The same arrays
+could be published instead in a `multiprocessing.shared_memory` block
+which the worker processes attach by its name.
+
+The strings (the names, the formatted labels and the vocabulary) are
+stored as blocks of utf-8 bytes and their offsets, read lazily by
+`StringBlock` and `BlockVocabulary`, so the attached processes do not
+build their own python objects.
+
+"""
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from collections.abc import Mapping
+
+## Alignment of the arrays in the shared memory blocks
+ALIGNMENT = 64
+## Names of the blocks published by this process (or its parents)
+_published = set()
+
+
+def save_index_arrays(path, arrays, meta):
+    """Write the index arrays and the metadata needed to rebuild the
+    `DataBaseAPI` in the folder `path`.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    meta = dict(meta)
+    meta['arrays'] = sorted(arrays.keys())
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name+'.npy'), array, allow_pickle=False)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_index_arrays(path, mmap_mode='r'):
+    """Read the index arrays (memory-mapped by default) and the metadata
+    stored in the folder `path`.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {}
+    for name in meta['arrays']:
+        arrays[name] = np.load(os.path.join(path, name+'.npy'),
+                               mmap_mode=mmap_mode, allow_pickle=False)
+    return arrays, meta
+
+
+def publish_index_arrays(arrays, meta, name=None):
+    """Copy the index arrays and their metadata in a new shared memory
+    block (named `name` or a random name). The block is returned: the
+    publisher should keep it while it is used and `close` and `unlink` it
+    at the end.
+    """
+    ## Imported here: only available from python 3.8
+    from multiprocessing import shared_memory
+    meta = dict(meta)
+    layout, offset = {}, 0
+    for key in sorted(arrays.keys()):
+        array = np.ascontiguousarray(arrays[key])
+        assert(array.dtype != object)
+        layout[key] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // ALIGNMENT)*ALIGNMENT
+    meta['layout'] = layout
+    header = json.dumps(meta).encode()
+    start = -(-(8+len(header)) // ALIGNMENT)*ALIGNMENT
+    block = shared_memory.SharedMemory(name=name, create=True,
+                                       size=max(start+offset, 1))
+    _published.add(block.name)
+    block.buf[:8] = np.array([start, len(header)], dtype=np.uint32).tobytes()
+    block.buf[8:8+len(header)] = header
+    for key, (dtype, shape, position) in layout.items():
+        array = np.ascontiguousarray(arrays[key])
+        view = np.ndarray(shape, dtype=dtype, buffer=block.buf,
+                          offset=start+position)
+        view[...] = array
+    return block
+
+
+def attach_index_arrays(name):
+    """Read-only views of the index arrays published in the shared memory
+    block `name`, their metadata and the attached block (which has to be
+    kept while the views are used).
+    """
+    from multiprocessing import shared_memory, resource_tracker
+    if sys.version_info >= (3, 13):
+        block = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        block = shared_memory.SharedMemory(name=name)
+        ## Only the publisher unlinks the block
+        if block.name not in _published:
+            resource_tracker.unregister(block._name, 'shared_memory')
+    start, length = np.frombuffer(block.buf[:8], dtype=np.uint32)
+    meta = json.loads(bytes(block.buf[8:8+length]).decode())
+    arrays = {}
+    for key, (dtype, shape, position) in meta.pop('layout').items():
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf,
+                                 offset=int(start)+position)
+        arrays[key].flags.writeable = False
+    return arrays, meta, block
+
+
+def to_storable_arrays(name, values):
+    """Arrays which store the values without pickling: the numerical ones
+    as `name` and the objects as a string block (`name_offsets`,
+    `name_bytes`) and the mask of the null values (`name_nulls`).
+    """
+    array = np.asarray(values)
+    if array.dtype != object:
+        return {name: array}
+    arrays = {name+'_nulls': np.asarray(pd.isnull(array), dtype=bool)}
+    arrays[name+'_offsets'], arrays[name+'_bytes'] = to_string_block(array)
+    return arrays
+
+
+def from_storable_arrays(arrays, name):
+    """Values stored by `to_storable_arrays`: an array or a `StringBlock`."""
+    if name in arrays:
+        return arrays[name]
+    return StringBlock(arrays[name+'_offsets'], arrays[name+'_bytes'],
+                       arrays.get(name+'_nulls'))
+
+
+def to_json_values(values):
+    """List of python values which could be serialized in the metadata."""
+    return [v.item() if isinstance(v, np.generic) else v for v in values]
+
+
+def to_string_block(values):
+    """Offsets (n+1 int64) and utf-8 bytes (uint8) of the strings of the
+    values (empty for the null ones).
+    """
+    encoded = [b'' if pd.isnull(v) else str(v).encode('utf-8')
+               for v in values]
+    offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+class StringBlock(object):
+    """Read-only array of strings stored as a block of utf-8 bytes and the
+    offsets of each string, which are decoded when they are indexed. The
+    positions of the mask `nulls` (if any) are NaN.
+    """
+
+    def __init__(self, offsets, data, nulls=None):
+        self.offsets = offsets
+        self.data = data
+        self.nulls = nulls
+
+    def _decode(self, j):
+        if (self.nulls is not None) and self.nulls[j]:
+            return np.nan
+        start, end = self.offsets[j], self.offsets[j+1]
+        return self.data[start:end].tobytes().decode('utf-8')
+
+    def __getitem__(self, idx):
+        if np.ndim(idx) == 0 and not isinstance(idx, slice):
+            j = int(idx)
+            return self._decode(j+len(self) if j < 0 else j)
+        if isinstance(idx, slice):
+            idx = np.arange(*idx.indices(len(self)))
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.nonzero(idx)[0]
+        idx = np.where(idx < 0, idx+len(self), idx)
+        values = np.empty(len(idx), dtype=object)
+        for k, j in enumerate(idx.tolist()):
+            values[k] = self._decode(j)
+        return values
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __iter__(self):
+        for j in range(len(self)):
+            yield self._decode(j)
+
+
+class BlockVocabulary(Mapping):
+    """Read-only mapping of the terms of a `StringBlock` to their positions,
+    searched by bisection in `order`, the positions sorted by the bytes of
+    their terms.
+    """
+
+    def __init__(self, terms, order):
+        self.terms = terms
+        self.order = order
+
+    @classmethod
+    def sorted_order(cls, terms):
+        """Positions of the `terms` sorted by their utf-8 bytes."""
+        encoded = [t.encode('utf-8') for t in terms]
+        return np.array(sorted(range(len(encoded)), key=encoded.__getitem__),
+                        dtype=np.int64)
+
+    def __getitem__(self, term):
+        key = term.encode('utf-8') if isinstance(term, str) else None
+        if key is None:
+            raise KeyError(term)
+        offsets, data = self.terms.offsets, self.terms.data
+        low, high = 0, len(self.order)
+        while low < high:
+            middle = (low+high)//2
+            j = self.order[middle]
+            if data[offsets[j]:offsets[j+1]].tobytes() < key:
+                low = middle+1
+            else:
+                high = middle
+        if low < len(self.order):
+            j = self.order[low]
+            if data[offsets[j]:offsets[j+1]].tobytes() == key:
+                return int(j)
+        raise KeyError(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
@@ -0,0 +1,62 @@
+"""
+DBAPI vectorizers
+-----------------
+Vectorizers of the main variable used by `DataBaseAPI` to transform the
+names of the catalog and the keywords of the user.
+
+"""
+
+import numpy as np
+from sklearn.preprocessing import normalize
+from sklearn.feature_extraction.text import TfidfVectorizer,\
+    HashingVectorizer
+
+
+class HashingTfidfVectorizer(object):
+    """TF-IDF n-gram vectorizer with the hashing trick.
+
+    It is equivalent to `TfidfVectorizer` (with its default smoothed idf
+    and l2 normalization) except for the collisions of the hashes, but
+    instead of a vocabulary of every n-gram of the catalog it stores only
+    the idf weights as a fixed-size `np.float32` array, so its memory does
+    not depend on the catalog. The n-grams which are not in the catalog
+    have a null weight, as the ones out of the vocabulary of `TfidfVectorizer`.
+    """
+
+    def __init__(self, ngram_range=(1, 4), n_features=2**20):
+        self.ngram_range = tuple(ngram_range)
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(ngram_range=self.ngram_range,
+                                        n_features=n_features,
+                                        alternate_sign=False, norm=None)
+
+    def fit(self, documents):
+        counts = self.hasher.transform(documents)
+        df = np.bincount(counts.indices, minlength=self.n_features)
+        n_documents = counts.shape[0]
+        idf = np.log((1.+n_documents)/(1.+df))+1.
+        self.idf_ = np.where(df > 0, idf, 0.).astype(np.float32)
+        return self
+
+    def transform(self, documents):
+        counts = self.hasher.transform(documents)
+        counts.data *= self.idf_[counts.indices]
+        counts.eliminate_zeros()
+        return normalize(counts)
+
+    def fit_transform(self, documents):
+        return self.fit(documents).transform(documents)
+
+
+def create_main_vectorizer(vectorizer):
+    """Instantiate the vectorizer of the main variable from its
+    specification: 'tfidf', 'hashing' or an object with `fit_transform`
+    and `transform`.
+    """
+    if vectorizer == 'tfidf':
+        return TfidfVectorizer(ngram_range=(1, 4))
+    elif vectorizer == 'hashing':
+        return HashingTfidfVectorizer(ngram_range=(1, 4))
+    assert(hasattr(vectorizer, 'fit_transform') and
+           hasattr(vectorizer, 'transform'))
+    return vectorizer
@@ -0,0 +1,35 @@
+
+"""
+Parameters of the example products catalog shared by the tests of the
+DataBaseAPI backends (sharding, SQLite and the registry).
+"""
+
+from chatbotQuery.datasets import fetch_data_products
+
+
+def joiner(l):
+    return ', '.join(l)
+
+
+def products_type_vars():
+    return {'main_var': {'name': 'Product Name', 'codename': 'productname'},
+            'cat_vars': {'name': ['Brand', 'Category'],
+                         'codename': ['brand', 'category']},
+            'label_var': {'name': 'Subscription Plan'}}
+
+
+def products_responses_formatter():
+    return {'main_var': (joiner, 'query_productnames'),
+            'cat_vars': {'Brand': lambda c, l: joiner(l),
+                         'Category': lambda c, l: joiner(l)},
+            'label_var': (lambda l, p: joiner(p), 'query_productnames'),
+            'join_cats': (joiner, 'query_catnames')}
+
+
+def products_parameters(data_info=None):
+    """Parameters of the `DataBaseAPI` of the products (read from the file
+    `data_info` if given).
+    """
+    data_info = fetch_data_products() if data_info is None else data_info
+    return {'data_info': data_info, 'type_vars': products_type_vars(),
+            'responses_formatter': products_responses_formatter()}
@@ -1,4 +1,5 @@
 
+import os
 import unittest
 import copy
 #import mock
@@ -12,6 +13,8 @@ from chatbotQuery.conversation import GeneralConversationState, CheckerState,\
 from chatbotQuery.conversation import SequentialChooser,\
     TransitionConversationStates
 from chatbotQuery import ChatbotMessage
+from chatbotQuery.io.parameters_processing import parse_configuration_file,\
+    create_testing_mode_parameters
 
 #from chatbotQuery.conversation import RandomChooser, SequentialChooser,\
 #    QuerierSizeDrivenChooser, QuerierSplitterChooser
@@ -344,6 +347,44 @@ class Test_ConversationStateMachine(unittest.TestCase):
                                                 endStates=endstate.name)
         self.assert_statemachine(statemachine)
 
+    def test_sessions_runtime(self):
+        pars = copy.copy(self.answering_state_pars)
+        endstate = GeneralConversationState(**pars)
+        pars = copy.copy(self.asking_state)
+        pars['transition'] = ('answering_state', lambda m: 0)
+        initstate = GeneralConversationState(**pars)
+        statemachine = ConversationStateMachine(name='sessions',
+                                                states=[initstate, endstate],
+                                                startState=initstate.name,
+                                                endStates=endstate.name)
+        statemachine.set_machine()
+        initial = statemachine.currentState
+        ## Sessions sharing the machine
+        runtimes = [statemachine.new_runtime() for _ in range(2)]
+        histories = []
+        for runtime in runtimes:
+            with statemachine.bind(runtime):
+                self.assertEqual(statemachine.currentState, initial)
+                self.assertEqual(initstate.counts, 0)
+            while True:
+                statemachine.get_message(self.db_handlers, self.message,
+                                         runtime=runtime)
+                with statemachine.bind(runtime):
+                    if statemachine.runned:
+                        histories.append(statemachine.historyStates)
+                        self.assertEqual(initstate.counts, 2)
+                        break
+        self.assertEqual(histories[0], histories[1])
+        self.assertIsNone(histories[0][-1])
+        self.assertLess(runtimes[0].nbytes, 1024)
+        ## Default runtime untouched
+        self.assertEqual(statemachine.currentState, initial)
+        self.assertFalse(statemachine.runned)
+        self.assertEqual(initstate.counts, 0)
+        self.assertEqual(endstate.chooser.times_used, 0)
+        with statemachine.bind(runtimes[0]):
+            self.assertEqual(endstate.chooser.times_used, 1)
+
     def test_onenestedchainstatemachine(self):
         # Testing longer chain
         pars = copy.copy(self.answering_state_pars)
@@ -401,3 +442,123 @@ class Test_ConversationStateMachine(unittest.TestCase):
                                                 startState='statemachine3',
                                                 endStates='statemachine3')
         self.assert_statemachine(statemachine)
+
+
+def legacy_manage_next_state(machine, currentstate, message):
+    """Next state resolved walking the path names (before the compiled
+    table of states).
+    """
+    next_state = currentstate.next_state
+    if next_state is None:
+        currentstatepath = currentstate.abspathname
+        parentstate = machine._get_parentState_transitioner(currentstatepath)
+        if parentstate is None:
+            return None
+        sonparentstate =\
+            machine._get_son_of_parentstate_transitioner(currentstatepath,
+                                                         parentstate)
+        machine.all_states_d[parentstate]._compute_next(message,
+                                                        sonparentstate)
+        machine.all_states_d[parentstate].runned = True
+        next_parent = machine.all_states_d[parentstate].next_state
+        if next_parent is None:
+            return None
+        if next_parent != machine.abspathname:
+            next_parent =\
+                '.'.join([machine.all_states_d[parentstate].parentState,
+                          machine._pathname_formatter(next_parent)])
+        next_state = machine._walk_initial_state(next_parent)
+        currentstate = machine.all_states_d[next_state]
+    else:
+        next_state = '.'.join([currentstate.parentState,
+                               machine._pathname_formatter(next_state)])
+        currentstate = machine.all_states_d[next_state]
+    if currentstate.NotEnter:
+        currentstate = None
+    return currentstate
+
+
+class Test_CompiledStateMachine(unittest.TestCase):
+    """Testing the compiled table of states against the path names.
+    """
+
+    def setUp(self):
+        package_path =\
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.example_yaml =\
+            os.path.join(os.path.dirname(package_path),
+                         'examples/example_dbparser/dbparser_parameter.yml')
+
+    def assert_same_transitions(self, machine):
+        machine.set_machine()
+        for path, i in machine.states_index.items():
+            if machine.start_table[i] >= 0:
+                self.assertEqual(machine.get_initial_state(path),
+                                 machine._walk_initial_state(path))
+        messages = [ChatbotMessage.from_candidates_messages({'message': m})
+                    for m in ['0', '1', '2']]
+        for state in machine.states_table:
+            if not isinstance(state, GeneralConversationState):
+                continue
+            for next_state, message in product(state.next_states+[None],
+                                               messages):
+                transitions = []
+                for manage in [machine.manage_next_state,
+                               lambda s, m: legacy_manage_next_state(
+                                   machine, s, m)]:
+                    for s in machine.states_table:
+                        s.runned = False
+                    state.next_state = next_state
+                    try:
+                        next_s = manage(state, message)
+                        transitions.append(None if next_s is None
+                                           else next_s.abspathname)
+                    except (KeyError, IndexError) as e:
+                        transitions.append(type(e))
+                self.assertEqual(transitions[0], transitions[1])
+
+    def test_example_configuration(self):
+        for test_mode in [False, True]:
+            ## The states are built in place of their parameters
+            pars = parse_configuration_file(self.example_yaml)
+            if test_mode:
+                pars = create_testing_mode_parameters(pars)
+            machine = ConversationStateMachine.from_parameters(pars)
+            self.assert_same_transitions(machine)
+            self.assertEqual(machine.currentState, 'Conversation.Hello.Hello')
+
+    def test_restart(self):
+        pars = create_testing_mode_parameters(
+            parse_configuration_file(self.example_yaml))
+        machine = ConversationStateMachine.from_parameters(pars)
+        machine.set_machine()
+        initial = machine.runtime.snapshot()
+        hello = machine.all_states_d['Conversation.Hello.Hello']
+        query = machine.states['Query Conversation']
+        ## Changes of the session
+        hello.counts, hello.runned = 3, True
+        query.states['Querier DB'].counts = 2
+        machine.currentState = 'Conversation.Say_goodbye.Say_goodbye'
+        ## Nested machine only resets its states
+        query.restart()
+        self.assertEqual(query.states['Querier DB'].counts, 0)
+        self.assertEqual(hello.counts, 3)
+        machine.restart()
+        self.assertEqual(machine.runtime.snapshot(), initial)
+        self.assertEqual(machine.currentState, 'Conversation.Hello.Hello')
+        self.assertFalse(hello.runned)
+        ## Sessions
+        runtime = machine.new_runtime(seed=0)
+        with machine.bind(runtime):
+            hello.counts = 5
+            machine.restart()
+            self.assertEqual(hello.counts, 0)
+        self.assertIsNotNone(runtime.random_state)
+        ## Machines not set yet reset their states before compiling
+        machine = ConversationStateMachine.from_parameters(pars)
+        hello = machine.states['Hello'].states['Hello']
+        hello.counts, hello.runned = 3, True
+        machine.restart()
+        self.assertTrue(machine.setted)
+        self.assertEqual((hello.counts, hello.runned), (0, False))
+        self.assertEqual(machine.runtime.snapshot(), initial)
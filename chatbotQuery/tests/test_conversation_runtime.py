@@ -0,0 +1,86 @@
+
+import unittest
+import numpy as np
+from array import array
+
+from chatbotQuery.conversation.conversation_runtime import\
+    ConversationRuntime, NamesVocabulary, RuntimeField, RuntimeNameField,\
+    attach_runtime, bind_runtime
+
+
+class Machine4test(object):
+
+    def __init__(self):
+        self.state_names = NamesVocabulary(['a'])
+        self.runtime = ConversationRuntime.empty(self, 2)
+
+
+class State4test(object):
+    counts = RuntimeField('counts')
+    next_state = RuntimeNameField('next_state')
+
+
+class Test_ConversationRuntime(unittest.TestCase):
+    """Testing the per-session fields of the compiled machines.
+    """
+
+    def test_runtime_fields(self):
+        machine, state = Machine4test(), State4test()
+        ## Plain attributes before attaching
+        with self.assertRaises(AttributeError):
+            state.counts
+        state.counts, state.next_state = 3, 'b'
+        attach_runtime(state, machine, 1, machine.runtime)
+        self.assertNotIn('counts', state.__dict__)
+        self.assertEqual(machine.runtime.table['counts'].tolist(), [0, 3])
+        self.assertEqual(state.next_state, 'b')
+        self.assertEqual(machine.state_names.names, ['a', 'b'])
+        ## Session runtimes
+        session = machine.runtime.copy()
+        with bind_runtime(session):
+            state.counts += 1
+            state.next_state = None
+            self.assertEqual(state.counts, 4)
+            self.assertIsNone(state.next_state)
+        self.assertEqual(state.counts, 3)
+        self.assertEqual(state.next_state, 'b')
+        ## Runtimes of other machines are ignored
+        with bind_runtime(Machine4test().runtime):
+            self.assertEqual(state.counts, 3)
+
+    def test_snapshot(self):
+        machine, state = Machine4test(), State4test()
+        machine.states_table = [None, state]
+        attach_runtime(state, machine, 1, machine.runtime)
+        runtime = machine.runtime.copy()
+        runtime.random_state = np.random.default_rng(0)
+        runtime.current, runtime.history = 1, array('i', [0, 1, -1])
+        with bind_runtime(runtime):
+            state.counts, state.next_state = 7, 'a'
+        blob = runtime.snapshot()
+        restored = ConversationRuntime.restore(machine, blob)
+        self.assertEqual(restored.table.tobytes(), runtime.table.tobytes())
+        self.assertEqual((restored.current, list(restored.history)),
+                         (1, [0, 1, -1]))
+        self.assertEqual(restored.random_state.integers(100, size=5).tolist(),
+                         runtime.random_state.integers(100, size=5).tolist())
+        with bind_runtime(restored):
+            self.assertEqual((state.counts, state.next_state), (7, 'a'))
+        ## Without generator
+        restored = ConversationRuntime.restore(machine,
+                                               machine.runtime.snapshot())
+        self.assertIsNone(restored.random_state)
+        ## Truncated snapshots
+        for wrong in [blob[:8], blob[:-1]]:
+            with self.assertRaises(ValueError):
+                ConversationRuntime.restore(machine, wrong)
+        ## Snapshots of other machines
+        machine.states_table = [None]
+        with self.assertRaises(ValueError):
+            ConversationRuntime.restore(machine, blob)
+
+    def test_names_vocabulary(self):
+        vocabulary = NamesVocabulary(['a', 'b', 'a'])
+        self.assertEqual(vocabulary.names, ['a', 'b'])
+        self.assertEqual(vocabulary.code('c'), 2)
+        self.assertEqual(vocabulary.code('a'), 0)
@@ -12,7 +12,9 @@
 
 """
 
+import asyncio
 import unittest
+import threading
 #import mock
 from unittest import mock
 import numpy as np
@@ -21,8 +23,9 @@ from chatbotQuery.conversation import TransitionConversationStates,\
     NullTransitionConversation
 from chatbotQuery.conversation import RandomChooser, SequentialChooser,\
     QuerierSizeDrivenChooser, QuerierSplitterChooser
-from chatbotQuery.conversation import BaseQuerier, NullQuerier
-from chatbotQuery.conversation import BaseDetector
+from chatbotQuery.conversation import BaseQuerier, NullQuerier,\
+    AsyncQuerier
+from chatbotQuery.conversation import BaseDetector, AsyncDetector
 from chatbotQuery import ChatbotMessage
 
 
@@ -271,6 +274,31 @@ class Test_Querier(unittest.TestCase):
         querier = NullQuerier()
         self.check_querier(querier)
 
+    def test_async_querier(self):
+        async def async_querier(handler_db, message):
+            await asyncio.sleep(0)
+            return self.query_info
+        querier = BaseQuerier.from_querier_info(async_querier)
+        self.assertIsInstance(querier, AsyncQuerier)
+        self.check_querier(querier)
+        message = asyncio.run(querier.amake_query(None, self.messages[0]))
+        self.assertIn('query', message)
+        ## Synchronous queries inside a running loop
+
+        async def sync_query():
+            return querier.make_query(None, self.messages[0])
+        self.assertIn('query', asyncio.run(sync_query()))
+        ## Blocking queriers run in the executor
+        threads = []
+
+        def blocking_querier(handler_db, message):
+            threads.append(threading.get_ident())
+            return self.query_info
+        querier = BaseQuerier.from_querier_info(blocking_querier)
+        message = asyncio.run(querier.amake_query(None, self.messages[0]))
+        self.assertIn('query', message)
+        self.assertNotEqual(threads, [threading.get_ident()])
+
 
 class Test_Detection(unittest.TestCase):
     """
@@ -339,3 +367,20 @@ class Test_Detection(unittest.TestCase):
         self.check_detector(detector3)
         detector4 = BaseDetector.from_detector_info([[0], lambda x: [0]])
         self.check_detector(detector4)
+
+    def test_async_detector(self):
+        async def async_detector(answer):
+            await asyncio.sleep(0)
+            return self.detector(answer)
+        detector = AsyncDetector(self.postypes, async_detector)
+        self.check_detector(detector)
+        self.assertIsInstance(BaseDetector.from_detector_info(detector),
+                              AsyncDetector)
+        for d in [detector, BaseDetector(self.postypes, self.detector)]:
+            response = asyncio.run(d.adetect(self.answers[0]))
+            self.assert_correct_response(response)
+
+        ## Synchronous detection inside a running loop
+        async def sync_detect():
+            return detector.detect(self.answers[0])
+        self.assert_correct_response(asyncio.run(sync_detect()))
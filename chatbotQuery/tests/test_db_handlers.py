@@ -5,9 +5,14 @@ import copy
 #import mock
 from unittest import mock
 from itertools import product
+import numpy as np
 
 from chatbotQuery import ChatbotMessage
 from chatbotQuery.ui import ProfileUser, HandlerConvesationDB
+from chatbotQuery.dbapi.dbapi_caching import fingerprint
+from chatbotQuery.ui.db_handlers import pack_query_ids, unpack_query_ids,\
+    IDS_QUERY
+from chatbotQuery.io import parse_configuration_file_db
 
 
 class Test_ProfileUser(unittest.TestCase):
@@ -88,6 +93,9 @@ class Test_HandlerConvesationDB(unittest.TestCase):
                 handlerdb.store_query(m, 'db')
         handlerdb.query_past_queries(2)
         handlerdb.query_last_queries(2)
+        report = handlerdb.memory_report()
+        self.assertEqual(set(report), set(['messagesDB', 'queriesDB']))
+        self.assertTrue(all([v > 0 for v in report.values()]))
 
     def test_handling_db(self):
         for p in product(*self.db_handlers):
@@ -98,3 +106,58 @@ class Test_HandlerConvesationDB(unittest.TestCase):
     def test_handling_db_from_file(self):
         handler_db = HandlerConvesationDB.from_file(self.example_db_hand_yaml)
         self.assert_handlerdb(handler_db)
+
+    def test_shared_databases(self):
+        handler_db0 = HandlerConvesationDB.from_file(self.example_db_hand_yaml)
+        handler_db1 = HandlerConvesationDB.from_file(self.example_db_hand_yaml)
+        self.assertIs(handler_db0.databases['db'], handler_db1.databases['db'])
+        parameters = parse_configuration_file_db(self.example_db_hand_yaml)
+        parameters['shared_databases'] = False
+        handler_db2 = HandlerConvesationDB.from_parameters(parameters)
+        self.assertIsNot(handler_db0.databases['db'],
+                         handler_db2.databases['db'])
+
+    def test_snapshot_query(self):
+        handler_db = HandlerConvesationDB.from_file(self.example_db_hand_yaml)
+        dbapi = handler_db.databases['db']
+        ## No queries and cleaned queries
+        for queries in [[], [{'query': None}]]:
+            handler_db.queriesDB = queries
+            blob = handler_db.snapshot_query()
+            handler_db.restore_query(blob)
+            self.assertEqual(handler_db.queriesDB, queries)
+        ## Last query recomputed from its ids
+        query_info = dbapi.get_query_info(['iphone'])
+        handler_db.store_query(dict(query_info, message='iphone'))
+        handler_db.message_in({'message': 'iphone'})
+        blob = handler_db.snapshot_query()
+        last = handler_db.queriesDB[-1]
+        handler_db.restore_query(blob)
+        self.assertEqual(len(handler_db.queriesDB), 1)
+        self.assertEqual(handler_db.messagesDB, [])
+        restored = handler_db.queriesDB[0]
+        self.assertEqual(restored['query']['query_result'],
+                         last['query']['query_result'])
+        for key in ['query_idxs', 'query_names', 'query_pars']:
+            self.assertEqual(fingerprint(restored['query'][key]),
+                             fingerprint(last['query'][key]))
+        self.assertEqual(restored['answer_names'], last['answer_names'])
+
+    def test_pack_query_ids(self):
+        main_var = np.empty(2, dtype=object)
+        main_var[0], main_var[1] = np.array([3, 1]), np.array([], dtype=int)
+        ids = {'main_var': main_var,
+               'cat_vars': {'Brand': [np.array([0]), np.array([2, 5])]}}
+        blob = pack_query_ids(ids, {'query_pars': {'label': True}})
+        status, unpacked, info = unpack_query_ids(blob)
+        self.assertEqual(status, IDS_QUERY)
+        self.assertEqual(info, {'query_pars': {'label': True}})
+        self.assertEqual([list(e) for e in unpacked['main_var']],
+                         [[3, 1], []])
+        self.assertEqual([list(e) for e in unpacked['cat_vars']['Brand']],
+                         [[0], [2, 5]])
+        ## Truncated or foreign blobs
+        for wrong in [b'', blob[:5], blob[:-4], blob+b'\x00', b'\x07'+blob[1:],
+                      blob[:9]+b'[]'+blob[11:]]:
+            with self.assertRaises(ValueError):
+                unpack_query_ids(wrong)
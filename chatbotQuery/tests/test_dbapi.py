@@ -2,10 +2,16 @@
 
 import unittest
 import pandas as pd
+import numpy as np
 import os
 import copy
+import tempfile
+import multiprocessing
+from unittest import mock
 
 from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_retrievers import create_main_retriever
+from chatbotQuery.dbapi.dbapi_category_index import FacetCounts
 from chatbotQuery.io import parse_configuration_file_dbapi
 
 
@@ -152,5 +158,545 @@ class Test_DataBaseAPI(unittest.TestCase):
         q_info = self.data.get_query_info(self.keywords_main,
                                           pre=q_main['query'])
 
+    def test_retrievers(self):
+        datafile = self.data.data
+        brute = DataBaseAPI(datafile, self.data.type_vars,
+                            self.data.responses_formatter,
+                            retrieval_pars={'retriever': 'brute'})
+        keywords = self.keywords_main+self.keywords_cat+['iphone', 'xxx']
+        ids = self.data.columwise_query(keywords)
+        ids_brute = brute.columwise_query(keywords)
+        for i in range(len(keywords)):
+            self.assertEqual(list(ids['main_var'][i]),
+                             sorted(ids_brute['main_var'][i]))
+
+    def test_build_load_index(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.data.build_index(path)
+            loaded = DataBaseAPI.load_index(path,
+                                            self.data.responses_formatter,
+                                            self.data.parameter_formatter)
+            ## Memory-mapped read-only arrays
+            self.assertFalse(loaded.main_ret.postings.data.flags.writeable)
+            self.assertFalse(loaded.main_ret.postings.data.flags.owndata)
+            pd.testing.assert_frame_equal(loaded.data, self.data.data,
+                                          check_dtype=False)
+            self.assertEqual(loaded.categories, self.data.categories)
+            keywords = self.keywords_main+self.keywords_cat
+            ids, ids_loaded = self.data.query(keywords)[0],\
+                loaded.query(keywords)[0]
+            for i in range(len(keywords)):
+                self.assertEqual(list(ids['main_var'][i]),
+                                 list(ids_loaded['main_var'][i]))
+            for c in self.data.categories:
+                for v in self.data.categories[c]:
+                    self.assertEqual(list(self.data.cats_ids[c][v]),
+                                     list(loaded.cats_ids[c][v]))
+            ## Updates of the memory-mapped indices
+            loaded.remove_ids([0])
+            c = self.data.type_vars['cat_vars']['name'][0]
+            self.assertEqual(
+                loaded.facets.counts[c][self.data.cats_codes[c][0]]+1,
+                self.data.facets.counts[c][self.data.cats_codes[c][0]])
+        ## Missing values and lazy data frame
+        data = self.data.data.copy()
+        data['Notes'] = ['note %d' % i if i % 3 else np.nan
+                         for i in range(data.shape[0])]
+        with_nulls = DataBaseAPI(data, self.data.type_vars,
+                                 self.data.responses_formatter)
+        with tempfile.TemporaryDirectory() as path:
+            with_nulls.build_index(path)
+            loaded = DataBaseAPI.load_index(path,
+                                            self.data.responses_formatter)
+            self.assertIsNone(loaded.__dict__['_data'])
+            self.assertEqual(list(loaded.main_names),
+                             list(with_nulls.main_names))
+            self.assertEqual(list(loaded.label_names),
+                             list(with_nulls.label_names))
+            self.assertEqual(loaded.get_query_info(['iphone'])
+                             ['answer_names'],
+                             with_nulls.get_query_info(['iphone'])
+                             ['answer_names'])
+            self.assertIsNone(loaded.__dict__['_data'])
+            pd.testing.assert_frame_equal(loaded.data, data,
+                                          check_dtype=False)
+            self.assertTrue(loaded.data['Notes'].isnull().iloc[0])
+        ## Only the inverted index is stored
+        brute = DataBaseAPI(self.data.data, self.data.type_vars,
+                            self.data.responses_formatter,
+                            retrieval_pars={'retriever': 'brute'})
+        with self.assertRaises(ValueError):
+            brute.build_index(path)
+
+    def test_shared_memory(self):
+        block = self.data.publish_shared()
+        try:
+            shared = DataBaseAPI.attach_shared(block.name,
+                                               self.data.responses_formatter,
+                                               self.data.parameter_formatter)
+            ## Read-only views of the block
+            postings = shared.main_ret.postings
+            self.assertFalse(postings.data.flags.writeable)
+            self.assertFalse(postings.data.flags.owndata)
+            ## The names and labels are decoded from the block
+            self.assertIsNone(shared.data)
+            self.assertTrue(np.shares_memory(
+                shared.label_names.data,
+                np.ndarray(block.size, dtype=np.uint8,
+                           buffer=shared._shared_block.buf)))
+            self.assertEqual(list(shared.main_names),
+                             list(self.data.main_names))
+            self.assertEqual(shared.label_names[[2, 0]].tolist(),
+                             self.data.label_names[[2, 0]].tolist())
+            self.assertEqual(dict(shared.main_vectorizer.vocabulary_),
+                             self.data.main_vectorizer.vocabulary_)
+            self.assertNotIn('xxx', shared.main_vectorizer.vocabulary_)
+            c = self.data.type_vars['cat_vars']['name'][0]
+            for other, counts in self.data.facets.values_facets(c, [0]).\
+                    items():
+                np.testing.assert_array_equal(
+                    shared.facets.values_facets(c, [0])[other], counts)
+            keywords = self.keywords_main+self.keywords_cat
+            ids, ids_shared = self.data.query(keywords)[0],\
+                shared.query(keywords)[0]
+            for i in range(len(keywords)):
+                np.testing.assert_array_equal(ids['main_var'][i],
+                                              ids_shared['main_var'][i])
+            self.assertEqual(
+                self.data.get_query_info(['iphone'])['answer_names'],
+                shared.get_query_info(['iphone'])['answer_names'])
+            with self.assertRaises(ValueError):
+                shared.remove_ids([0])
+            ## Attached by other processes
+            if hasattr(os, 'fork'):
+                def attach():
+                    worker = DataBaseAPI.attach_shared(
+                        block.name, self.data.responses_formatter)
+                    ids = worker.query(['iphone'])[0]['main_var'][0]
+                    os._exit(0 if list(ids) == [0, 1, 2] else 1)
+                process = multiprocessing.get_context('fork').\
+                    Process(target=attach)
+                process.start()
+                process.join(30)
+                self.assertEqual(process.exitcode, 0)
+            del shared, postings
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_hashing_vectorizer(self):
+        hashing = DataBaseAPI(self.data.data, self.data.type_vars,
+                              self.data.responses_formatter,
+                              retrieval_pars={'vectorizer': 'hashing'})
+        self.assertFalse(hasattr(hashing.main_vectorizer, 'vocabulary_'))
+        keywords = self.keywords_main+self.keywords_cat+['iphone', 'xxx']
+        ids = self.data.columwise_query(keywords)
+        with tempfile.TemporaryDirectory() as path:
+            hashing.build_index(path)
+            loaded = DataBaseAPI.load_index(path,
+                                            self.data.responses_formatter)
+            for data in [hashing, loaded]:
+                ids_hashing = data.columwise_query(keywords)
+                for i in range(len(keywords)):
+                    self.assertEqual(list(ids['main_var'][i]),
+                                     list(ids_hashing['main_var'][i]))
+
+    def test_compact_dtypes(self):
+        compact = DataBaseAPI(self.data.data, self.data.type_vars,
+                              self.data.responses_formatter,
+                              retrieval_pars={'compact_dtypes': True})
+        self.assertEqual(compact.main_ret.postings.dtype, np.float32)
+        self.assertEqual(compact.cats_ids['Brand']['Apple'].dtype, np.uint8)
+        report, report_compact =\
+            self.data.memory_report(), compact.memory_report()
+        self.assertLess(report_compact['main_ret'], report['main_ret'])
+        self.assertLess(report_compact['cats_ids'], report['cats_ids'])
+        ## Same queries with compact ids
+        q_cat = self.data.get_query_info(['apple'])['query']
+        for pre in [None, q_cat]:
+            for k in self.keywords_main+self.keywords_cat:
+                ids, ids_compact = self.data.query([k], pre)[0],\
+                    compact.query([k], pre)[0]
+                self.assertEqual(ids_compact['main_var'][0].dtype, np.uint8)
+                self.assertEqual(list(ids['main_var'][0]),
+                                 list(ids_compact['main_var'][0]))
+                for c in ids['cat_vars']:
+                    self.assertEqual(ids_compact['cat_vars'][c][0].dtype,
+                                     np.uint8)
+                    self.assertEqual(list(ids['cat_vars'][c][0]),
+                                     list(ids_compact['cat_vars'][c][0]))
+        ## Stored and updated
+        with tempfile.TemporaryDirectory() as path:
+            compact.build_index(path)
+            loaded = DataBaseAPI.load_index(path,
+                                            self.data.responses_formatter)
+            self.assertEqual(loaded.main_ret.postings.dtype, np.float32)
+            self.assertEqual(loaded.cats_ids['Brand']['Apple'].dtype,
+                             np.uint8)
+        rows = compact.data.iloc[[0]*300]
+        rows.index = range(1000, 1300)
+        compact.add_rows(rows)
+        ids, _ = compact.query([rows['Product Name'].iloc[0]])
+        self.assertEqual(ids['main_var'][0].dtype, np.uint16)
+        self.assertIn(324, ids['main_var'][0])
+
+    def test_query_batch(self):
+        ids_cat, pars_cat = self.data.query(['apple'])
+        pre_cat = {'query_idxs': ids_cat, 'query_result':
+                   pars_cat['query_result']}
+        queries = [([k], None) for k in self.keywords_main] +\
+            [([k], pre_cat, True) for k in self.keywords_main] +\
+            [([k], pre_cat) for k in self.keywords_cat] +\
+            [(self.keywords_cat, None), (['iphone', 'apple'], None)]
+        results = self.data.query_batch_ids(queries)
+        self.assertEqual(len(results), len(queries))
+        for q, (ids, pars) in zip(queries, results):
+            ids_e, pars_e = self.data.query(*q)
+            self.assertEqual(pars, pars_e)
+            for i in range(len(q[0])):
+                self.assertEqual(list(ids['main_var'][i]),
+                                 list(ids_e['main_var'][i]))
+                for c in ids['cat_vars']:
+                    self.assertEqual(list(ids['cat_vars'][c][i]),
+                                     list(ids_e['cat_vars'][c][i]))
+        self.assertEqual(self.data.query_batch([]), [])
+
+    def test_query_cache(self):
+        data = DataBaseAPI(self.data.data, self.data.type_vars,
+                           self.data.responses_formatter,
+                           self.data.parameter_formatter,
+                           cache_pars={'query': {'maxsize': 2}})
+        self.assertEqual(self.data.cache_stats(), {})
+        with mock.patch.object(data, 'get_query_responses',
+                               return_value=({}, {})):
+            q0 = data.get_query_info(['iPhone  7'])
+            q1 = data.get_query_info(['iphone 7'])
+            self.assertEqual(data.cache_stats()['query']['hits'], 1)
+            self.assertIsNot(q0['query']['query_idxs'],
+                             q1['query']['query_idxs'])
+            ## Cached ids are read-only and containers are copies
+            ids = q1['query']['query_idxs']['main_var']
+            self.assertFalse(ids[0].flags.writeable)
+            data._cross_element_element_query(q1['query']['query_idxs'],
+                                              {'main_var': [np.array([])]})
+            q2 = data.get_query_info(['iphone 7'])
+            self.assertEqual(len(q2['query']['query_idxs']['main_var'][0]),
+                             len(q0['query']['query_idxs']['main_var'][0]))
+            ## Prior queries are part of the key
+            q3 = data.get_query_info(['iphone 7'], pre=q0['query'])
+            ## The arrays of the callers (results and priors) are not frozen
+            self.assertTrue(all([ids.flags.writeable for ids in
+                                 q0['query']['query_idxs']['main_var']]))
+            data.query_batch([(['iphone 7'], q0['query']), (['apple'], None)])
+            stats = data.cache_stats()['query']
+            self.assertEqual((stats['hits'], stats['misses']), (3, 3))
+            self.assertEqual(stats['evictions'], 1)
+
+    def test_responses_cache(self):
+        formatter = mock.Mock(side_effect=lambda l: ', '.join(l))
+        responses_formatter = dict(self.data.responses_formatter,
+                                   main_var=(formatter, 'names'))
+        data = DataBaseAPI(self.data.data, self.data.type_vars,
+                           responses_formatter,
+                           cache_pars={'responses': {'maxsize': 2}})
+        q0 = data.get_query_info(['iphone'])
+        q1 = data.get_query_info(['iphone'])
+        self.assertEqual(formatter.call_count, 1)
+        self.assertEqual(q0['answer_names'], q1['answer_names'])
+        self.assertIsNot(q0['answer_names'], q1['answer_names'])
+        self.assertEqual(data.cache_stats()['responses']['hits'], 1)
+        ## The label flag is part of the key
+        q2 = data.get_query_info(['iphone'], label=True)
+        self.assertNotEqual(q2['answer_names'], q0['answer_names'])
+        data.get_query_info(['iphone'], label=True)
+        self.assertEqual(data.cache_stats()['responses']['hits'], 2)
+        ## Catalog updates invalidate the responses
+        data.remove_ids([0])
+        data.get_query_info_from_ids(q0['query']['query_idxs'])
+        self.assertEqual(formatter.call_count, 2)
+
+    def test_truncated_responses(self):
+        responses_formatter = dict(self.data.responses_formatter,
+                                   main_var=(', '.join, 'names'),
+                                   max_items=2)
+        data = DataBaseAPI(self.data.data, self.data.type_vars,
+                           responses_formatter)
+        q_info = data.get_query_info(['watch'])
+        names = q_info['query']['query_names']['main_var']
+        self.assertEqual(len(names), 5)
+        self.assertEqual(q_info['answer_names']['names'],
+                         ', '.join(names[:2])+' (and 3 more)')
+        ## Custom count and labels
+        data.responses_formatter['more_items'] = lambda n: ' +%d' % n
+        _, responses = data.get_label_reponses(
+            q_info['query']['query_idxs'])
+        self.assertTrue(responses['query_productnames'].endswith(' +3'))
+        self.assertEqual(responses['query_productnames'].count('€'), 2)
+
+    def test_get_names_labels(self):
+        ids, _ = self.data.query(['apple'])
+        ids['cat_vars']['Brand'] = [np.array([0, 1])]
+        names = self.data.get_names(ids)
+        rows = self.data.data.index[ids['main_var'][0]]
+        expected = self.data.data.loc[rows, 'Product Name']
+        self.assertEqual(names['main_var'], list(expected))
+        self.assertEqual(names['cat_vars']['Brand'],
+                         self.data.categories['Brand'][:2])
+        self.assertEqual(names['cat_vars']['Category'], [])
+        labels = self.data.get_label(ids)
+        expected = self.data.data.loc[rows, 'Subscription Plan']
+        self.assertEqual(labels, [str(e) for e in expected])
+        ## Empty float arrays
+        ids = {'main_var': [np.array([])],
+               'cat_vars': {'Brand': [np.array([])],
+                            'Category': [np.array([])]}}
+        self.assertEqual(self.data.get_names(ids)['main_var'], [])
+        self.assertEqual(self.data.get_label(ids), [])
+
+    def test_query_batch_info(self):
+        q_cat = self.data.get_query_info(['apple'])
+        queries = [(['iphone'], None), (['iphone'], q_cat['query'], True),
+                   (['samsung'], q_cat['query'])]
+        for q, q_info in zip(queries, self.data.query_batch(queries)):
+            expected = self.data.get_query_info(*q)
+            self.assertEqual(q_info['answer_names'],
+                             expected['answer_names'])
+            self.assertEqual(list(q_info['query']['query_names']['main_var']),
+                             list(expected['query']['query_names']
+                                  ['main_var']))
+
+    def test_top_k(self):
+        top_data = copy.copy(self.data)
+        top_data.retrieval_pars = dict(self.data.retrieval_pars, top_k=3,
+                                       score_floor=0.1)
+        for retriever in ['inverted', 'brute']:
+            top_data.main_ret = create_main_retriever(retriever, 0.75)
+            top_data.main_ret.fit(self.data.main_vectorizer.
+                                  transform(self.data.main_names))
+            ids, pars = top_data.query(['iphone'])
+            self.assertTrue(0 < len(ids['main_var'][0]) <= 3)
+            scores = ids['main_scores'][0]
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            self.assertTrue(np.all(scores >= 0.1))
+            ## Refinement keeps the ranking
+            q_cat = top_data.get_query_info(['apple'])
+            ids_ref, _ = top_data.query(['iphone'], q_cat['query'])
+            logi = np.isin(ids['main_var'][0], ids_ref['main_var'][0])
+            np.testing.assert_array_equal(ids_ref['main_var'][0],
+                                          ids['main_var'][0][logi])
+            np.testing.assert_array_equal(ids_ref['main_scores'][0],
+                                          scores[logi])
+
+    def test_top_k_few_matches(self):
+        ## With a null score floor the brute retriever finds every element
+        ## in its radius, but only the ones sharing terms are returned
+        top_data = copy.copy(self.data)
+        top_data.retrieval_pars = dict(self.data.retrieval_pars, top_k=50,
+                                       score_floor=0.)
+        results = []
+        for retriever in ['inverted', 'brute']:
+            top_data.main_ret = create_main_retriever(retriever, 0.75)
+            top_data.main_ret.fit(self.data.main_vectorizer.
+                                  transform(self.data.main_names))
+            ids, _ = top_data.query(['macbook air'])
+            self.assertTrue(0 < len(ids['main_var'][0]) < 50)
+            self.assertTrue(np.all(ids['main_scores'][0] > 0))
+            results.append(ids)
+        np.testing.assert_array_equal(results[0]['main_var'][0],
+                                      results[1]['main_var'][0])
+        np.testing.assert_allclose(results[0]['main_scores'][0],
+                                   results[1]['main_scores'][0])
+
+    def test_refinement(self):
+        ref_data = copy.copy(self.data)
+        ref_data.retrieval_pars = dict(self.data.retrieval_pars,
+                                       refinement=True)
+        keywords = ['iphone', 'apple', 'galaxy', 'samsung galaxy', 'macbook',
+                    'macbook air', 'watch', 'plan']
+        for k0 in keywords:
+            pre = self.data.get_query_info([k0])['query']
+            for k1 in keywords:
+                ids, pars = self.data.query([k1], pre)
+                ids_ref, pars_ref = ref_data.query([k1], pre)
+                self.assertEqual(pars, pars_ref)
+                np.testing.assert_array_equal(ids['main_var'][0],
+                                              ids_ref['main_var'][0])
+        ## Top-k ranks among the previous rows
+        ref_data.retrieval_pars['top_k'] = 4
+        pre = ref_data.get_query_info(['iphone'])['query']
+        ref_data.retrieval_pars['top_k'] = 2
+        ids_ref, _ = ref_data.query(['iphone plus'], pre)
+        self.assertEqual(len(ids_ref['main_var'][0]), 2)
+        self.assertTrue(np.all(np.isin(ids_ref['main_var'][0],
+                                       pre['query_idxs']['main_var'][0])))
+        ## Batches refine each query with its own previous query
+        pre_plan = ref_data.get_query_info(['plan'])['query']
+        queries = [(['iphone plus'], pre), (['iphone plus'], None),
+                   (['watch'], pre_plan), (['iphone plus'], pre_plan)]
+        results = ref_data.query_batch_ids(queries)
+        for q, (ids, pars) in zip(queries, results):
+            ids_e, pars_e = ref_data.query(*q)
+            self.assertEqual(pars, pars_e)
+            for i in range(len(q[0])):
+                np.testing.assert_array_equal(ids['main_var'][i],
+                                              ids_e['main_var'][i])
+                np.testing.assert_array_equal(ids['main_scores'][i],
+                                              ids_e['main_scores'][i])
+
+    def test_category_element_mask(self):
+        ids_cat, _ = self.data.query(['apple'])
+        ids = np.arange(self.data.data.shape[0])
+        expected = self.data._category_element_mask(ids, ids_cat, 0)
+        for i in range(len(ids)):
+            self.assertEqual(self.data._category_element_mask(
+                ids[i:i+1], ids_cat, 0)[0], expected[i])
+
+    def test_fuzzy(self):
+        fuzzy_data = copy.copy(self.data)
+        fuzzy_data.retrieval_pars = dict(self.data.retrieval_pars,
+                                         fuzzy=True)
+        fuzzy_data._set_fuzzy_index()
+        for misspelled, keyword in [('iphnoe', 'iphone'),
+                                    ('samsng', 'samsung'),
+                                    ('galxy', 'galaxy')]:
+            ids, pars = self.data.query([misspelled])
+            self.assertEqual(pars['query_result']['query_type'], 'none')
+            ids_fuzzy, pars_fuzzy = fuzzy_data.query([misspelled])
+            expected, pars_expected = self.data.query([keyword])
+            self.assertEqual(pars_fuzzy, pars_expected)
+            np.testing.assert_array_equal(ids_fuzzy['main_var'][0],
+                                          expected['main_var'][0])
+            for c in expected['cat_vars']:
+                np.testing.assert_array_equal(ids_fuzzy['cat_vars'][c][0],
+                                              expected['cat_vars'][c][0])
+        ## Words of the catalog and unknown words are not corrected
+        ids, pars = fuzzy_data.query(['qwerty'])
+        self.assertEqual(pars['query_result']['query_type'], 'none')
+        ## New words of the catalog updates
+        rows = self.data.data.iloc[[0]].copy()
+        rows.index = [1001]
+        rows['Product Name'] = 'Zenfone Max'
+        fuzzy_data.add_rows(rows)
+        self.assertEqual(fuzzy_data.fuzzy_index.correct('zenfnoe max'),
+                         'zenfone max')
+
+    def test_facets(self):
+        q_cat = self.data.get_query_info(['apple'])['query']
+        self.assertEqual(q_cat['query_facets'],
+                         {'Brand': [{'Apple': 9}],
+                          'Category': [{'Computing': 4,
+                                        'Phones & Tablets': 3,
+                                        'Wearables': 2}]})
+        ## The rows of the elements are counted only on demand
+        q_ele = self.data.get_query_info(['watch'])['query']
+        self.assertEqual(q_ele['query_facets'],
+                         {'Brand': [{}], 'Category': [{}]})
+        rows_data = copy.copy(self.data)
+        rows_data.responses_formatter = dict(self.data.responses_formatter,
+                                             facets_rows=True)
+        q_ele = rows_data.get_query_info(['watch'])['query']
+        self.assertEqual(q_ele['query_facets']['Category'],
+                         [{'Wearables': 5}])
+        self.assertEqual(sum(q_ele['query_facets']['Brand'][0].values()), 5)
+        self.assertEqual(q_ele['query_facets'],
+                         self.data.get_facets(q_ele['query_idxs']))
+        ## Values of several categories are counted from their rows
+        ids = {'main_var': [np.array([], dtype=np.int64)],
+               'cat_vars': {'Brand': [np.array([2])],
+                            'Category': [np.array([0])]}}
+        rows = np.union1d(self.data.cats_ids['Brand'][
+                              self.data.categories['Brand'][2]],
+                          self.data.cats_ids['Category'][
+                              self.data.categories['Category'][0]])
+        expected = self.data.get_facets({'main_var': [rows],
+                                         'cat_vars': {}})
+        self.assertEqual(self.data.get_facets(ids), expected)
+        self.assertEqual(self.data.get_facets(ids, rows=False),
+                         {'Brand': [{}], 'Category': [{}]})
+        self.assertEqual(self.data.get_facets(
+            {'main_var': [np.array([], dtype=np.int64)],
+             'cat_vars': {}}), {'Brand': [{}], 'Category': [{}]})
+
+    def test_catalog_updates(self):
+        data = self.data
+        held_ids, _ = data.query(['iphone'])
+        held_names = list(data.get_names(held_ids)['main_var'])
+        ## Added rows
+        rows = data.data.iloc[[0, 3]].copy()
+        rows.index = [1001, 1002]
+        rows['Brand'] = ['Apple', 'Acme']
+        ids = data.add_rows(rows)
+        np.testing.assert_array_equal(ids, [25, 26])
+        ids_q, _ = data.query([rows['Product Name'].iloc[1]])
+        self.assertIn(26, ids_q['main_var'][0])
+        self.assertIn('Acme', data.categories['Brand'])
+        np.testing.assert_array_equal(data.cats_ids['Brand']['Acme'], [26])
+        ids_c, pars = data.query(['acme'])
+        self.assertEqual(pars['query_result']['query_type'], 'categories')
+        self.assertEqual(data.get_names(ids_c)['cat_vars']['Brand'],
+                         ['Acme'])
+        self.assertEqual(data.get_facets(ids_c)['Brand'], [{'Acme': 1}])
+        ## Updated rows
+        rows = data.data.loc[[1002]].copy()
+        rows['Subscription Plan'] = 1.
+        rows['Brand'] = 'Apple'
+        data.update_rows(rows)
+        self.assertEqual(len(data.cats_ids['Brand']['Acme']), 0)
+        self.assertIn(26, data.cats_ids['Brand']['Apple'])
+        self.assertEqual(data.cats_codes['Brand'][26],
+                         data.categories['Brand'].index('Apple'))
+        self.assertEqual(data.get_facets(ids_c)['Brand'], [{}])
+        self.assertEqual(data.label_names[26], '1.0')
+        with self.assertRaises(KeyError):
+            data.update_rows(rows.rename(index={1002: 2000}))
+        ## Removed rows
+        data.remove_ids([25, 26])
+        for compact in [False, True]:
+            if compact:
+                data.compact(background=True).join()
+            ids_q, _ = data.query([rows['Product Name'].iloc[0]])
+            self.assertNotIn(26, ids_q['main_var'][0])
+            self.assertNotIn(25, data.cats_ids['Brand']['Apple'])
+            self.assertEqual(data.cats_codes['Brand'][25], -1)
+            ## The ids held by the sessions are still valid
+            self.assertEqual(list(data.get_names(held_ids)['main_var']),
+                             held_names)
+        ## Incremental facets
+        expected = FacetCounts.from_codes(data.cats_codes, data.categories)
+        for j in range(len(data.categories['Brand'])):
+            counts = data.facets.values_facets('Brand', [j])
+            for c, e in expected.values_facets('Brand', [j]).items():
+                np.testing.assert_array_equal(counts[c], e)
+        ## Index labels are unique
+        with self.assertRaises(ValueError):
+            data.add_rows(rows)
+        rows = data.data.iloc[[0, 1]].copy()
+        rows.index = [3000, 3000]
+        with self.assertRaises(ValueError):
+            data.add_rows(rows)
+
     def test_get_message_reflection(self):
         self.data.get_reflection_query(self.message)
+        ## Compact mode with ids lists and arrays passed unchanged
+        compact = copy.copy(self.data)
+        compact.retrieval_pars = dict(self.data.retrieval_pars,
+                                      compact_dtypes=True)
+        message = copy.deepcopy(self.message)
+        for query_idxs in [[], np.array([], dtype=np.int64)]:
+            message['query']['query_idxs'] = query_idxs
+            reflected = compact.get_reflection_query(message)
+            self.assertIs(reflected['query']['query_idxs'], query_idxs)
+        ## The ids dicts are compacted without casting the message ids
+        ids, _ = self.data.query(['iphone apple'])
+        cats_dtypes = dict([(c, ids['cat_vars'][c][0].dtype)
+                            for c in ids['cat_vars']])
+        message['query']['query_idxs'] = ids
+        reflected = compact.get_reflection_query(message)['query']
+        self.assertIs(message['query']['query_idxs'], ids)
+        self.assertEqual(reflected['query_idxs']['main_var'][0].dtype,
+                         np.uint8)
+        self.assertEqual(ids['main_var'][0].dtype, np.int64)
+        for c in ids['cat_vars']:
+            self.assertEqual(reflected['query_idxs']['cat_vars'][c][0].dtype,
+                             np.uint8)
+            self.assertEqual(ids['cat_vars'][c][0].dtype, cats_dtypes[c])
@@ -0,0 +1,81 @@
+
+import unittest
+import numpy as np
+
+from chatbotQuery.dbapi.dbapi_caching import LRUCache, create_cache,\
+    freeze, thaw, fingerprint
+
+
+class Test_LRUCache(unittest.TestCase):
+    """Testing the bounded caches.
+    """
+
+    def test_lru_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1,
+                                         'evictions': 1, 'size': 2,
+                                         'maxsize': 2})
+        self.assertIn('a', cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_ttl_eviction(self):
+        now = [0.]
+        cache = LRUCache(maxsize=10, ttl=5, timer=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 4.
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 6.
+        self.assertNotIn('a', cache)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.evictions, 1)
+
+    def test_create_cache(self):
+        self.assertIsNone(create_cache(None))
+        self.assertIsInstance(create_cache({'maxsize': 3}), LRUCache)
+
+
+class Test_CachedStructures(unittest.TestCase):
+    """Testing the utils to store query structures.
+    """
+
+    def setUp(self):
+        main_var = np.empty(1, dtype=object)
+        main_var[0] = np.array([1, 2, 3])
+        self.query = {'main_var': main_var,
+                      'cat_vars': {'Brand': [np.array([0])]}}
+
+    def test_freeze_thaw(self):
+        frozen = freeze(self.query)
+        self.assertFalse(frozen['main_var'][0].flags.writeable)
+        with self.assertRaises(ValueError):
+            frozen['main_var'][0][0] = 5
+        ## The arrays of the caller are copied and keep their flags
+        self.assertTrue(self.query['main_var'][0].flags.writeable)
+        self.query['main_var'][0][0] = 5
+        self.assertNotEqual(frozen['main_var'][0][0], 5)
+        self.assertIs(freeze(frozen)['main_var'][0], frozen['main_var'][0])
+        thawed = thaw(frozen)
+        thawed['main_var'][0] = np.array([])
+        thawed['cat_vars']['Brand'].append(np.array([1]))
+        self.assertEqual(len(frozen['main_var'][0]), 3)
+        self.assertEqual(len(frozen['cat_vars']['Brand']), 1)
+        ## Tuples of structures
+        frozen = freeze((self.query, {'names': 'a'}))
+        self.assertIsInstance(thaw(frozen), tuple)
+        self.assertFalse(frozen[0]['main_var'][0].flags.writeable)
+
+    def test_fingerprint(self):
+        other = thaw(self.query)
+        other['main_var'][0] = np.array([1, 2, 3], dtype=np.int32)
+        self.assertEqual(fingerprint(self.query), fingerprint(other))
+        other['main_var'][0] = np.array([1, 2])
+        self.assertNotEqual(fingerprint(self.query), fingerprint(other))
+        self.assertEqual(fingerprint([np.array([])]),
+                         fingerprint([np.array([], dtype=np.int64)]))
@@ -0,0 +1,156 @@
+
+import unittest
+import numpy as np
+
+import pandas as pd
+
+from chatbotQuery.dbapi.dbapi_category_index import CategoryBitmapIndex,\
+    FacetCounts, group_rows
+
+
+class Test_CategoryBitmapIndex(unittest.TestCase):
+    """Testing the bitmap operations against the numpy set operations.
+    """
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.n_rows = 1000
+        ## Few dense values and a lot of sparse ones
+        codes = np.concatenate([random_state.randint(0, 3, 900),
+                                random_state.randint(3, 50, 100)])
+        random_state.shuffle(codes)
+        self.categories = {'cat': list(range(50))}
+        self.cats_ids = {'cat': dict([(v, np.nonzero(codes == v)[0])
+                                      for v in range(50)])}
+        self.index =\
+            CategoryBitmapIndex.from_cats_ids(self.cats_ids, self.categories,
+                                              self.n_rows)
+
+    def test_conversions(self):
+        ids = np.array([0, 5, 63, 64, 65, 500, 999])
+        bitmap = self.index.from_ids(ids)
+        np.testing.assert_array_equal(self.index.to_ids(bitmap), ids)
+        np.testing.assert_array_equal(self.index.to_ids(self.index.empty()),
+                                      np.array([], dtype=np.int64))
+        np.testing.assert_array_equal(self.index.filter([999, 1, 5], bitmap),
+                                      np.array([999, 5]))
+
+    def test_union(self):
+        self.assertTrue(len(self.index.dense_values('cat')) > 0)
+        for values in [[], [0], [10, 20], [0, 1, 30, 49]]:
+            expected = np.array([], dtype=np.int64)
+            for v in values:
+                expected = np.union1d(expected, self.cats_ids['cat'][v])
+            bitmap = self.index.union('cat', values)
+            np.testing.assert_array_equal(self.index.to_ids(bitmap),
+                                          expected)
+        np.testing.assert_array_equal(
+            self.index.union_values('cat', [3, 1], np.array([]), [1, 7]),
+            np.array([1, 3, 7]))
+
+    def test_update(self):
+        ## Rows moved to other values and new rows of a new value
+        cats_ids = {'cat': dict(self.cats_ids['cat'])}
+        cats_ids['cat'][0] = np.setdiff1d(cats_ids['cat'][0], np.arange(100))
+        cats_ids['cat'][4] = np.union1d(cats_ids['cat'][4], np.arange(100))
+        cats_ids['cat'][50] = np.arange(1000, 1100)
+        categories = {'cat': list(range(51))}
+        moved = np.intersect1d(self.cats_ids['cat'][0], np.arange(100))
+        self.index.resize(1100)
+        self.index.update('cat', dict([(j, cats_ids['cat'][j])
+                                       for j in [0, 4, 50]]),
+                          {4: moved, 50: np.arange(1000, 1100)}, {0: moved})
+        expected = CategoryBitmapIndex.from_cats_ids(cats_ids, categories,
+                                                     1100)
+        self.assertIn(50, self.index.dense_values('cat'))
+        for values in [[0], [1, 4], [50, 2, 30]]:
+            np.testing.assert_array_equal(self.index.union('cat', values),
+                                          expected.union('cat', values))
+        ## Growth beyond the capacity of the buffers
+        self.index.resize(5000)
+        self.assertEqual(len(self.index.union('cat', [0])), (5000+63)//64)
+        np.testing.assert_array_equal(
+            self.index.to_ids(self.index.union('cat', [4])),
+            cats_ids['cat'][4])
+
+
+class Test_FacetCounts(unittest.TestCase):
+    """Testing the precomputed facets against the counts of the rows.
+    """
+
+    def test_facets(self):
+        random_state = np.random.RandomState(0)
+        cats_codes = {'a': random_state.randint(-1, 5, 300),
+                      'b': random_state.randint(-1, 8, 300)}
+        categories = {'a': list(range(5)), 'b': list(range(8))}
+        facets = FacetCounts.from_codes(cats_codes, categories)
+        for c, values in [('a', [0]), ('a', [1, 3]), ('b', [7, 2, 2])]:
+            rows = np.nonzero(np.isin(cats_codes[c], values))[0]
+            expected = facets.rows_facets(cats_codes, rows)
+            counts = facets.values_facets(c, values)
+            for c1 in categories:
+                np.testing.assert_array_equal(counts[c1], expected[c1])
+                self.assertEqual(len(counts[c1]), len(categories[c1]))
+
+    def test_update(self):
+        random_state = np.random.RandomState(0)
+        categories = {'a': list(range(5)), 'b': list(range(8)),
+                      'c': list(range(3))}
+        cats_codes = dict([(c, random_state.randint(-1, len(v), 300))
+                           for c, v in categories.items()])
+        facets = FacetCounts.from_codes(cats_codes, categories)
+        self.assertEqual(sorted(facets.cooccurrences),
+                         [('a', 'b'), ('a', 'c'), ('b', 'c')])
+        ## Rows moved, removed and added with new values
+        for _ in range(20):
+            ids = np.unique(random_state.randint(0, 320, 10))
+            categories['b'] = list(range(len(categories['b'])+1))
+            old_codes, new_codes = {}, {}
+            for c in categories:
+                codes = -np.ones(320, dtype=np.int64)
+                codes[:len(cats_codes[c])] = cats_codes[c]
+                old_codes[c] = codes[ids].copy()
+                new_codes[c] = random_state.randint(-1, len(categories[c]),
+                                                    len(ids))
+                codes[ids] = new_codes[c]
+                cats_codes[c] = codes
+            facets.update(old_codes, new_codes,
+                          dict([(c, len(v)) for c, v in categories.items()]))
+            expected = FacetCounts.from_codes(cats_codes, categories)
+            for c, values in [('a', [0, 4]), ('b', [1, 3, 8]), ('c', [2])]:
+                counts = facets.values_facets(c, values)
+                expected_counts = expected.values_facets(c, values)
+                for c1 in categories:
+                    np.testing.assert_array_equal(counts[c1],
+                                                  expected_counts[c1])
+
+
+class Test_GroupRows(unittest.TestCase):
+    """Testing the grouping of rows against the boolean scans.
+    """
+
+    def test_group_rows(self):
+        random_state = np.random.RandomState(0)
+        columns = [pd.Series(random_state.randint(0, 20, 500)),
+                   pd.Series(random_state.choice(['a', 'b', 'c'], 500)),
+                   pd.Series(['a', np.nan, 'b', 'a', None, np.nan]),
+                   pd.Series([np.nan, 1., 2., 1.])]
+        for column in columns:
+            categories, cats_ids, codes = group_rows(column)
+            expected = list(column.unique())
+            self.assertEqual(len(categories), len(expected))
+            for v, e in zip(categories, expected):
+                self.assertIs(type(v), type(e))
+                if pd.isnull(e):
+                    self.assertEqual(len(cats_ids[v]), 0)
+                else:
+                    self.assertEqual(v, e)
+                    np.testing.assert_array_equal(
+                        cats_ids[v], np.nonzero(np.array(column == v))[0])
+                    self.assertEqual(cats_ids[v].dtype, np.int64)
+            ## Value position of each row
+            for j, v in enumerate(categories):
+                np.testing.assert_array_equal(np.nonzero(codes == j)[0],
+                                              cats_ids[v])
+            self.assertEqual(codes.dtype, np.int32)
+            self.assertTrue(np.all(codes[np.array(column.isnull())] == -1))
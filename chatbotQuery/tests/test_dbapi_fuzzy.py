@@ -0,0 +1,38 @@
+
+import unittest
+
+from chatbotQuery.dbapi.dbapi_fuzzy import FuzzyWordIndex, deletions,\
+    max_edits
+
+
+class Test_FuzzyWordIndex(unittest.TestCase):
+    """Testing the correction of misspelled words.
+    """
+
+    def setUp(self):
+        self.index = FuzzyWordIndex().fit(['iPhone 7 128GB', 'iPhone 7 Plus',
+                                           'Galaxy S8 64GB', 'Phone case',
+                                           'MacBook Air'])
+
+    def test_deletions(self):
+        self.assertEqual(deletions('abc', 1), set(['abc', 'bc', 'ac', 'ab']))
+        self.assertEqual(len(deletions('abcd', 2)), 1+4+6)
+        self.assertEqual([max_edits(w) for w in ['abc', 'abcd', 'abcdefgh']],
+                         [0, 1, 2])
+
+    def test_correct(self):
+        self.assertEqual(self.index.correct_word('iphnoe'), 'iphone')
+        self.assertEqual(self.index.correct_word('Galxy'), 'galaxy')
+        self.assertEqual(self.index.correct_word('macbok'), 'macbook')
+        ## Too short, too far or already known words are kept
+        self.assertEqual(self.index.correct_word('plsu'), 'plus')
+        self.assertEqual(self.index.correct_word('xyz'), 'xyz')
+        self.assertEqual(self.index.correct_word('qwerty'), 'qwerty')
+        self.assertEqual(self.index.correct_word('phone'), 'phone')
+        self.assertEqual(self.index.correct('Galxy S8, iphnoe 7'),
+                         'galaxy s8, iphone 7')
+
+    def test_add(self):
+        self.assertEqual(self.index.correct_word('zenfnoe'), 'zenfnoe')
+        self.index.add(['Zenfone Max'])
+        self.assertEqual(self.index.correct_word('zenfnoe'), 'zenfone')
@@ -0,0 +1,30 @@
+
+import unittest
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from chatbotQuery.dbapi.dbapi_memory import nbytes, memory_report
+
+
+class Test_Memory(unittest.TestCase):
+    """Testing the estimation of the memory of the structures.
+    """
+
+    def test_nbytes(self):
+        array = np.zeros(100)
+        self.assertEqual(nbytes(array), 800)
+        matrix = sparse.random(10, 10, density=0.5, format='csr')
+        self.assertEqual(nbytes(matrix), matrix.data.nbytes +
+                         matrix.indices.nbytes+matrix.indptr.nbytes)
+        ## Shared arrays are counted once
+        self.assertLess(nbytes([array, array]), 2*800)
+        objects = np.empty(2, dtype=object)
+        objects[0], objects[1] = array, np.zeros(10, dtype=np.uint8)
+        self.assertGreaterEqual(nbytes(objects), 810)
+        self.assertGreater(nbytes(pd.DataFrame({'a': array})), 800)
+
+    def test_memory_report(self):
+        report = memory_report({'a': np.zeros(10), 'b': {'c': np.zeros(5)}})
+        self.assertEqual(report['a'], 80)
+        self.assertGreater(report['b'], 40)
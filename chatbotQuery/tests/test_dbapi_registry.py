@@ -0,0 +1,113 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+import multiprocessing
+
+from chatbotQuery.datasets import fetch_data_products
+from chatbotQuery.dbapi.dbapi_registry import DataBaseAPIRegistry,\
+    describe_parameters, files_mtimes
+from chatbotQuery.tests.dbapi_fixtures import joiner, products_parameters
+
+
+class Test_DataBaseAPIRegistry(unittest.TestCase):
+    """Testing the registry of shared DataBaseAPI.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.datafile = os.path.join(self.folder, 'products.csv')
+        fetch_data_products().to_csv(self.datafile)
+        self.parameters = products_parameters(self.datafile)
+        self.builds = []
+
+        def builder(parameters):
+            self.builds.append(parameters)
+            return object()
+        self.registry = DataBaseAPIRegistry(builder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_shared_instances(self):
+        dbapi = self.registry.get(self.parameters)
+        self.assertIs(self.registry.get(dict(self.parameters)), dbapi)
+        self.assertIn(self.parameters, self.registry)
+        self.assertEqual(len(self.builds), 1)
+        ## Different parameters
+        other = dict(self.parameters)
+        other['responses_formatter'] = {'join_cats': (joiner, 'other')}
+        self.assertIsNot(self.registry.get(other), dbapi)
+        self.assertEqual(len(self.registry), 2)
+
+    def test_invalidation(self):
+        dbapi = self.registry.get(self.parameters)
+        ## Data file modified: the instance is replaced
+        mtime = os.path.getmtime(self.datafile)+10
+        os.utime(self.datafile, (mtime, mtime))
+        self.assertIsNot(self.registry.get(self.parameters), dbapi)
+        self.assertEqual(len(self.registry), 1)
+        ## Explicit invalidation
+        self.registry.invalidate(self.parameters)
+        self.assertNotIn(self.parameters, self.registry)
+        self.registry.get(self.parameters)
+        self.registry.invalidate()
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(len(self.builds), 3)
+
+    def test_describe_parameters(self):
+        description = describe_parameters(self.parameters)
+        self.assertEqual(description['data_info'], {'file': self.datafile})
+        self.assertEqual(files_mtimes(description),
+                         [os.path.getmtime(self.datafile)])
+        self.assertIn('function', description['responses_formatter']
+                      ['join_cats'][0])
+        self.assertIn('dataframe', describe_parameters(fetch_data_products()))
+        ## Functions described by their code, not their position
+        f0, f1, f2 = (lambda l: joiner(l)), (lambda l: l), (lambda l: l)
+        self.assertNotEqual(self.registry.key({'f': f0}),
+                            self.registry.key({'f': f1}))
+        self.assertEqual(self.registry.key({'f': f1}),
+                         self.registry.key({'f': f2}))
+        self.assertNotEqual(self.registry.key({'f': lambda l: l+'a'}),
+                            self.registry.key({'f': lambda l: l+'b'}))
+
+        def closure(sep):
+            return lambda l: sep.join(l)
+        self.assertNotEqual(self.registry.key({'f': closure(', ')}),
+                            self.registry.key({'f': closure('; ')}))
+
+    def test_read_only(self):
+        registry = DataBaseAPIRegistry()
+        dbapi = registry.get(self.parameters)
+        self.assertTrue(dbapi.read_only)
+        rows = dbapi.data.iloc[:1]
+        with self.assertRaises(ValueError):
+            dbapi.update_rows(rows)
+        with self.assertRaises(ValueError):
+            dbapi.remove_ids([0])
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "Fork not available.")
+    def test_fork_safety(self):
+        self.registry.get(self.parameters)
+        ## Lock held by another thread of the parent during the fork
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with self.registry._lock:
+                locked.set()
+                release.wait()
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        locked.wait()
+        try:
+            process = multiprocessing.get_context('fork').\
+                Process(target=self.registry.get, args=(self.parameters,))
+            process.start()
+            process.join(10)
+            self.assertEqual(process.exitcode, 0)
+        finally:
+            release.set()
+            thread.join()
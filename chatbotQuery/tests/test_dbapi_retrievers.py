@@ -0,0 +1,160 @@
+
+import unittest
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors
+
+from chatbotQuery.dbapi import DummyRetriever, DummyVectorizer
+from chatbotQuery.dbapi.dbapi_retrievers import InvertedIndexRetriever,\
+    TokenIndexRetriever, create_main_retriever, select_top_k
+
+
+class Test_InvertedIndexRetriever(unittest.TestCase):
+    """Testing the sparse retrievers against the brute-force ones.
+    """
+
+    def setUp(self):
+        self.data_sp = sparse.random(200, 50, density=0.1, format='csr',
+                                     random_state=0)
+        self.queries_sp = sparse.random(10, 50, density=0.1, format='csr',
+                                        random_state=1)
+
+    def assert_same_neighbors(self, retriever, radius):
+        brute = NearestNeighbors(metric='cosine', algorithm='brute')
+        brute.fit(self.data_sp)
+        _, ids_brute = brute.radius_neighbors(self.queries_sp.A, radius)
+        _, ids = retriever.radius_neighbors(self.queries_sp, radius)
+        self.assertEqual(len(ids), len(ids_brute))
+        for i in range(len(ids)):
+            np.testing.assert_array_equal(ids[i], np.sort(ids_brute[i]))
+
+    def test_radius_neighbors(self):
+        retriever = InvertedIndexRetriever().fit(self.data_sp)
+        for radius in [0.1, 0.75, 0.9, 1.]:
+            self.assert_same_neighbors(retriever, radius)
+
+    def test_top_neighbors(self):
+        retriever = InvertedIndexRetriever().fit(self.data_sp)
+        sims = retriever.similarities(self.queries_sp).A
+        scores, ids = retriever.top_neighbors(self.queries_sp, 5, 0.1)
+        for i in range(len(ids)):
+            expected = np.argsort(-sims[i], kind='stable')[:5]
+            expected = expected[sims[i][expected] >= 0.1]
+            np.testing.assert_array_equal(ids[i], expected)
+            np.testing.assert_allclose(scores[i], sims[i][expected])
+
+    def test_neighbors_in(self):
+        retriever = InvertedIndexRetriever().fit(self.data_sp)
+        retriever.remove([4, 7])
+        random_state = np.random.RandomState(0)
+        rows = [np.sort(random_state.choice(200, 60, replace=False))
+                for i in range(self.queries_sp.shape[0])]
+        _, ids_full = retriever.radius_neighbors(self.queries_sp, 0.9)
+        _, ids = retriever.radius_neighbors_in(self.queries_sp, rows, 0.9)
+        sims = retriever.similarities(self.queries_sp).A
+        scores_top, ids_top =\
+            retriever.top_neighbors_in(self.queries_sp, rows, 3, 0.05)
+        for i in range(len(ids)):
+            np.testing.assert_array_equal(
+                ids[i], ids_full[i][np.isin(ids_full[i], rows[i])])
+            candidates = np.setdiff1d(rows[i], [4, 7])
+            candidates = candidates[sims[i][candidates] >= 0.05]
+            expected = candidates[np.argsort(-sims[i][candidates],
+                                             kind='stable')[:3]]
+            np.testing.assert_array_equal(ids_top[i], expected)
+            np.testing.assert_allclose(scores_top[i], sims[i][expected])
+
+    def test_create_main_retriever(self):
+        retriever = create_main_retriever('inverted', 0.75)
+        self.assertIsInstance(retriever, InvertedIndexRetriever)
+        retriever = create_main_retriever('brute', 0.75)
+        self.assertIsInstance(retriever, NearestNeighbors)
+        self.assertIs(create_main_retriever(retriever, 0.75), retriever)
+        with self.assertRaises(AssertionError):
+            create_main_retriever(None, 0.75)
+
+
+    def test_updates(self):
+        retriever = InvertedIndexRetriever().fit(self.data_sp[:150])
+        ids = retriever.add(self.data_sp[150:180])
+        np.testing.assert_array_equal(ids, np.arange(150, 180))
+        retriever.add(self.data_sp[180:])
+        ## Replaced and removed elements
+        data_sp = self.data_sp.tolil()
+        updated = sparse.random(5, 50, density=0.2, format='csr',
+                                random_state=2)
+        data_sp[[3, 10, 160, 190, 199]] = updated
+        retriever.add(updated, [3, 10, 160, 190, 199])
+        removed = np.array([0, 10, 151, 185])
+        data_sp[removed] = 0
+        retriever.remove(removed)
+        self.assertEqual(retriever.n_segments, 4)
+        expected = InvertedIndexRetriever().fit(data_sp)
+        for compact in [False, True]:
+            if compact:
+                retriever.compact()
+                self.assertEqual(retriever.n_segments, 1)
+            np.testing.assert_allclose(
+                retriever.similarities(self.queries_sp).A,
+                expected.similarities(self.queries_sp).A)
+            np.testing.assert_allclose(retriever.postings.A,
+                                       expected.postings.A)
+            _, ids = retriever.radius_neighbors(self.queries_sp, 1.)
+            for ids_i in ids:
+                self.assertFalse(np.any(np.isin(ids_i, removed)))
+            ## Subset queries among the segments
+            rows = [np.arange(0, 200, 3)]*self.queries_sp.shape[0]
+            dists, ids = retriever.radius_neighbors_in(self.queries_sp,
+                                                       rows, 0.95)
+            dists_e, ids_e = expected.radius_neighbors_in(self.queries_sp,
+                                                          rows, 0.95)
+            for i in range(len(ids)):
+                np.testing.assert_array_equal(ids[i], ids_e[i])
+                np.testing.assert_allclose(dists[i], dists_e[i])
+
+    def test_select_top_k(self):
+        ids, scores = select_top_k(np.array([3, 1, 2, 0]),
+                                   np.array([.5, .9, .5, .1]), 3)
+        np.testing.assert_array_equal(ids, [1, 2, 3])
+        np.testing.assert_array_equal(scores, [.9, .5, .5])
+        ## Ties of the last selected score
+        ids, _ = select_top_k(np.array([9, 7, 3, 5, 8]),
+                              np.array([.5, .5, .9, .5, .5]), 3)
+        np.testing.assert_array_equal(ids, [3, 5, 7])
+
+
+class Test_TokenIndexRetriever(unittest.TestCase):
+    """Testing the indexed category retriever against `DummyRetriever`.
+    """
+
+    def setUp(self):
+        self.categories = ['Apple', 'Samsung', 'Phones & Tablets',
+                           'Smart Watches', 'Tablets', 'Google Home']
+        self.keywords = ['apple phones', 'tablets', 'home', 'watches tablets',
+                         'x', '', 'Phones & Tablets', 'samsung apple']
+
+    def assert_same_retrieved(self, categories, keywords, radius):
+        dummy = DummyRetriever(radius=radius).fit(categories)
+        for ngram_index in [True, False]:
+            retriever = TokenIndexRetriever(radius=radius,
+                                            ngram_index=ngram_index)
+            retriever.fit(categories)
+            retrieved = retriever.radius_neighbors(keywords)
+            expected = dummy.radius_neighbors(keywords)
+            self.assertEqual(len(retrieved), len(expected))
+            for r, e in zip(retrieved, expected):
+                np.testing.assert_array_equal(r, e)
+                self.assertEqual(r.dtype, e.dtype)
+
+    def test_tokens(self):
+        vectorizer = DummyVectorizer()
+        categories = vectorizer.fit_transform(self.categories)
+        keywords = vectorizer.transform(self.keywords)
+        for radius in [1, 2]:
+            self.assert_same_retrieved(categories, keywords, radius)
+
+    def test_substrings(self):
+        categories = [c.lower() for c in self.categories]
+        keywords = [k.split(' ') for k in self.keywords]+[['ab', 'lets']]
+        for radius in [1, 2]:
+            self.assert_same_retrieved(categories, keywords, radius)
@@ -0,0 +1,48 @@
+
+import unittest
+import numpy as np
+
+from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_sharding import ShardedDataBaseAPI
+from chatbotQuery.tests.dbapi_fixtures import products_parameters
+
+
+class Test_ShardedDataBaseAPI(unittest.TestCase):
+    """Testing the sharded database against the single process one.
+    """
+
+    def setUp(self):
+        self.parameters = products_parameters()
+        self.keywords = ['iphone', 'galaxy 64GB', 'apple', 'samsung',
+                         'tablets', 'vacuum', 'xx']
+
+    def assert_same_answers(self, retrieval_pars={}):
+        data = DataBaseAPI(retrieval_pars=retrieval_pars, **self.parameters)
+        with ShardedDataBaseAPI(n_shards=3, retrieval_pars=retrieval_pars,
+                                **self.parameters) as sharded:
+            self.assertEqual(len(sharded.main_ret.pools), 3)
+            for k0 in self.keywords:
+                pre = data.get_query_info([k0])['query']
+                for k1 in self.keywords:
+                    expected = data.get_query_info([k1], pre)
+                    answer = sharded.get_query_info([k1], pre)
+                    self.assertEqual(answer['answer_names'],
+                                     expected['answer_names'])
+                    ids, ids_expected = answer['query']['query_idxs'],\
+                        expected['query']['query_idxs']
+                    for key in ['main_var', 'main_scores']:
+                        if key in ids_expected:
+                            np.testing.assert_allclose(
+                                np.asarray(ids[key][0], dtype=float),
+                                np.asarray(ids_expected[key][0], dtype=float))
+
+    def test_radius_queries(self):
+        self.assert_same_answers()
+
+    def test_top_k_queries(self):
+        self.assert_same_answers({'top_k': 4})
+
+    def test_not_updatable(self):
+        with ShardedDataBaseAPI(**self.parameters) as sharded:
+            with self.assertRaises(ValueError):
+                sharded.remove_ids([0])
@@ -0,0 +1,118 @@
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+from chatbotQuery.datasets import fetch_data_products
+from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_sqlite import SQLiteDataBaseAPI
+from chatbotQuery.tests.dbapi_fixtures import products_type_vars,\
+    products_responses_formatter
+
+
+class Test_SQLiteDataBaseAPI(unittest.TestCase):
+    """Testing the SQLite database against the in-memory one.
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'products.db')
+        type_vars = products_type_vars()
+        responses_formatter = products_responses_formatter()
+        SQLiteDataBaseAPI.build_database(self.path, fetch_data_products(),
+                                         type_vars)
+        self.data = SQLiteDataBaseAPI(self.path, responses_formatter)
+        self.memory = DataBaseAPI(fetch_data_products(), type_vars,
+                                  responses_formatter)
+
+    def tearDown(self):
+        self.data.close()
+        shutil.rmtree(self.folder)
+
+    def test_same_ids(self):
+        keywords = ['apple iphone', 'iPhone 7 128', 'galaxy s7 phone',
+                    'iphone 7 plus', 'watch', 'watch 42mm', 'macbook air',
+                    'drone bebop 2', 'vacuum cleaner', '7', 'xx']
+        for top_k in [None, 2, 1]:
+            for data in [self.data, self.memory]:
+                data.retrieval_pars['top_k'] = top_k
+            ids, _ = self.data.query(keywords)
+            expected, _ = self.memory.query(keywords)
+            for key in expected:
+                if key == 'cat_vars':
+                    continue
+                for i in range(len(keywords)):
+                    np.testing.assert_array_equal(ids[key][i],
+                                                  expected[key][i])
+        ## Radius covering every element
+        self.data.retrieval_pars.update(top_k=None, radius=1.)
+        ids, _ = self.data.query(['watch', 'xx'])
+        for i in range(2):
+            np.testing.assert_array_equal(ids['main_var'][i], np.arange(25))
+
+    def test_same_answers(self):
+        keywords = ['iphone', 'galaxy 64gb', 'apple', 'samsung', 'tablets',
+                    'iphone 7 plus', 'xx']
+        for k0 in keywords:
+            pre = self.memory.get_query_info([k0])['query']
+            for k1 in keywords:
+                for label in [None, True]:
+                    answer = self.data.get_query_info([k1], pre, label)
+                    expected = self.memory.get_query_info([k1], pre, label)
+                    self.assertEqual(answer['answer_names'],
+                                     expected['answer_names'])
+                    self.assertEqual(answer['query']['query_result'],
+                                     expected['query']['query_result'])
+                    self.assertEqual(answer['query']['query_facets'],
+                                     expected['query']['query_facets'])
+
+    def test_names_labels(self):
+        ids = {'main_var': [np.array([4, 0, 2])],
+               'cat_vars': {'Brand': [np.array([1])],
+                            'Category': [np.array([], dtype=np.int64)]}}
+        self.assertEqual(self.data.get_names(ids),
+                         self.memory.get_names(ids))
+        self.assertIsInstance(self.data.get_names(ids)['main_var'], list)
+        self.assertEqual(self.data.get_label(ids),
+                         self.memory.get_label(ids))
+
+    def test_fuzzy(self):
+        self.data.retrieval_pars['fuzzy'] = True
+        self.data._set_fuzzy_index()
+        ids, pars = self.data.query(['galxy 64gb'])
+        np.testing.assert_array_equal(ids['main_var'][0], [3, 4])
+        self.assertEqual(pars['query_result']['query_type'], 'elements')
+
+    def test_top_k(self):
+        self.data.retrieval_pars['top_k'] = 1
+        ids, _ = self.data.query(['galaxy 64gb'])
+        self.assertEqual(len(ids['main_var'][0]), 1)
+        self.assertEqual(len(ids['main_scores'][0]), 1)
+
+    def test_connections(self):
+        ## Read-only connection pooled by thread
+        with self.assertRaises(sqlite3.OperationalError):
+            self.data._connection().execute("DELETE FROM rows")
+        connections, connected, release = [], threading.Event(),\
+            threading.Event()
+
+        def connect():
+            connections.append(self.data._connection())
+            connected.set()
+            release.wait()
+        thread = threading.Thread(target=connect)
+        thread.start()
+        connected.wait()
+        self.assertIsNot(connections[0], self.data._connection())
+        self.assertIs(self.data._connection(), self.data._connection())
+        self.assertEqual(len(self.data._connections), 2)
+        ## Closed at the end of its thread
+        release.set()
+        thread.join()
+        self.assertEqual(len(self.data._connections), 1)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            connections[0].execute("SELECT 1")
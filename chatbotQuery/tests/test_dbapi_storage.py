@@ -0,0 +1,39 @@
+
+import unittest
+import numpy as np
+
+from chatbotQuery.dbapi.dbapi_storage import to_string_block, StringBlock,\
+    BlockVocabulary
+
+
+class Test_StringBlocks(unittest.TestCase):
+    """Testing the strings stored as blocks of bytes and offsets.
+    """
+
+    def setUp(self):
+        self.values = ['iphone 7', '', u'caf\xe9', 'galaxy s8', 'a']
+
+    def test_string_block(self):
+        block = StringBlock(*to_string_block(self.values))
+        self.assertEqual(len(block), 5)
+        self.assertEqual(list(block), self.values)
+        self.assertEqual(block[2], u'caf\xe9')
+        self.assertEqual(block[-1], 'a')
+        names = block[np.array([3, 0])]
+        self.assertEqual(names.dtype, object)
+        self.assertEqual(names.tolist(), ['galaxy s8', 'iphone 7'])
+        self.assertEqual(block[1:3].tolist(), ['', u'caf\xe9'])
+        self.assertEqual(block[[]].tolist(), [])
+
+    def test_block_vocabulary(self):
+        terms = StringBlock(*to_string_block(self.values))
+        vocabulary = BlockVocabulary(terms,
+                                     BlockVocabulary.sorted_order(self.values))
+        self.assertEqual(dict(vocabulary),
+                         dict(zip(self.values, range(len(self.values)))))
+        self.assertEqual(vocabulary['galaxy s8'], 3)
+        self.assertIn(u'caf\xe9', vocabulary)
+        for term in ['iphone', 'z', 'b', 3]:
+            self.assertNotIn(term, vocabulary)
+        with self.assertRaises(KeyError):
+            vocabulary['iphone 8']
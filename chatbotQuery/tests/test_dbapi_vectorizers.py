@@ -0,0 +1,41 @@
+
+import unittest
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from chatbotQuery.datasets import fetch_data_products
+from chatbotQuery.dbapi.dbapi_vectorizers import HashingTfidfVectorizer,\
+    create_main_vectorizer
+
+
+class Test_HashingTfidfVectorizer(unittest.TestCase):
+    """Testing the hashed vectorizer against the vocabulary one.
+    """
+
+    def setUp(self):
+        self.names = list(fetch_data_products()['Product Name'])
+        self.keywords = ['iphone', 'galaxy 64GB', 'apple phones', 'xx',
+                         'iphone 7 plus', '']
+
+    def test_same_similarities(self):
+        tfidf = TfidfVectorizer(ngram_range=(1, 4))
+        hashing = HashingTfidfVectorizer(ngram_range=(1, 4))
+        data_tfidf = tfidf.fit_transform(self.names)
+        data_hashing = hashing.fit_transform(self.names)
+        self.assertEqual(hashing.idf_.dtype, np.float32)
+        self.assertEqual(hashing.idf_.shape, (2**20,))
+        np.testing.assert_allclose(
+            data_hashing.dot(data_hashing.T).A,
+            data_tfidf.dot(data_tfidf.T).A, atol=1e-6)
+        np.testing.assert_allclose(
+            hashing.transform(self.keywords).dot(data_hashing.T).A,
+            tfidf.transform(self.keywords).dot(data_tfidf.T).A, atol=1e-6)
+
+    def test_create_main_vectorizer(self):
+        self.assertIsInstance(create_main_vectorizer('tfidf'),
+                              TfidfVectorizer)
+        vectorizer = create_main_vectorizer('hashing')
+        self.assertIsInstance(vectorizer, HashingTfidfVectorizer)
+        self.assertIs(create_main_vectorizer(vectorizer), vectorizer)
+        with self.assertRaises(AssertionError):
+            create_main_vectorizer(None)
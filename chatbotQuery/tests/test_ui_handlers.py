@@ -1,5 +1,6 @@
 
 import unittest
+import asyncio
 import sys
 import io
 import os
@@ -9,7 +10,10 @@ from unittest import mock
 from itertools import product
 
 from chatbotQuery import ChatbotMessage
-from chatbotQuery.ui import HandlerConvesationUI, TerminalUIHandler
+from chatbotQuery.ui import HandlerConvesationUI, TerminalUIHandler,\
+    SessionStore, HandlerConvesationDB
+from chatbotQuery.conversation import ConversationStateMachine
+from chatbotQuery.io import parse_configuration_file
 
 
 class StringIO(io.StringIO):
@@ -154,3 +158,116 @@ class Test_HandlerConvesationDB(unittest.TestCase):
         HandlerConvesationUI.\
             from_configuration_files(self.example_db_hand_yaml,
                                      self.example_yaml)
+
+    def test_sessions(self):
+        def texts(answer):
+            return [m['message'] for m in answer.get_all_messages()]
+        workers = [HandlerConvesationUI.
+                   from_configuration_files(self.example_db_hand_yaml,
+                                            self.example_yaml)
+                   for _ in range(2)]
+        ## Handler of the same machine which is never restored
+        reference = HandlerConvesationUI(
+            HandlerConvesationDB.from_file(self.example_db_hand_yaml),
+            workers[0].conversation_machine)
+        store = SessionStore()
+        workers[0].new_session(seed=0)
+        store.set('session', workers[0].snapshot())
+        reference.new_session(seed=0)
+        ## Turns of the session run alternately by the workers
+        messages = ['hello', 'iphone', 'yes', 'no', 'samsung', 'no', 'bye']
+        for i, message in enumerate(messages):
+            answer = workers[i % 2].\
+                get_session_message(store, 'session', {'message': message})
+            expected = reference.get_message({'message': message})
+            self.assertEqual(texts(answer), texts(expected))
+            ## The next message reflects the same last answer
+            worker = workers[(i+1) % 2]
+            worker.restore(store.get('session'))
+            reflected, expected = [h._reflection_information(
+                {'message': '', 'from': 'user'}, h.last_message)
+                for h in [worker, reference]]
+            self.assertEqual(set(reflected), set(expected))
+            for key in expected:
+                if key != 'query':
+                    self.assertEqual(reflected[key], expected[key])
+                elif expected[key] is None:
+                    self.assertIsNone(reflected[key])
+                else:
+                    self.assertEqual(reflected[key]['query_names'],
+                                     expected[key]['query_names'])
+                    self.assertEqual(reflected[key]['query_result'],
+                                     expected[key]['query_result'])
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get('session'), reference.snapshot())
+        ## Last answer with a query which is not the stored one
+        query = reference.handler_db.databases['db'].\
+            get_query_info(['samsung'])['query']
+        reference.last_message = dict(reference.last_message, query=query)
+        workers[0].restore(reference.snapshot())
+        self.assertEqual(workers[0].last_message['query']['query_names'],
+                         query['query_names'])
+        self.assertEqual(workers[0].handler_db.queriesDB[-1]['query']
+                         ['query_names'],
+                         reference.handler_db.queriesDB[-1]['query']
+                         ['query_names'])
+        ## Truncated or foreign sessions
+        blob, runtime = store.get('session'), reference.runtime
+        for wrong in [b'', blob[:6], blob[:-1], b'XXXX'+blob[4:],
+                      blob[:12]+blob[13:]+b'\x00']:
+            with self.assertRaises(ValueError):
+                reference.restore(wrong)
+        self.assertIs(reference.runtime, runtime)
+        ## Default runtime of the machines untouched
+        for worker in workers:
+            machine = worker.conversation_machine
+            self.assertEqual(machine.historyStates, [machine.currentState])
+
+    def test_async_conversations(self):
+        def texts(answer):
+            return [m['message'] for m in answer.get_all_messages()]
+        machine = ConversationStateMachine.\
+            from_parameters(parse_configuration_file(self.example_yaml))
+        machine.set_machine()
+        conversations = [['hello', 'iphone', 'yes', 'no'],
+                         ['hi', 'samsung', 'no', 'bye'],
+                         ['hello', 'apple', 'yes', 'iphone']]
+
+        def new_handler(seed):
+            handler_db = HandlerConvesationDB.from_file(
+                self.example_db_hand_yaml)
+            handler = HandlerConvesationUI(handler_db, machine)
+            handler.new_session(seed=seed)
+            return handler
+
+        ## Sequential conversations
+        expected = []
+        for seed, messages in enumerate(conversations):
+            handler = new_handler(seed)
+            expected.append([texts(handler.get_message({'message': m}))
+                             for m in messages])
+
+        ## Concurrent conversations sharing the machine
+        async def conversation(seed, messages):
+            handler = new_handler(seed)
+            answers = []
+            for m in messages:
+                answers.append(texts(await handler.aget_message(
+                    {'message': m})))
+            return answers
+
+        async def run_all():
+            return await asyncio.gather(*[conversation(seed, messages)
+                                          for seed, messages in
+                                          enumerate(conversations)])
+        self.assertEqual(asyncio.run(run_all()), expected)
+        self.assertEqual(machine.historyStates, [machine.currentState])
+
+        ## Concurrent turns of the same handler wait for each other
+        async def same_handler(seed, messages):
+            handler = new_handler(seed)
+            answers = await asyncio.gather(*[handler.aget_message(
+                {'message': m}) for m in messages])
+            return [texts(answer) for answer in answers]
+        self.assertEqual(asyncio.run(same_handler(0, conversations[0])),
+                         expected[0])
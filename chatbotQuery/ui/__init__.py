@@ -6,3 +6,4 @@
 from chatbotQuery.ui.db_handlers import ProfileUser, HandlerConvesationDB
 from chatbotQuery.ui.ui_handlers import HandlerConvesationUI,\
     FlaskUIHandler, TerminalUIHandler
+from chatbotQuery.ui.ui_sessions import SessionStore
@@ -1,11 +1,20 @@
 
 
 import time
+import json
+import struct
+import numpy as np
 from chatbotQuery.io import parse_configuration_file_db
 from chatbotQuery.dbapi import DataBaseAPI
+from chatbotQuery.dbapi.dbapi_registry import get_shared_database
+from chatbotQuery.dbapi.dbapi_memory import memory_report
 
 datetime_format = '%Y-%m-%d %H:%m:%S %z'
 
+## Status of the last query, number of keywords, length of the json
+QUERY_HEADER = struct.Struct('<BII')
+NO_QUERIES, NULL_QUERY, IDS_QUERY = 0, 1, 2
+
 
 class ProfileUser(object):
     """Profile user of the chatbot.
@@ -29,9 +38,13 @@ class HandlerConvesationDB(object):
     * Tracking the interaction
     * Store messages
 
+    The databases given by their parameters are taken from the process-wide
+    registry of shared `DataBaseAPI` unless `shared_databases` is False.
+
     """
 
-    def __init__(self, profile_user=None, logging_file=None, databases=None):
+    def __init__(self, profile_user=None, logging_file=None, databases=None,
+                 shared_databases=True):
         self.profile_user = ProfileUser(profile_user)
         self.messagesDB = []
         self.queriesDB = []
@@ -42,7 +55,10 @@ class HandlerConvesationDB(object):
             self.databases.update(databases)
             for d, v in self.databases.items():
                 if isinstance(v, dict):
-                    self.databases[d] = DataBaseAPI.from_parameters(v)
+                    if shared_databases:
+                        self.databases[d] = get_shared_database(v)
+                    else:
+                        self.databases[d] = DataBaseAPI.from_parameters(v)
 #                assert(isinstance(self.databases[d], DataBaseAPI))
         else:
             ## It should be DataBaseAPI object
@@ -135,6 +151,136 @@ class HandlerConvesationDB(object):
             i += 1
         return retrieved
 
+    def snapshot_query(self):
+        """Binary blob with the ids of the last stored query."""
+        if not len(self.queriesDB):
+            return QUERY_HEADER.pack(NO_QUERIES, 0, 0)
+        return pack_query(self.queriesDB[-1]['query'])
+
+    def restore_query(self, blob=None):
+        """Restart the tracking of the conversation from the last query
+        stored by `snapshot_query` (or from scratch if `blob` is None). The
+        query information is computed again from its ids.
+        """
+        if blob is not None:
+            status, query_info = self._unpack_query_info(blob)
+        self.messagesDB = []
+        self.queriesDB = []
+        if blob is None:
+            return
+        if status == NULL_QUERY:
+            self.queriesDB.append({'query': None})
+        elif status == IDS_QUERY:
+            if 'db' in self.databases:
+                query_info = self.databases['db'].\
+                    get_reflection_query(query_info)
+            query_info['time'] = time.strftime(datetime_format)
+            self.queriesDB.append(query_info)
+
+    def unpack_query(self, blob):
+        """Query of a blob built by `pack_query`, with its information
+        computed again from its ids (None if it is a null query).
+        """
+        status, query_info = self._unpack_query_info(blob)
+        if status == NO_QUERIES:
+            raise ValueError("Not a query blob.")
+        return None if query_info is None else query_info['query']
+
+    def _unpack_query_info(self, blob):
+        ## Status of the blob and information of its query
+        status, ids, info = unpack_query_ids(blob)
+        if status != IDS_QUERY:
+            return status, None
+        if 'db' in self.databases:
+            label = info['query_pars'].get('label', False)
+            query_info = self.databases['db'].\
+                get_query_info_from_ids(ids, label, info['query_result'])
+            query_info['query']['query_pars'] = info['query_pars']
+        else:
+            query_info = {'query': dict(query_idxs=ids, **info)}
+        return status, query_info
+
+    def memory_report(self):
+        """Bytes used by the stored messages and queries."""
+        return memory_report({'messagesDB': self.messagesDB,
+                              'queriesDB': self.queriesDB})
+
     def get_last_query(self):
         ## Temporal
         return {}
+
+
+def pack_query(query):
+    """Binary blob of the ids and parameters of a query (a null query if
+    it is None or it has no ids).
+    """
+    if (query is None) or (query.get('query_idxs') is None):
+        return QUERY_HEADER.pack(NULL_QUERY, 0, 0)
+    return pack_query_ids(query['query_idxs'],
+                          {'query_pars': query.get('query_pars', {}),
+                           'query_result': query.get('query_result', {})})
+
+
+def pack_query_ids(ids, info={}):
+    """Binary blob of the query ids: header, json of the category names and
+    the extra information `info`, lengths of the ids of every keyword and
+    variable and the ids as uint32.
+    """
+    cat_names = list(ids.get('cat_vars', {}).keys())
+    info = dict(info, cat_vars=cat_names)
+    info = json.dumps(info, default=json_default).encode('utf-8')
+    elements = list(ids['main_var'])
+    for c in cat_names:
+        elements += list(ids['cat_vars'][c])
+    lengths = np.array([len(e) for e in elements], dtype='<u4')
+    values = np.concatenate([np.asarray(e, dtype='<u4') for e in elements] +
+                            [np.array([], dtype='<u4')])
+    header = QUERY_HEADER.pack(IDS_QUERY, len(ids['main_var']), len(info))
+    return b''.join([header, info, lengths.tobytes(), values.tobytes()])
+
+
+def unpack_query_ids(blob):
+    """Status, ids and extra information of a blob built by
+    `pack_query_ids`. A blob which is not a query raises a ValueError.
+    """
+    if len(blob) < QUERY_HEADER.size:
+        raise ValueError("Not a query blob.")
+    status, n_keywords, n_info = QUERY_HEADER.unpack_from(blob)
+    if status not in [NO_QUERIES, NULL_QUERY, IDS_QUERY]:
+        raise ValueError("Not a query blob.")
+    if status != IDS_QUERY:
+        return status, None, {}
+    start = QUERY_HEADER.size
+    if len(blob) < start+n_info:
+        raise ValueError("Not a query blob.")
+    info = json.loads(blob[start:start+n_info].decode('utf-8'))
+    if not isinstance(info, dict) or\
+            not isinstance(info.get('cat_vars'), list):
+        raise ValueError("Not a query blob.")
+    cat_names = info.pop('cat_vars')
+    start += n_info
+    n_elements = n_keywords*(1+len(cat_names))
+    if len(blob) < start+4*n_elements:
+        raise ValueError("Not a query blob.")
+    lengths = np.frombuffer(blob, dtype='<u4', count=n_elements,
+                            offset=start)
+    start += lengths.nbytes
+    if len(blob) != start+4*int(lengths.sum()):
+        raise ValueError("Not a query blob.")
+    values = np.frombuffer(blob, dtype='<u4', count=int(lengths.sum()),
+                           offset=start).astype(np.int64)
+    elements = np.split(values, np.cumsum(lengths)[:-1])
+    main_var = np.empty(n_keywords, dtype=object)
+    for i in range(n_keywords):
+        main_var[i] = elements[i]
+    ids = {'main_var': main_var, 'cat_vars': {}}
+    for j, c in enumerate(cat_names):
+        ids['cat_vars'][c] = elements[n_keywords*(j+1):n_keywords*(j+2)]
+    return status, ids, info
+
+
+def json_default(value):
+    ## Numpy values of the query parameters
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError("Not serializable query information.")
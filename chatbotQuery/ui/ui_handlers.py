@@ -4,13 +4,28 @@
 """
 
 import time
+import json
+import struct
+import asyncio
+from contextlib import contextmanager
 from chatbotQuery import ChatbotMessage
 from chatbotQuery.io import parse_configuration_file,\
     parse_configuration_file_db
 from chatbotQuery.ui import HandlerConvesationDB
+from chatbotQuery.ui.db_handlers import pack_query, unpack_query_ids,\
+    json_default
 from chatbotQuery.conversation import ConversationStateMachine
+from chatbotQuery.conversation.conversation_runtime import bound_runtime
 from chatbotQuery.ui.flask_utils import run_flask_app_conversation
 
+## Magic, lengths of the runtime, query, last message and last message
+## query blobs of a session
+SESSION_HEADER = struct.Struct('<4sIIII')
+SESSION_MAGIC = b'CSS2'
+## Keys of the last message which are not reflected in the next one
+UNREFLECTED_KEYS = ['message', 'from', 'time', 'sending_status',
+                    'collection', 'query']
+
 
 class HandlerConvesationUI(object):
     """Object which manage the whole conversation interaction.
@@ -20,6 +35,15 @@ class HandlerConvesationUI(object):
     * Tracking and managing the interaction
     * Store messages
 
+    The conversation runs on the default runtime of the machine unless a
+    session is started (`new_session`) or restored (`restore`), so a
+    worker can serve many sessions with the same handler and machine.
+
+    A handler holds one conversation at a time (its session runtime, last
+    message and stored queries), so the asynchronous turns of a handler
+    run one after another. Concurrent conversations use one handler each,
+    which can share the machine.
+
     """
 
     def __init__(self, handler_db, conversation_machine):
@@ -28,6 +52,8 @@ class HandlerConvesationUI(object):
             conversation_machine.set_machine()
         self.conversation_machine = conversation_machine
         self.last_message = {'message': ''}
+        self.runtime = None
+        self._turn_loop, self._turn_lock = None, None
 
     @classmethod
     def from_parameters(cls, parameters_db, parameters_conv):
@@ -43,17 +69,164 @@ class HandlerConvesationUI(object):
         return cls.from_parameters(parameters_db, parameters_conv)
 
     def get_message(self, message):
-        if self.breaker(self.last_message):
-            return None
+        with self._session():
+            if self.breaker(self.last_message):
+                return None
+            message = self._message_in(message)
+            answer = self.conversation_machine.get_message(self.handler_db,
+                                                           message)
+            return self._answer_out(answer)
+
+    async def aget_message(self, message):
+        """Asynchronous `get_message`. The turns of the concurrent tasks
+        which share the handler wait for each other.
+        """
+        async with self._turns():
+            with self._session():
+                if self.breaker(self.last_message):
+                    return None
+                message = self._message_in(message)
+                answer = await self.conversation_machine.\
+                    aget_message(self.handler_db, message)
+                return self._answer_out(answer)
+
+    def _turns(self):
+        ## Lock of the turns in the running loop
+        loop = asyncio.get_running_loop()
+        if self._turn_loop is not loop:
+            self._turn_loop, self._turn_lock = loop, asyncio.Lock()
+        return self._turn_lock
+
+    def _message_in(self, message):
         message = self._format_message(message)
         self._reflection_information(message, self.last_message)
         self.handler_db.message_in(message)
-        answer = self.conversation_machine.get_message(self.handler_db,
-                                                       message)
+        return message
+
+    def _answer_out(self, answer):
         self.handler_db.store_query(answer)
         self.last_message = answer
         return answer
 
+    ################################ Sessions ################################
+    @contextmanager
+    def _session(self):
+        if self.runtime is None:
+            yield
+        else:
+            with self.conversation_machine.bind(self.runtime):
+                yield
+
+    def new_session(self, seed=None):
+        """Start a new conversation."""
+        self.runtime = self.conversation_machine.new_runtime(seed)
+        self.handler_db.restore_query()
+        self.last_message = {'message': ''}
+
+    def snapshot(self):
+        """Binary blob with the state of the current conversation: the
+        runtime of the machine, the ids of the last query and the parts of
+        the last answer reflected in the next message.
+        """
+        runtime = self.runtime
+        if runtime is None:
+            runtime = bound_runtime(self.conversation_machine)
+        runtime = runtime.snapshot()
+        query = self.handler_db.snapshot_query()
+        message, message_query = self._snapshot_last_message(query)
+        return b''.join([SESSION_HEADER.pack(SESSION_MAGIC, len(runtime),
+                                             len(query), len(message),
+                                             len(message_query)),
+                         runtime, query, message, message_query])
+
+    def _snapshot_last_message(self, query):
+        ## Json of the reflected keys of the last answer and blob of its
+        ## query (empty if it is the last stored query)
+        if self.last_message is None:
+            return b'null', b''
+        last = dict([(k, v) for k, v in self.last_message.items()
+                     if k not in UNREFLECTED_KEYS])
+        message = {'keys': last, 'has_message': 'message' in
+                   self.last_message, 'query': 'absent'}
+        message_query = b''
+        if 'query' in self.last_message:
+            message_query = pack_query(self.last_message['query'])
+            message['query'] = 'blob'
+            if message_query == query:
+                message['query'], message_query = 'last', b''
+        message = json.dumps(message, default=json_default).encode('utf-8')
+        return message, message_query
+
+    def _load_last_message(self, message, message_query):
+        ## Reflected keys of the last answer and the source of its query,
+        ## validated before the session is restored
+        try:
+            message = json.loads(message.decode('utf-8'))
+        except ValueError:
+            raise ValueError("Not a conversation session.")
+        if message is None:
+            return None
+        if not isinstance(message, dict) or\
+                not isinstance(message.get('keys'), dict) or\
+                (message.get('query') not in ['absent', 'last', 'blob']):
+            raise ValueError("Not a conversation session.")
+        if message['query'] == 'blob':
+            unpack_query_ids(message_query)
+        return message
+
+    def _restore_last_message(self, message, message_query):
+        ## Last answer with the keys reflected in the next message
+        if message is None:
+            return None
+        last_message = dict(message['keys'])
+        if message.get('has_message', True):
+            last_message['message'] = ''
+        if message['query'] == 'last':
+            last_message['query'] = self.handler_db.queriesDB[-1]['query']
+        elif message['query'] == 'blob':
+            last_message['query'] = self.handler_db.unpack_query(
+                message_query)
+        return last_message
+
+    def restore(self, blob):
+        """Continue the conversation stored by `snapshot`. The log of the
+        messages of the handler DB is not part of the session. A blob
+        which is not a session raises a ValueError.
+        """
+        if len(blob) < SESSION_HEADER.size:
+            raise ValueError("Not a conversation session.")
+        magic, n_runtime, n_query, n_message, n_message_query =\
+            SESSION_HEADER.unpack_from(blob)
+        start = SESSION_HEADER.size
+        if (magic != SESSION_MAGIC) or (len(blob) != start+n_runtime +
+                                        n_query+n_message+n_message_query):
+            raise ValueError("Not a conversation session.")
+        runtime = self.conversation_machine.\
+            restore_runtime(blob[start:start+n_runtime])
+        start += n_runtime
+        query = blob[start:start+n_query]
+        start += n_query
+        message_query = blob[start+n_message:]
+        message = self._load_last_message(blob[start:start+n_message],
+                                          message_query)
+        self.handler_db.restore_query(query)
+        self.last_message = self._restore_last_message(message,
+                                                       message_query)
+        self.runtime = runtime
+
+    def get_session_message(self, store, session_id, message):
+        """Run a turn of the conversation `session_id` of the session
+        store (started if it is not stored) and store it back.
+        """
+        blob = store.get(session_id)
+        if blob is None:
+            self.new_session()
+        else:
+            self.restore(blob)
+        answer = self.get_message(message)
+        store.set(session_id, self.snapshot())
+        return answer
+
     def run_alternative(self, message={}):
         while True:
             answer = self.get_message(message)
@@ -0,0 +1,42 @@
+"""
+UI sessions
+-----------
+Storage of the conversation sessions between turns, so every turn can be
+run by any worker sharing the same machine definition.
+
+"""
+
+import threading
+
+
+class SessionStore(object):
+    """In-memory key-value store of the session blobs (stand-in for an
+    external key-value storage).
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def set(self, session_id, blob):
+        assert(isinstance(blob, bytes))
+        with self._lock:
+            self._sessions[session_id] = blob
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    @property
+    def nbytes(self):
+        return sum([len(b) for b in self._sessions.values()])
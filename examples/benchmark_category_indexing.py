@@ -0,0 +1,51 @@
+"""
+Benchmark category indexing
+---------------------------
+Startup time of the indexing of the category columns of `DataBaseAPI`:
+boolean scans of the column for each one of its values against the grouping
+in a single pass of `group_rows`.
+
+How to run the benchmark:
+
+    python benchmark_category_indexing.py [n_rows] [n_values]
+
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from chatbotQuery.dbapi.dbapi_category_index import group_rows
+
+
+def boolean_scans(column):
+    ## Previous indexing: one scan of the column for each value
+    categories = list(column.unique())
+    dummy_idxs = np.arange(column.shape[0])
+    cats_ids = dict([(v, dummy_idxs[np.array(column == v)])
+                     for v in categories])
+    return categories, cats_ids
+
+
+def timing(f, column):
+    t0 = time.perf_counter()
+    result = f(column)
+    return time.perf_counter()-t0, result
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_values = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    random_state = np.random.RandomState(0)
+    column = pd.Series(['brand_%d' % v for v in
+                        random_state.zipf(1.5, n_rows) % n_values])
+
+    t_scans, (categories, cats_ids) = timing(boolean_scans, column)
+    t_group, (categories_g, cats_ids_g, _) = timing(group_rows, column)
+    assert(categories == categories_g)
+    assert(all([np.array_equal(cats_ids[v], cats_ids_g[v])
+                for v in categories]))
+    print("%d rows, %d values" % (n_rows, len(categories)))
+    print("Boolean scans: %.3fs" % t_scans)
+    print("Single pass:   %.3fs (x%.1f)" % (t_group, t_scans/t_group))
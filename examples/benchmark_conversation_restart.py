@@ -0,0 +1,74 @@
+"""
+Benchmark conversation restart
+------------------------------
+Cost of `ConversationStateMachine.restart` as the machine grows: the reset
+of the per-session fields from the initial runtime against the previous
+restart, which set the machine again and rebuilt the components of every
+state.
+
+How to run the benchmark:
+
+    python benchmark_conversation_restart.py [n_repeats]
+
+"""
+
+import sys
+import time
+
+from chatbotQuery.conversation import ConversationStateMachine,\
+    GeneralConversationState, TransitionConversationStates, BaseDetector,\
+    BaseChooser, BaseQuerier
+
+
+def chain_machine(n_machines, n_states):
+    ## Chain of nested machines with a chain of states each
+    machines = []
+    for i in range(n_machines):
+        states = []
+        for j in range(n_states):
+            transition = None
+            if j < n_states-1:
+                transition = ('state_%d' % (j+1), lambda m: 0)
+            states.append(GeneralConversationState(
+                'state_%d' % j, chooser=[{'message': 'message %d' % j}],
+                transition=transition, asker=bool(j % 2)))
+        transition = None
+        if i < n_machines-1:
+            transition = ('machine_%d' % (i+1), lambda m: 0)
+        machines.append(ConversationStateMachine(
+            'machine_%d' % i, states, 'state_0', 'state_%d' % (n_states-1),
+            transition=transition))
+    machine = ConversationStateMachine('conversation', machines, 'machine_0',
+                                       'machine_%d' % (n_machines-1))
+    machine.set_machine()
+    return machine
+
+
+def rebuild_restart(machine):
+    ## Previous restart (from the initial components of each state)
+    machine.set_machine()
+    for state in machine.flat_states:
+        state.transition = TransitionConversationStates.\
+            from_transition_info(state.transition)
+        state.detector = BaseDetector.from_detector_info(state.detector)
+        state.chooser = BaseChooser.from_chooser_info(state.chooser)
+        state.querier = BaseQuerier.from_querier_info(state.querier)
+
+
+def timing(f, machine, n_repeats):
+    t0 = time.perf_counter()
+    for _ in range(n_repeats):
+        f(machine)
+    return (time.perf_counter()-t0)/n_repeats
+
+
+if __name__ == "__main__":
+    n_repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print("%8s %14s %14s" % ('states', 'rebuild (us)', 'restart (us)'))
+    for n_machines in [1, 4, 16, 64]:
+        machine = chain_machine(n_machines, 8)
+        t_rebuild = timing(rebuild_restart, machine, n_repeats)
+        machine = chain_machine(n_machines, 8)
+        t_restart = timing(lambda m: m.restart(), machine, n_repeats)
+        print("%8d %14.1f %14.1f" % (len(machine.states_table),
+                                     t_rebuild*1e6, t_restart*1e6))
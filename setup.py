@@ -84,4 +84,5 @@ setup(name=release.name,
       long_description=read('README.md'),
       packages=packages,
       install_requires=install_requires,
+      python_requires='>=3.8',
       )